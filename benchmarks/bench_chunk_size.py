@@ -0,0 +1,64 @@
+"""
+    Compare fixed and adaptive chunk sizes for single-stream downloads of several file
+    sizes, against a local fake Drive server with per-request latency and a bandwidth cap.
+
+    python3 benchmarks/bench_chunk_size.py --sizes 1 16 64 --bandwidth 64 --latency 20
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils.fake_drive_server import FakeDriveServer
+from download_files_gdrive import GoogleDriveDownloader
+
+KIB = 1024
+MIB = 1024 * KIB
+
+# (label, chunk size, adaptive)
+CONFIGS = [
+    ('256 KiB', 256 * KIB, False),
+    ('1 MiB', 1 * MIB, False),
+    ('8 MiB', 8 * MIB, False),
+    ('adaptive', 256 * KIB, True),
+]
+
+
+def run_once(server, cred_file, file_id, destination, chunk_size, adaptive, write_buffer):
+    downloader = GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint, chunk_size=chunk_size,
+                                       adaptive_chunks=adaptive, write_buffer=write_buffer)
+    start = time.perf_counter()
+    downloader.download_file(file_id, destination)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark fixed vs adaptive chunk sizes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 16, 64], help='File sizes in MiB')
+    parser.add_argument('--bandwidth', type=float, default=64, help='Per-connection bandwidth cap in MiB/s')
+    parser.add_argument('--latency', type=float, default=20, help='Delay before each media response in ms')
+    parser.add_argument('--write-buffer', type=int, default=0, help='Write buffer in KiB (0 = unbuffered)')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with FakeDriveServer(bandwidth=args.bandwidth * MIB, latency=args.latency / 1000) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        cred_file = server.write_credentials(os.path.join(tmp, 'cred.json'))
+        destination = os.path.join(tmp, 'bench.bin')
+
+        print(f"{'size MiB':>9} {'chunks':>10} {'seconds':>8} {'MiB/s':>8} {'requests':>9}")
+        for size in args.sizes:
+            file_id = f"bench{size}"
+            server.add_file(file_id, os.urandom(size * MIB))
+            for label, chunk_size, adaptive in CONFIGS:
+                server.requests.clear()
+                elapsed = run_once(server, cred_file, file_id, destination, chunk_size, adaptive,
+                                   args.write_buffer * KIB)
+                requests = len(server.media_requests(file_id))
+                print(f"{size:>9} {label:>10} {elapsed:>8.2f} {size / elapsed:>8.1f} {requests:>9}")
@@ -0,0 +1,98 @@
+"""
+    Peak memory of concurrent downloads against the offline fake Drive server, for every
+    combination of file size and concurrency. Each combination runs in a fresh process;
+    with responses streamed through the BufferPool the peak RSS should stay flat however
+    large the files, chunks and worker counts get.
+
+    python3 benchmarks/bench_memory.py --sizes 16 64 256 --concurrency 1 4 16
+    python3 benchmarks/bench_memory.py --quick --max-growth 32
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from utils.fake_drive_server import FakeDriveServer, SyntheticContent
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import BatchDownloader
+from buffer_pool import BufferPool, DEFAULT_MEMORY_BUDGET
+from drive_service import TOKEN_CACHE_ENV
+from bench_suite import peak_rss_mib, MIB
+
+MODES = ('chunks', 'ranged')
+# Small enough to finish in seconds, e.g. as a smoke test in CI
+QUICK = {'sizes': [1, 8], 'concurrency': [1, 4], 'memory_budget': 8}
+
+
+def run_case(size, concurrency, options):
+    """
+    Download concurrency files of size MiB at once in a fresh process.
+
+    :return: Dict with the seconds taken, the peak RSS and how often a worker waited for a buffer.
+    """
+    logging.getLogger().setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ[TOKEN_CACHE_ENV] = os.path.join(tmp, 'tokens')
+        with FakeDriveServer() as server:
+            for i in range(concurrency):
+                server.add_file(f"file{i}", SyntheticContent(size * MIB, seed=i))
+            cred_file = server.write_credentials(os.path.join(tmp, 'cred.json'))
+            pool = BufferPool(budget=options['memory_budget'] * MIB)
+            ranged = options['mode'] == 'ranged'
+            # One chunk or part per file is the worst case for memory: a whole file per request
+            downloader = GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint, retry_delay=0.01,
+                                               chunk_size=size * MIB, part_size=max(1, size // 4) * MIB,
+                                               workers=4 if ranged else 1, buffer_pool=pool)
+            batch = BatchDownloader(downloader, workers=concurrency)
+            start = time.perf_counter()
+            batch.run((f"file{i}", os.path.join(tmp, f"file{i}.bin")) for i in range(concurrency))
+            seconds = time.perf_counter() - start
+    return {'size_mib': size, 'concurrency': concurrency, 'failed': batch.summary['failed'],
+            'seconds': round(seconds, 3), 'peak_rss_mib': round(peak_rss_mib(), 1), 'buffer_waits': pool.waits}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure peak memory as file size and concurrency grow')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256], help='File sizes in MiB')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='Files downloaded at once')
+    parser.add_argument('--mode', choices=MODES, default='chunks',
+                        help='Single stream of one chunk per file, or 4 ranged parts per file')
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET // MIB,
+                        help='Budget of the buffer pool in MiB')
+    parser.add_argument('--quick', action='store_true', help='Use small sizes, e.g. for a smoke test')
+    parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+    parser.add_argument('--max-growth', type=float,
+                        help='Exit with 1 when the peak RSS of any case exceeds the smallest one by more MiB')
+    args = parser.parse_args()
+    if args.quick:
+        for key, value in QUICK.items():
+            setattr(args, key, value)
+    options = {'mode': args.mode, 'memory_budget': args.memory_budget}
+
+    results = []
+    print(f"{'MiB':>6} {'workers':>8} {'seconds':>8} {'RSS MiB':>8} {'waits':>6} {'failed':>7}")
+    for size in args.sizes:
+        for concurrency in args.concurrency:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_case, size, concurrency, options).result()
+            results.append(result)
+            print(f"{size:>6} {concurrency:>8} {result['seconds']:>8.2f} {result['peak_rss_mib']:>8.1f} "
+                  f"{result['buffer_waits']:>6} {result['failed']:>7}")
+
+    peaks = [result['peak_rss_mib'] for result in results]
+    growth = round(max(peaks) - min(peaks), 1)
+    print(f"Peak RSS grew by {growth} MiB across all cases.")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': options, 'growth_mib': growth, 'results': results}, f, indent=2)
+    failed = any(result['failed'] for result in results)
+    sys.exit(1 if failed or (args.max_growth is not None and growth > args.max_growth) else 0)
@@ -0,0 +1,49 @@
+"""
+    Compare the single-stream download path with the parallel ranged path
+    against a local fake Drive server that caps bandwidth per connection.
+
+    python3 benchmarks/bench_ranged_download.py --size 64 --bandwidth 16 --workers 1 2 4 8
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils.fake_drive_server import FakeDriveServer
+from download_files_gdrive import GoogleDriveDownloader
+
+MIB = 1024 * 1024
+
+
+def run_once(server, cred_file, destination, workers, part_size):
+    downloader = GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint,
+                                       workers=workers, part_size=part_size)
+    start = time.perf_counter()
+    downloader.download_file('bench', destination)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark single-stream vs parallel ranged downloads')
+    parser.add_argument('--size', type=int, default=64, help='File size in MiB')
+    parser.add_argument('--bandwidth', type=float, default=16, help='Per-connection bandwidth cap in MiB/s')
+    parser.add_argument('--part-size', type=int, default=8, help='Part size in MiB for the ranged path')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to compare')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with FakeDriveServer(bandwidth=args.bandwidth * MIB) as server, tempfile.TemporaryDirectory() as tmp:
+        server.add_file('bench', os.urandom(args.size * MIB))
+        cred_file = server.write_credentials(os.path.join(tmp, 'cred.json'))
+        destination = os.path.join(tmp, 'bench.bin')
+
+        print(f"{'workers':>8} {'seconds':>8} {'MiB/s':>8}")
+        for workers in args.workers:
+            elapsed = run_once(server, cred_file, destination, workers, args.part_size * MIB)
+            print(f"{workers:>8} {elapsed:>8.2f} {args.size / elapsed:>8.1f}")
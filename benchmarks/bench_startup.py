@@ -0,0 +1,74 @@
+"""
+    Measure how long the download CLI takes from process start to exit, for --help,
+    an argument error, and a small download with cold and warm token/metadata caches,
+    against a local fake Drive server.
+
+    python3 benchmarks/bench_startup.py --runs 5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from utils.fake_drive_server import FakeDriveServer
+from drive_service import TOKEN_CACHE_ENV
+
+CLI = os.path.join(ROOT, 'src', 'download_files_gdrive.py')
+
+
+def time_command(args, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, CLI] + args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def measure(args, env, runs, reset=None):
+    timings = []
+    for _ in range(runs):
+        if reset:
+            reset()
+        timings.append(time_command(args, env))
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark CLI startup on the cold and warm paths')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per scenario; the median is reported')
+    args = parser.parse_args()
+
+    with FakeDriveServer() as server, tempfile.TemporaryDirectory() as tmp:
+        server.add_file('bench', os.urandom(1024))
+        cred_file = server.write_credentials(os.path.join(tmp, 'cred.json'))
+        token_dir = os.path.join(tmp, 'tokens')
+        metadata_cache = os.path.join(tmp, 'metadata.sqlite')
+        env = dict(os.environ, **{TOKEN_CACHE_ENV: token_dir})
+        download = ['bench', os.path.join(tmp, 'bench.bin'), '--credentials', cred_file,
+                    '--api-endpoint', server.api_endpoint, '--metadata-cache', metadata_cache]
+
+        def clear_caches():
+            shutil.rmtree(token_dir, ignore_errors=True)
+            if os.path.exists(metadata_cache):
+                os.remove(metadata_cache)
+
+        scenarios = [
+            ('--help', measure(['--help'], env, args.runs)),
+            ('argument error', measure([], env, args.runs)),
+            ('download, cold caches', measure(download, env, args.runs, reset=clear_caches)),
+            ('download, warm caches', measure(download, env, args.runs)),
+        ]
+        server.requests.clear()
+        time_command(download, env)
+        warm_requests = len(server.requests)
+
+        print(f"{'scenario':<24} {'ms':>8}")
+        for name, seconds in scenarios:
+            print(f"{name:<24} {seconds * 1000:>8.1f}")
+        print(f"requests made by a warm download: {warm_requests}")
@@ -0,0 +1,230 @@
+"""
+    Reproducible benchmark suite against the offline fake Drive server: a single large
+    file, many small files, a folder walk, and a download resumed after dropped
+    connections. Each scenario runs in a fresh process and reports throughput, p50/p99
+    latency and peak RSS; results can be saved and compared with an earlier run.
+
+    python3 benchmarks/bench_suite.py --output results.json
+    python3 benchmarks/bench_suite.py --baseline results.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import math
+import time
+import logging
+import platform
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from utils.fake_drive_server import FakeDriveServer, SyntheticContent
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import BatchDownloader
+from mirror_folder import FolderWalker
+from metadata_cache import shared_cache
+from drive_service import TOKEN_CACHE_ENV
+
+KIB = 1024
+MIB = 1024 * KIB
+SCENARIOS = ('large_file', 'small_files', 'folder_walk', 'resume')
+# Small enough to finish in seconds, e.g. as a smoke test in CI
+QUICK = {'size': 8, 'files': 50, 'file_size': 4, 'folders': 4, 'files_per_folder': 50, 'repeat': 1}
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of samples, or 0.0 for no samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / MIB if sys.platform == 'darwin' else peak / KIB
+
+
+def large_file(server, cred_file, tmp, options):
+    server.add_file('large', SyntheticContent(options['size'] * MIB, seed=options['seed']))
+    downloader = GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint, workers=options['workers'],
+                                       retry_delay=0.01)
+    destination = os.path.join(tmp, 'large.bin')
+    samples = []
+    for _ in range(options['repeat']):
+        shared_cache.clear()
+        if os.path.exists(destination):
+            os.remove(destination)
+        start = time.perf_counter()
+        downloader.download_file('large', destination)
+        samples.append(time.perf_counter() - start)
+    return {'files': options['repeat'], 'bytes': options['size'] * MIB * options['repeat'],
+            'failed': 0, 'samples': samples, 'seconds': sum(samples)}
+
+
+def small_files(server, cred_file, tmp, options):
+    for i in range(options['files']):
+        server.add_file(f"small{i}", SyntheticContent(options['file_size'] * KIB, seed=options['seed'] + i))
+    samples, totals = [], {'files': 0, 'failed': 0, 'bytes': 0, 'seconds': 0.0}
+    for repeat in range(options['repeat']):
+        shared_cache.clear()
+        directory = os.path.join(tmp, f"small{repeat}")
+        os.makedirs(directory)
+        batch = BatchDownloader(GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint, retry_delay=0.01),
+                                workers=options['batch_workers'])
+        results = batch.run((f"small{i}", os.path.join(directory, f"small{i}.bin")) for i in range(options['files']))
+        # Latency of every single file, from the start of its download to its result
+        samples += [result['seconds'] for result in results]
+        for key in ('files', 'failed', 'bytes', 'seconds'):
+            totals[key] += batch.summary[key]
+    return dict(totals, samples=samples)
+
+
+def folder_walk(server, cred_file, tmp, options):
+    server.add_folder('root', 'root')
+    for folder in range(options['folders']):
+        server.add_folder(f"folder{folder}", f"folder{folder}", parents=['root'])
+        for i in range(options['files_per_folder']):
+            server.add_file(f"f{folder}-{i}", b'', name=f"file{i}.bin", parents=[f"folder{folder}"])
+    downloader = GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint)
+    samples, files = [], 0
+    for repeat in range(options['repeat']):
+        walker = FolderWalker(downloader, workers=options['list_workers'])
+        start = time.perf_counter()
+        files += sum(1 for _ in walker.walk('root', os.path.join(tmp, f"walk{repeat}")))
+        samples.append(time.perf_counter() - start)
+    return {'files': files, 'bytes': 0, 'failed': 0, 'samples': samples, 'seconds': sum(samples)}
+
+
+def resume(server, cred_file, tmp, options):
+    size = options['size'] * MIB
+    drops = options['drops']
+    server.add_file('resume', SyntheticContent(size, seed=options['seed']))
+    # A single stream, so every drop is resumed from the part journal
+    downloader = GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint, retries=drops + 2,
+                                       retry_delay=0.01)
+    destination = os.path.join(tmp, 'resume.bin')
+    samples = []
+    for _ in range(options['repeat']):
+        shared_cache.clear()
+        if os.path.exists(destination):
+            os.remove(destination)
+        server.inject_fault(drop_after=size // (drops + 1), count=drops)
+        start = time.perf_counter()
+        downloader.download_file('resume', destination)
+        samples.append(time.perf_counter() - start)
+    return {'files': options['repeat'], 'bytes': size * options['repeat'], 'failed': 0,
+            'samples': samples, 'seconds': sum(samples)}
+
+
+def run_scenario(name, options):
+    """
+    Run one scenario against a fresh fake Drive server; called in its own process so the
+    peak RSS belongs to that scenario alone.
+
+    :return: Raw measurements: files, bytes, failed, seconds, latency samples and peak RSS.
+    """
+    # Retries of injected failures are expected, not worth a warning each
+    logging.getLogger().setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ[TOKEN_CACHE_ENV] = os.path.join(tmp, 'tokens')
+        with FakeDriveServer(bandwidth=options['bandwidth'] * MIB if options['bandwidth'] else None,
+                             latency=options['latency'] / 1000, api_latency=options['api_latency'] / 1000,
+                             error_rate=options['error_rate'], seed=options['seed']) as server:
+            cred_file = server.write_credentials(os.path.join(tmp, 'cred.json'))
+            measured = globals()[name](server, cred_file, tmp, options)
+    return dict(measured, peak_rss_mib=round(peak_rss_mib(), 1))
+
+
+def report(measured):
+    """Turn the raw measurements of a scenario into its reported figures."""
+    seconds = measured['seconds']
+    return {
+        'files': measured['files'],
+        'failed': measured['failed'],
+        'seconds': round(seconds, 3),
+        'mib_per_second': round(measured['bytes'] / MIB / seconds, 2) if seconds else 0.0,
+        'files_per_second': round(measured['files'] / seconds, 2) if seconds else 0.0,
+        'p50_ms': round(percentile(measured['samples'], 50) * 1000, 2),
+        'p99_ms': round(percentile(measured['samples'], 99) * 1000, 2),
+        'peak_rss_mib': measured['peak_rss_mib'],
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Compare results with a baseline run of the same scenarios.
+
+    :return: List of messages, one for every figure worse than the baseline by more than tolerance.
+    """
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        throughput = 'mib_per_second' if before['mib_per_second'] else 'files_per_second'
+        if result[throughput] < before[throughput] * (1 - tolerance):
+            found.append(f"{name}: {throughput} {result[throughput]} < {before[throughput]}")
+        for key in ('p99_ms', 'peak_rss_mib'):
+            if before[key] and result[key] > before[key] * (1 + tolerance):
+                found.append(f"{name}: {key} {result[key]} > {before[key]}")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the downloaders against an offline fake Drive server')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS), help='Scenarios to run')
+    parser.add_argument('--size', type=int, default=256, help='Size of the large and resumed files in MiB')
+    parser.add_argument('--workers', type=int, default=4, help='Ranged download workers for the large file')
+    parser.add_argument('--files', type=int, default=1000, help='Number of small files')
+    parser.add_argument('--file-size', type=int, default=16, help='Size of each small file in KiB')
+    parser.add_argument('--batch-workers', type=int, default=16, help='Batch workers for the small files')
+    parser.add_argument('--folders', type=int, default=20, help='Number of folders in the walked tree')
+    parser.add_argument('--files-per-folder', type=int, default=500, help='Files in each walked folder')
+    parser.add_argument('--list-workers', type=int, default=4, help='Folders listed concurrently')
+    parser.add_argument('--drops', type=int, default=3, help='Connections dropped while downloading the resumed file')
+    parser.add_argument('--bandwidth', type=float, default=200, help='Per-connection bandwidth cap in MiB/s (0 for none)')
+    parser.add_argument('--latency', type=float, default=20, help='Delay before each media response in ms')
+    parser.add_argument('--api-latency', type=float, default=10, help='Delay before each metadata/list response in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of media responses failing with 503')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the file contents and injected errors')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each scenario')
+    parser.add_argument('--quick', action='store_true', help='Use small sizes, e.g. for a smoke test')
+    parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, help='Compare with the results of an earlier --output')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed regression against --baseline, as a fraction (default 0.2)')
+    args = parser.parse_args()
+    if args.quick:
+        for key, value in QUICK.items():
+            setattr(args, key, value)
+    options = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'tolerance')}
+
+    results = {}
+    print(f"{'scenario':>12} {'seconds':>8} {'MiB/s':>8} {'files/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'RSS MiB':>8} {'failed':>7}")
+    for name in args.scenarios:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            result = results[name] = report(pool.submit(run_scenario, name, options).result())
+        print(f"{name:>12} {result['seconds']:>8.2f} {result['mib_per_second']:>8.1f} "
+              f"{result['files_per_second']:>9.1f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['peak_rss_mib']:>8.1f} {result['failed']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                                       'cpus': os.cpu_count()},
+                       'options': options, 'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f)['results'], args.tolerance)
+        for message in found:
+            print(f"Regression: {message}")
+        sys.exit(1 if found else 0)
@@ -1,4 +1,36 @@
-import pytest, json, os
+import pytest, json, os, sys
+
+# Make the modules under src/ importable the same way the scripts import each other
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from utils.fake_drive_server import FakeDriveServer
+from metadata_cache import shared_cache
+from drive_service import TOKEN_CACHE_ENV
+from download_files_gdrive import GoogleDriveDownloader
+
+# Request size of the downloaders built by make_downloader, so small test files span several chunks
+CHUNK = 64 * 1024
+
+
+def make_downloader(fake_drive, fake_cred_file, **kwargs):
+    """GoogleDriveDownloader against the fake server, with small chunks and short retry delays."""
+    kwargs.setdefault('chunk_size', CHUNK)
+    kwargs.setdefault('retry_delay', 0.01)
+    return GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, **kwargs)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def token_cache_dir(tmp_path_factory)->str:
+    # Tokens minted during the tests are shared with the CLI subprocesses but kept out of the user's cache
+    directory = str(tmp_path_factory.mktemp('tokens'))
+    os.environ[TOKEN_CACHE_ENV] = directory
+    yield directory
+    os.environ.pop(TOKEN_CACHE_ENV, None)
 
 @pytest.fixture(scope="module", autouse=True)
 def test_data_dict()->dict:
@@ -15,4 +47,15 @@ def cred_file()->str:
 
 @pytest.fixture(scope="module", autouse=True)
 def invalid_cred_file()->str:
-    return os.path.join('config','invalid_cred.json')
\ No newline at end of file
+    return os.path.join('config','invalid_cred.json')
+
+@pytest.fixture
+def fake_drive():
+    # File IDs are reused between tests, so cached metadata must not leak across servers
+    shared_cache.clear()
+    with FakeDriveServer() as server:
+        yield server
+
+@pytest.fixture
+def fake_cred_file(fake_drive, tmp_path)->str:
+    return fake_drive.write_credentials(str(tmp_path / 'fake_cred.json'))
\ No newline at end of file
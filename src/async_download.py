@@ -0,0 +1,603 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from urllib.parse import quote, urlencode, urljoin
+from async_http import AsyncHTTPPool, DEFAULT_POOL_SIZE
+from download_metrics import DownloadMetrics, DEFAULT_PROGRESS_INTERVAL
+from metadata_cache import METADATA_FIELDS, shared_cache
+from download_files_gdrive import DEFAULT_RETRIES
+from http_pool import REDIRECT_STATUSES
+from export_formats import DEFAULT_API_ENDPOINT, GOOGLE_APPS_PREFIX, UnsupportedExportError, \
+    select_export_formats, export_paths, export_url
+from stream_sink import AsyncSink, is_sink, open_sink, sink_name, media_url
+from rate_limit import is_rate_limited, retry_after_seconds
+from atomic_write import destination_lock, part_path, preallocate, commit, file_identity, finished_elsewhere
+from blob_cache import blob_key
+# googleapiclient and google.auth are only needed for errors and token refreshes and are
+# imported where they are used, as in download_files_gdrive
+
+logger = logging.getLogger()
+
+# Downloads in flight at once; most of them wait on the network, not on the disk
+DEFAULT_CONCURRENCY = 200
+# Bytes read from the network but not yet written, across every download in flight
+DEFAULT_INFLIGHT_BYTES = 64 * 1024 * 1024
+DEFAULT_READ_SIZE = 256 * 1024
+# The part journal of a binary download is updated every this many bytes
+JOURNAL_INTERVAL = 8 * 1024 * 1024
+
+
+class ByteBudget:
+    """
+    Shared limit on bytes held in memory. A reservation waits until it fits, so a slow
+    disk pushes back on the network reads instead of letting buffers grow.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes):
+        nbytes = min(nbytes, self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + nbytes <= self.limit)
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.used -= nbytes
+                self._condition.notify_all()
+
+
+class AsyncDriveDownloader:
+    """
+    asyncio counterpart of GoogleDriveDownloader for workloads of many files.
+
+    Requests go through one AsyncHTTPPool of keep-alive connections, so hundreds of small
+    downloads can be in flight on a single thread without a TCP and TLS handshake each.
+    download_file() behaves like GoogleDriveDownloader.download_file(): binary files are
+    resumed from the part journal, retried with backoff and verified against Drive's
+    checksums; Google Docs Editors files are exported. Disk writes and hashing run on the
+    default executor, bounded by a ByteBudget shared by all downloads.
+
+    The pool belongs to the event loop it was first used on: use the downloader as an
+    async context manager, or through the synchronous download() and run() wrappers.
+    """
+
+    def __init__(self, credentials_file, api_endpoint=None, concurrency=DEFAULT_CONCURRENCY,
+                 pool_size=DEFAULT_POOL_SIZE, max_inflight_bytes=DEFAULT_INFLIGHT_BYTES,
+                 read_size=DEFAULT_READ_SIZE, retries=DEFAULT_RETRIES, retry_delay=1.0, credentials=None,
+                 metadata_cache=None, verify=True, sha256=False, metrics_hooks=None,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL, fsync=False, scheduler=None, wait_for_lock=True,
+                 blob_cache=None, export_formats=None):
+        self.credentials_file = credentials_file
+        self.api_endpoint = (api_endpoint or DEFAULT_API_ENDPOINT).rstrip('/') + '/'
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.max_inflight_bytes = max_inflight_bytes
+        self.read_size = read_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.metadata_cache = metadata_cache or shared_cache
+        self.verify = verify
+        self.sha256 = sha256
+        self.metrics_hooks = list(metrics_hooks or [])
+        self.progress_interval = progress_interval
+        self.fsync = fsync
+        self.wait_for_lock = wait_for_lock
+        self.blob_cache = blob_cache
+        self.export_formats = export_formats
+        self.summary = None
+        self.credentials = credentials or self.load_credentials()
+        # Requests and bytes are paced by the same RequestScheduler as the threaded backend
+        from drive_service import shared_scheduler, scheduler_key
+        self.scheduler = scheduler or shared_scheduler()
+        self._scheduler_key = scheduler_key(self.credentials)
+        self.pool = None
+        self.budget = None
+        self._token_lock = None
+
+    def load_credentials(self):
+        try:
+            from drive_service import load_credentials
+            return load_credentials(self.credentials_file)
+        except Exception as e:
+            logger.error(f"Failed to authenticate Google Drive: {e}")
+            sys.exit(-1)
+
+    def _start(self):
+        if self.pool is None:
+            self.pool = AsyncHTTPPool(self.pool_size)
+            self.budget = ByteBudget(self.max_inflight_bytes)
+            self._token_lock = asyncio.Lock()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def __aenter__(self):
+        self._start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _refresh_credentials(self):
+        from drive_service import auth_request
+        self.credentials.refresh(auth_request())
+
+    async def _authorize(self, rejected=None):
+        """
+        Return a valid access token, refreshing it (once for all waiting downloads) when it
+        has expired or is the token the server just rejected.
+        """
+        self._start()
+        async with self._token_lock:
+            if not self.credentials.valid or (rejected is not None and self.credentials.token == rejected):
+                await asyncio.get_running_loop().run_in_executor(None, self._refresh_credentials)
+            return self.credentials.token
+
+    @asynccontextmanager
+    async def _get(self, url, headers=None):
+        """
+        GET url with the access token and yield the response, retrying rate limited
+        requests as the scheduler allows and following redirects (export links answer with
+        one). Error responses are raised as googleapiclient HttpErrors, so retries and 404
+        handling match the threaded path.
+        """
+        from googleapiclient.errors import HttpError
+        import httplib2
+        rejected = None
+        attempt = 0
+        redirects = 0
+        while True:
+            delay = self.scheduler.request_delay(self._scheduler_key)
+            if delay:
+                await asyncio.sleep(delay)
+            token = await self._authorize(rejected)
+            async with self.pool.request('GET', url, dict(headers or {}, Authorization=f"Bearer {token}")) as response:
+                location = response.headers.get('location')
+                if response.status in REDIRECT_STATUSES and location and redirects < 5:
+                    await response.read()
+                    url = urljoin(url, location)
+                    redirects += 1
+                    continue
+                if response.status < 400:
+                    yield response
+                    return
+                body = await response.read()
+            if is_rate_limited(response.status, body) and attempt < self.scheduler.retries:
+                attempt += 1
+                delay = self.scheduler.rate_limited_delay(self._scheduler_key, attempt,
+                                                          retry_after_seconds(response.headers.get('retry-after')))
+                logger.warning(f"Rate limited by Drive; retrying in {delay:.2f}s "
+                               f"(attempt {attempt}/{self.scheduler.retries}).")
+                continue
+            if response.status != 401 or rejected is not None:
+                raise HttpError(httplib2.Response({'status': response.status}), body, uri=url)
+            rejected = token
+
+    def _url(self, file_id, suffix='', **params):
+        return f"{self.api_endpoint}files/{quote(file_id, safe='')}{suffix}?{urlencode(params)}"
+
+    async def get_file_info(self, file_id, refresh=False):
+        """
+        Return the metadata of a file, from the cache when possible.
+
+        :param file_id: ID of the Drive file.
+        :param refresh: Skip the cached copy and fetch fresh metadata.
+        """
+        from googleapiclient.errors import HttpError
+        if not refresh:
+            cached = self.metadata_cache.get(file_id)
+            if cached is not None:
+                return cached
+        try:
+            async with self._get(self._url(file_id, fields=METADATA_FIELDS, supportsAllDrives='true')) as response:
+                file_info = json.loads(await response.read())
+        except HttpError as error:
+            logger.error(f"An HTTP error occurred while retrieving metadata: {error}")
+            raise
+        self.metadata_cache.put(file_id, file_info)
+        return file_info
+
+    @staticmethod
+    def _write(fd, data, offset, hasher):
+        view = memoryview(data)
+        position = offset
+        while view:
+            written = os.pwrite(fd, view, position)
+            view = view[written:]
+            position += written
+        if hasher:
+            hasher.update(offset, data)
+
+    async def _stream_body(self, response, fd, offset, hasher, metrics, journal=None):
+        """
+        Write the response body to fd from offset, keeping at most the shared budget of
+        bytes in memory. Returns the offset after the last byte written.
+        """
+        loop = asyncio.get_running_loop()
+        marked = offset
+        try:
+            while True:
+                async with self.budget.reserve(self.read_size):
+                    data = await response.read_chunk(self.read_size)
+                    if not data:
+                        return offset
+                    await loop.run_in_executor(None, self._write, fd, data, offset, hasher)
+                offset += len(data)
+                metrics.add_bytes(len(data))
+                delay = self.scheduler.bytes_delay(len(data))
+                if delay:
+                    await asyncio.sleep(delay)
+                if journal and offset - marked >= JOURNAL_INTERVAL:
+                    journal.mark(0, offset - 1)
+                    marked = offset
+        except BaseException:
+            # Whatever was written is on disk and can be resumed from
+            if journal and offset > marked:
+                journal.mark(0, offset - 1)
+            raise
+
+    async def _stream_export(self, url, path, metrics):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            metrics.start_transfer(None)
+            async with self._get(url) as response:
+                await self._stream_body(response, fd, 0, None, metrics)
+        except BaseException:
+            # Exports cannot be resumed, so a partial one is of no use
+            os.remove(path)
+            raise
+        finally:
+            os.close(fd)
+
+    async def _export(self, file_id, file_info, export_mime_type, destination, metrics):
+        key = self.blob_cache and blob_key(file_id, file_info, export_mime_type)
+        if key and await self._from_cache(key, destination, metrics):
+            return
+        url = export_url(file_id, file_info, export_mime_type, self.api_endpoint)
+        await self._retry(lambda: self._stream_export(url, part_path(destination), metrics), metrics)
+        await self._commit(destination, key, metrics)
+
+    async def _export_all(self, file_id, file_info, destination, metrics):
+        # Every selected format is streamed at the same time
+        paths = export_paths(destination, select_export_formats(file_info, self.export_formats))
+        await asyncio.gather(*(self._export(file_id, file_info, export_mime_type, path, metrics)
+                               for export_mime_type, path in paths.items()))
+
+    async def _from_cache(self, key, destination, metrics):
+        from resumable_download import JOURNAL_SUFFIX
+        loop = asyncio.get_running_loop()
+        with metrics.phase('cache'):
+            hit = await loop.run_in_executor(None, self.blob_cache.materialize, key, part_path(destination))
+        metrics.cache = 'hit' if hit else 'miss'
+        if hit:
+            await loop.run_in_executor(None, commit, part_path(destination), destination, self.fsync)
+            if os.path.exists(destination + JOURNAL_SUFFIX):
+                os.remove(destination + JOURNAL_SUFFIX)
+        return hit
+
+    async def _commit(self, destination, key, metrics):
+        loop = asyncio.get_running_loop()
+        if self.fsync:
+            with metrics.phase('fsync'):
+                await loop.run_in_executor(None, commit, part_path(destination), destination, True)
+        else:
+            commit(part_path(destination), destination)
+        if key:
+            await loop.run_in_executor(None, self.blob_cache.store, key, destination)
+
+    async def _download_binary(self, file_id, destination, file_info, hasher, metrics):
+        from resumable_download import PartJournal, IncompleteRangeError
+        from integrity import ChecksumMismatchError
+        loop = asyncio.get_running_loop()
+        part = part_path(destination)
+        journal = PartJournal(destination, file_id, file_info, data_path=part)
+        size = journal.identity['size']
+        offset = journal.contiguous_offset()
+        fd = os.open(part, os.O_WRONLY | os.O_CREAT | (0 if offset else os.O_TRUNC), 0o666)
+        try:
+            os.ftruncate(fd, offset)
+            # Ranges written past the gap by an earlier ranged run are gone from disk now
+            if journal.completed_bytes() > offset:
+                journal.truncate(offset)
+            await loop.run_in_executor(None, preallocate, fd, size)
+            if hasher:
+                if hasher.offset > offset:
+                    hasher.reset()
+                await loop.run_in_executor(None, hasher.add_written, [(0, offset - 1)] if offset else [])
+            metrics.start_transfer(size, offset)
+            if not 0 < size <= offset:
+                headers = {'Range': f"bytes={offset}-"} if offset else {}
+                async with self._get(self._url(file_id, alt='media', supportsAllDrives='true'), headers) as response:
+                    if offset and response.status == 200:
+                        # The server ignored the range and sends the whole file
+                        logger.info(f"Server ignored the resume offset for {file_id}; starting over.")
+                        offset = 0
+                        os.ftruncate(fd, 0)
+                        journal.remove()
+                        if hasher:
+                            hasher.reset()
+                    offset = await self._stream_body(response, fd, offset, hasher, metrics, journal)
+            if offset < size:
+                raise IncompleteRangeError(f"Received {offset} of {size} bytes of {file_id}")
+        finally:
+            os.close(fd)
+        if hasher:
+            try:
+                digests = hasher.verify(file_info)
+            except ChecksumMismatchError:
+                journal.remove()
+                hasher.reset()
+                self.metadata_cache.invalidate(file_id)
+                raise
+            logger.info(f"Checksum verified: {', '.join(f'{name} {digest}' for name, digest in digests.items())}.")
+        journal.remove()
+
+    async def _retry(self, attempt, metrics):
+        from resumable_download import is_transient_error, backoff_delay
+        tries = 0
+        while True:
+            try:
+                return await attempt()
+            except Exception as e:
+                if tries >= self.retries or not is_transient_error(e):
+                    raise
+                tries += 1
+                delay = backoff_delay(tries, self.retry_delay)
+                logger.warning(f"Transfer interrupted ({e}); retrying in {delay:.2f}s (attempt {tries}/{self.retries}).")
+                metrics.record_retry(e, delay)
+                await asyncio.sleep(delay)
+
+    async def download_file(self, file_id, destination, metrics=None):
+        """
+        Download one file; see GoogleDriveDownloader.download_file.
+
+        :param file_id: ID of the Drive file.
+        :param destination: Local path to write to, '-' for standard output, or a sink: an
+                            object with a write() method, which may be a coroutine, or an
+                            asyncio.StreamWriter. Sinks are awaited before more data is read.
+        :param metrics: Optional DownloadMetrics to report to; one is created otherwise.
+        :return: None on success, the HTTP response when the file was not found.
+        """
+        metrics = metrics or DownloadMetrics(file_id, sink_name(destination) if is_sink(destination) else destination,
+                                             self.metrics_hooks, self.progress_interval)
+        loop = asyncio.get_running_loop()
+        try:
+            if is_sink(destination):
+                response = await self._download_to_sink(file_id, AsyncSink(open_sink(destination)), metrics)
+            else:
+                previous = file_identity(destination)
+                # Waiting for another process's lock must not block the event loop
+                lock = destination_lock(destination, wait=self.wait_for_lock)
+                waited = await loop.run_in_executor(None, lock.__enter__)
+                try:
+                    response = await self._download_file(file_id, destination, metrics, previous if waited else False)
+                finally:
+                    lock.__exit__(None, None, None)
+        except BaseException as e:
+            metrics.finish('failed', e)
+            raise
+        if response is None:
+            metrics.finish('ok')
+        else:
+            metrics.finish('failed', f"HTTP {response.status}")
+        return response
+
+    async def _download_to_sink(self, file_id, sink, metrics):
+        """
+        Stream a file into sink; see GoogleDriveDownloader._stream_to_sink. Reads are
+        bounded by the shared ByteBudget and each is written before the next one is read.
+        """
+        from googleapiclient.errors import HttpError
+        from resumable_download import IncompleteRangeError
+        from integrity import OrderedHasher
+        try:
+            # Inside the try, so a missing file is answered with its response as by the threaded backend
+            with metrics.phase('auth'):
+                await self._authorize()
+            with metrics.phase('metadata'):
+                file_info = await self.get_file_info(file_id)
+            export = file_info['mimeType'].startswith(GOOGLE_APPS_PREFIX)
+            if export:
+                formats = select_export_formats(file_info, self.export_formats)
+                if len(formats) > 1:
+                    raise UnsupportedExportError(f"Only one export format can be streamed, not {len(formats)}")
+                key = self.blob_cache and blob_key(file_id, file_info, formats[0])
+                url = export_url(file_id, file_info, formats[0], self.api_endpoint)
+                size = None
+                hasher = None
+            else:
+                key = self.blob_cache and blob_key(file_id, file_info)
+                url = media_url(file_id, self.api_endpoint)
+                size = int(file_info['size']) if 'size' in file_info else None
+                hasher = OrderedHasher(metrics.destination, ('md5', 'sha256') if self.sha256 else ('md5',)) \
+                    if self.verify else None
+
+            loop = asyncio.get_running_loop()
+            if key:
+                with metrics.phase('cache'):
+                    blob = await loop.run_in_executor(None, self.blob_cache.open, key)
+                metrics.cache = 'hit' if blob else 'miss'
+                if blob is not None:
+                    with blob:
+                        metrics.start_transfer(size)
+                        while True:
+                            data = await loop.run_in_executor(None, blob.read, self.read_size)
+                            if not data:
+                                break
+                            await sink.write(data)
+                            metrics.add_bytes(len(data))
+                    await sink.flush()
+                    return None
+
+            written = 0
+
+            async def attempt():
+                nonlocal written
+                if export and written:
+                    raise IOError(f"Export stream interrupted after {written} bytes; it cannot be resumed")
+                async with self._get(url, {'Range': f"bytes={written}-"} if written else None) as response:
+                    # A server that ignores the range sends the bytes already written again
+                    skip = written if response.status == 200 else 0
+                    metrics.start_transfer(size, written)
+                    while True:
+                        async with self.budget.reserve(self.read_size):
+                            data = await response.read_chunk(self.read_size)
+                            if not data:
+                                break
+                            if skip:
+                                data, skip = data[skip:], max(0, skip - len(data))
+                            if data:
+                                await sink.write(data)
+                                if hasher:
+                                    hasher.update(written, data)
+                                written += len(data)
+                                metrics.add_bytes(len(data))
+                        delay = self.scheduler.bytes_delay(len(data))
+                        if delay:
+                            await asyncio.sleep(delay)
+                if size is not None and written < size:
+                    raise IncompleteRangeError(f"Stream ended after {written} of {size} bytes")
+
+            await self._retry(attempt, metrics)
+            await sink.flush()
+            if hasher:
+                # The bytes have already been handed to the consumer, which must discard them
+                digests = hasher.verify(file_info)
+                logger.info(f"Checksum verified: {', '.join(f'{name} {digest}' for name, digest in digests.items())}.")
+            logger.info(f"File streamed successfully to {metrics.destination}.")
+        except HttpError as error:
+            if error.resp.status == 404:
+                logger.error(f"Error: File not found with ID {file_id}.")
+                return error.resp
+            logger.error(f"An HTTP error occurred: {error}")
+            raise
+        except Exception as e:
+            logger.error(f"An error occurred during the download: {e}")
+            raise
+
+    async def _download_file(self, file_id, destination, metrics, previous=False):
+        from googleapiclient.errors import HttpError
+        from resumable_download import JOURNAL_SUFFIX
+        from integrity import OrderedHasher
+        with metrics.phase('auth'):
+            await self._authorize()
+        with metrics.phase('metadata'):
+            file_info = await self.get_file_info(file_id, refresh=os.path.exists(destination + JOURNAL_SUFFIX))
+        mime_type = file_info['mimeType']
+        if previous is not False and finished_elsewhere(destination, previous, file_info):
+            logger.info(f"File was downloaded to {destination} by another process; reusing it.")
+            return None
+        part = part_path(destination)
+
+        try:
+            if mime_type.startswith(GOOGLE_APPS_PREFIX):
+                await self._export_all(file_id, file_info, destination, metrics)
+            else:
+                key = self.blob_cache and blob_key(file_id, file_info)
+                if key and await self._from_cache(key, destination, metrics):
+                    return None
+                hasher = OrderedHasher(part, ('md5', 'sha256') if self.sha256 else ('md5',)) \
+                    if self.verify else None
+
+                async def attempt():
+                    file_info = await self.get_file_info(file_id)
+                    await self._download_binary(file_id, destination, file_info, hasher, metrics)
+
+                await self._retry(attempt, metrics)
+                await self._commit(destination, key, metrics)
+            logger.info(f"File downloaded successfully to {destination}.")
+        except UnsupportedExportError as e:
+            logger.error(str(e))
+            raise
+        except HttpError as error:
+            if error.resp.status == 404:
+                logger.error(f"Error: File not found with ID {file_id}.")
+                return error.resp
+            else:
+                logger.error(f"An HTTP error occurred: {error}")
+            raise
+        except Exception as e:
+            logger.error(f"An error occurred during the download: {e}")
+            raise
+
+    async def _download_one(self, file_id, destination):
+        start = time.perf_counter()
+        result = {'file_id': file_id, 'destination': destination}
+        metrics = DownloadMetrics(file_id, sink_name(destination) if is_sink(destination) else destination,
+                                  self.metrics_hooks, self.progress_interval)
+        try:
+            response = await self.download_file(file_id, destination, metrics)
+            if response is not None:
+                raise IOError(f"File not found with ID {file_id}")
+            on_disk = not is_sink(destination) and os.path.exists(destination)
+            result.update(status='ok', bytes=os.path.getsize(destination) if on_disk else metrics.bytes)
+        except (Exception, SystemExit) as e:
+            # SystemExit must not leave the task: it would stop the event loop and every other download
+            result.update(status='failed', bytes=0, error=str(e) or type(e).__name__)
+        result['seconds'] = round(time.perf_counter() - start, 3)
+        result.update(phases=metrics.snapshot()['phases'], retries=metrics.retries)
+        logger.info(f"[{result['status']}] {file_id} -> {destination} ({result['bytes']} bytes, {result['seconds']}s)")
+        return result
+
+    async def download_many(self, jobs, on_result=None):
+        """
+        Download every (file_id, destination) pair from jobs, up to concurrency at a time.
+
+        Jobs are pulled from the iterable as downloads finish, so it may be lazy. Results
+        have the same shape as BatchDownloader's and the summary is left in self.summary.
+
+        :param jobs: Iterable of (file_id, destination) tuples.
+        :param on_result: Optional callable receiving each result as it completes. When
+                          given, results are not kept in memory and an empty list is returned.
+        :return: List of per-file result dicts in completion order.
+        """
+        from batch_download import summarize
+        # Mint (or load from the token cache) the token once before the downloads start
+        await self._authorize()
+        started = time.perf_counter()
+        results = []
+        totals = {'files': 0, 'succeeded': 0, 'bytes': 0}
+        jobs = iter(jobs)
+
+        async def worker():
+            for file_id, destination in jobs:
+                result = await self._download_one(file_id, destination)
+                totals['files'] += 1
+                totals['succeeded'] += result['status'] == 'ok'
+                totals['bytes'] += result['bytes']
+                if on_result:
+                    on_result(result)
+                else:
+                    results.append(result)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        self.summary = summarize(totals, time.perf_counter() - started)
+        return results
+
+    async def _run_closing(self, coroutine):
+        try:
+            return await coroutine
+        finally:
+            await self.close()
+
+    def download(self, file_id, destination):
+        """Synchronous wrapper around download_file, running its own event loop."""
+        return asyncio.run(self._run_closing(self.download_file(file_id, destination)))
+
+    def run(self, jobs, on_result=None):
+        """Synchronous wrapper around download_many, a drop-in for BatchDownloader.run."""
+        return asyncio.run(self._run_closing(self.download_many(jobs, on_result)))
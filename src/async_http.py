@@ -0,0 +1,181 @@
+import ssl
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+logger = logging.getLogger()
+
+# Open connections allowed per host; requests beyond it wait for a free connection
+DEFAULT_POOL_SIZE = 100
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class AsyncResponse:
+    """
+    Response of an AsyncHTTPPool request whose body is read incrementally.
+
+    The connection goes back to the pool when the response is released after its body
+    was read completely; otherwise it is closed.
+    """
+
+    def __init__(self, reader, writer, status, reason, headers, timeout, has_body=True):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        length = headers.get('content-length')
+        self._remaining = int(length) if length is not None and not self._chunked else None
+        self._chunk_left = 0
+        self.reusable = headers.get('connection', '').lower() != 'close' and (self._chunked or self._remaining is not None)
+        self.complete = not has_body or self._remaining == 0
+
+    async def _read(self, read):
+        try:
+            return await asyncio.wait_for(read, self._timeout)
+        except asyncio.IncompleteReadError:
+            raise ConnectionResetError('Connection closed in the middle of a response')
+
+    async def read_chunk(self, size):
+        """
+        Read up to size bytes of the body.
+
+        :return: The bytes read; empty once the body is complete.
+        """
+        if self.complete:
+            return b''
+        if self._chunked:
+            if self._chunk_left == 0:
+                line = await self._read(self._reader.readuntil(b'\r\n'))
+                self._chunk_left = int(line.split(b';', 1)[0], 16)
+                if self._chunk_left == 0:
+                    # Skip the trailer section up to the final empty line
+                    while await self._read(self._reader.readuntil(b'\r\n')) != b'\r\n':
+                        pass
+                    self.complete = True
+                    return b''
+            data = await self._read(self._reader.read(min(size, self._chunk_left)))
+            if not data:
+                raise ConnectionResetError('Connection closed in the middle of a response')
+            self._chunk_left -= len(data)
+            if self._chunk_left == 0:
+                await self._read(self._reader.readexactly(2))
+            return data
+        if self._remaining is None:
+            data = await self._read(self._reader.read(size))
+            self.complete = not data
+            return data
+        data = await self._read(self._reader.read(min(size, self._remaining)))
+        if not data:
+            raise ConnectionResetError(f"Connection closed with {self._remaining} bytes of the response missing")
+        self._remaining -= len(data)
+        self.complete = self._remaining == 0
+        return data
+
+    async def read(self, chunk_size=64 * 1024):
+        """Read the rest of the body."""
+        parts = []
+        while True:
+            data = await self.read_chunk(chunk_size)
+            if not data:
+                return b''.join(parts)
+            parts.append(data)
+
+
+class AsyncHTTPPool:
+    """
+    Minimal asyncio HTTP/1.1 client with a pool of keep-alive connections per host.
+
+    Only what the Drive downloads need: GET/POST requests, Content-Length or chunked
+    response bodies, TLS for https URLs. At most pool_size connections are open per host;
+    a request on an idle connection that turns out to be closed by the server is sent
+    again once on a new connection.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, ssl_context=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.connections_opened = 0
+        self._idle = {}
+        self._slots = {}
+
+    async def _connect(self, scheme, host, port):
+        if scheme == 'https' and self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self.ssl_context if scheme == 'https' else None),
+            self.timeout)
+        self.connections_opened += 1
+        return reader, writer
+
+    async def _send(self, connection, method, host_header, target, headers, body):
+        reader, writer = connection
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host_header}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readuntil(b'\r\n'), self.timeout)
+        _, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        response_headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readuntil(b'\r\n'), self.timeout)
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        status = int(status)
+        has_body = method != 'HEAD' and status not in (204, 304) and status >= 200
+        return AsyncResponse(reader, writer, status, reason, response_headers, self.timeout, has_body)
+
+    @asynccontextmanager
+    async def request(self, method, url, headers=None, body=None):
+        """
+        Send a request and yield the AsyncResponse once its headers have arrived.
+
+        :param method: HTTP method.
+        :param url: Absolute http or https URL.
+        :param headers: Optional dict of request headers.
+        :param body: Optional request body bytes.
+        """
+        parts = urlsplit(url)
+        port = parts.port or DEFAULT_PORTS[parts.scheme]
+        key = (parts.scheme, parts.hostname, port)
+        host_header = parts.hostname if port == DEFAULT_PORTS[parts.scheme] else f"{parts.hostname}:{port}"
+        target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        slots = self._slots.setdefault(key, asyncio.Semaphore(self.pool_size))
+        async with slots:
+            idle = self._idle.setdefault(key, [])
+            response = None
+            while response is None:
+                reused = bool(idle)
+                connection = idle.pop() if reused else await self._connect(*key)
+                try:
+                    response = await self._send(connection, method, host_header, target, headers or {}, body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection[1].close()
+                    # Only an idle connection the server has since closed is worth another try
+                    if not reused:
+                        raise
+                except BaseException:
+                    connection[1].close()
+                    raise
+            try:
+                yield response
+            finally:
+                if response.complete and response.reusable:
+                    idle.append(connection)
+                else:
+                    connection[1].close()
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
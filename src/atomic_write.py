@@ -0,0 +1,133 @@
+import os
+import time
+import errno
+import fcntl
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# Downloads are written to <destination>.part and renamed over the destination once complete
+PART_SUFFIX = '.part'
+LOCK_SUFFIX = '.lock'
+
+
+class DestinationBusyError(IOError):
+    pass
+
+
+def part_path(destination):
+    return destination + PART_SUFFIX
+
+
+def file_identity(path):
+    """(device, inode, size) of path, or None when it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino, st.st_size
+
+
+def finished_elsewhere(destination, previous, file_info):
+    """
+    Whether a process we waited for has renamed a complete download into place.
+
+    :param destination: Final path of the download.
+    :param previous: file_identity() of the destination before the wait.
+    :param file_info: Drive metadata of the file; its size is compared when known.
+    """
+    current = file_identity(destination)
+    return current is not None and current != previous and \
+        ('size' not in file_info or current[2] == int(file_info['size']))
+
+
+def preallocate(fd, size):
+    """
+    Reserve size bytes for the file behind fd, so a full disk fails the download before
+    the transfer rather than midway and the file is laid out in one piece. Filesystems
+    without fallocate support are left alone.
+    """
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+            raise
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit(part, destination, fsync=False):
+    """
+    Move a finished part file over the destination in one atomic rename, so readers see
+    either the old file or the complete new one.
+
+    :param part: Path of the finished part file.
+    :param destination: Final path, in the same directory.
+    :param fsync: Flush the data before the rename and the directory after it, so the new
+                  file also survives a power loss.
+    """
+    if fsync:
+        fsync_path(part)
+    os.replace(part, destination)
+    if fsync:
+        fsync_path(os.path.dirname(os.path.abspath(destination)))
+
+
+@contextmanager
+def destination_lock(destination, wait=True):
+    """
+    Hold an exclusive advisory lock on destination (through <destination>.lock) while
+    downloading to it, so two processes never write the same file.
+
+    :param destination: Final path of the download.
+    :param wait: Wait for another holder to finish instead of failing.
+    :return: Context manager yielding True when another process held the lock first.
+    :raises DestinationBusyError: When wait is False and the lock is held elsewhere.
+    :raises FileNotFoundError: When the directory of destination does not exist.
+    """
+    # Checked first, so the error names the directory rather than the lock file
+    directory = os.path.dirname(os.path.abspath(destination))
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(errno.ENOENT, 'Destination directory does not exist', directory)
+    path = destination + LOCK_SUFFIX
+    waited = False
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not wait:
+                    raise DestinationBusyError(f"{destination} is being downloaded by another process")
+                logger.info(f"Waiting for another process downloading to {destination}...")
+                started = time.perf_counter()
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                waited = True
+                logger.info(f"Lock on {destination} acquired after {time.perf_counter() - started:.1f}s.")
+            # The previous holder removes the lock file on release; a lock on a file that is
+            # no longer at path protects nothing, so open it again
+            st = os.fstat(fd)
+            current = file_identity(path)
+        except BaseException:
+            os.close(fd)
+            raise
+        if current is not None and current[:2] == (st.st_dev, st.st_ino):
+            break
+        os.close(fd)
+    try:
+        yield waited
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        os.close(fd)
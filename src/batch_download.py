@@ -0,0 +1,488 @@
+import os
+import csv
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import multiprocessing
+from functools import partial
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from download_files_gdrive import GoogleDriveDownloader, DEFAULT_RETRIES
+from buffer_pool import BufferPool, DEFAULT_MEMORY_BUDGET
+from download_metrics import metrics_sinks
+from metadata_cache import MetadataCache, BATCH_LIMIT, DEFAULT_TTL
+from http_pool import PooledHttp, DEFAULT_POOL_SIZE
+from rate_limit import RequestScheduler
+from blob_cache import BlobCache, DEFAULT_MAX_SIZE, MATERIALIZE_MODES
+from export_formats import parse_formats
+from stream_sink import is_sink
+from ranged_download import DEFAULT_WORKERS
+from sharding import parse_shard, shard_of, select_shard
+
+logger = logging.getLogger()
+
+DEFAULT_BATCH_WORKERS = 8
+
+
+def parse_manifest(text, fmt=None, with_priority=False):
+    """
+    Parse a manifest of file_id -> destination pairs.
+
+    Accepted formats are a JSON object mapping file IDs to destinations, a JSON list of
+    {"file_id": ..., "destination": ...} objects, or CSV rows of file_id,destination
+    (an optional header row is skipped). List items may carry a "priority" and CSV rows
+    a third column with one, for a DownloadQueue; higher priorities go first.
+
+    :param text: Manifest contents.
+    :param fmt: 'json' or 'csv'; guessed from the contents when not given.
+    :param with_priority: Return (file_id, destination, priority) tuples, priority 0 when not given.
+    :return: List of (file_id, destination) tuples.
+    """
+    if fmt is None:
+        fmt = 'json' if text.lstrip()[:1] in ('{', '[') else 'csv'
+    if fmt == 'json':
+        data = json.loads(text)
+        if isinstance(data, dict):
+            items = [{'file_id': file_id, 'destination': destination} for file_id, destination in data.items()]
+        else:
+            items = data
+        if with_priority:
+            return [(item['file_id'], item['destination'], int(item.get('priority', 0))) for item in items]
+        return [(item['file_id'], item['destination']) for item in items]
+    jobs = []
+    for row in csv.reader(text.splitlines()):
+        if not row or row[0].strip().startswith('#'):
+            continue
+        if [cell.strip() for cell in row[:2]] == ['file_id', 'destination']:
+            continue
+        if len(row) < 2:
+            raise ValueError(f"Manifest row needs a file_id and a destination: {row}")
+        if with_priority:
+            jobs.append((row[0].strip(), row[1].strip(), int(row[2]) if len(row) > 2 and row[2].strip() else 0))
+        else:
+            jobs.append((row[0].strip(), row[1].strip()))
+    return jobs
+
+
+def load_manifest(path, with_priority=False):
+    """
+    Read a manifest from a .json/.csv file, or from stdin when path is '-'.
+
+    :param path: Path to the manifest file or '-'.
+    :param with_priority: See parse_manifest.
+    :return: List of (file_id, destination) tuples.
+    """
+    if path == '-':
+        return parse_manifest(sys.stdin.read(), with_priority=with_priority)
+    with open(path, 'r') as f:
+        text = f.read()
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return parse_manifest(text, extension if extension in ('json', 'csv') else None, with_priority)
+
+
+class BatchDownloader:
+    """
+    Download many files in one process on a bounded thread pool.
+
+    All workers share a single set of credentials whose access token is minted once up
+    front, and one Drive service whose pooled transport keeps a few connections alive
+    for all of them.
+    """
+
+    def __init__(self, downloader, workers=DEFAULT_BATCH_WORKERS):
+        self.downloader = downloader
+        self.workers = workers
+        self.summary = None
+        self._local = threading.local()
+
+    def _worker_downloader(self):
+        if not hasattr(self._local, 'downloader'):
+            self._local.downloader = self.downloader.worker_copy()
+        return self._local.downloader
+
+    def _prefetch(self, file_ids):
+        try:
+            self.downloader.prefetch_metadata(file_ids)
+        except Exception as e:
+            # Not fatal: each download falls back to its own metadata lookup
+            logger.warning(f"Batched metadata lookup failed: {e}")
+
+    def _download_one(self, file_id, destination):
+        start = time.perf_counter()
+        result = {'file_id': file_id, 'destination': destination}
+        downloader = self._worker_downloader()
+        try:
+            response = downloader.download_file(file_id, destination)
+            if response is not None:
+                raise IOError(f"File not found with ID {file_id}")
+            # Streams have no size on disk, and several export formats are written next to
+            # destination rather than to it
+            on_disk = not is_sink(destination) and os.path.exists(destination)
+            result.update(status='ok', bytes=os.path.getsize(destination) if on_disk else downloader.last_metrics.bytes)
+        except (Exception, SystemExit) as e:
+            result.update(status='failed', bytes=0, error=str(e) or type(e).__name__)
+        result['seconds'] = round(time.perf_counter() - start, 3)
+        if downloader.last_metrics is not None:
+            # Where the time went, so slow stages stand out in the report
+            result.update(phases=downloader.last_metrics.snapshot()['phases'],
+                          retries=downloader.last_metrics.retries)
+        logger.info(f"[{result['status']}] {file_id} -> {destination} ({result['bytes']} bytes, {result['seconds']}s)")
+        return result
+
+    def run(self, jobs, on_result=None):
+        """
+        Download every (file_id, destination) pair from jobs.
+
+        jobs may be a lazy iterable; at most a couple of jobs per worker are queued at a
+        time, so producers can stream work in without building the whole list first.
+        Jobs are read in groups of BATCH_LIMIT whose metadata is fetched with a single
+        batch request before they are handed to the workers.
+
+        :param jobs: Iterable of (file_id, destination) tuples.
+        :param on_result: Optional callable receiving each result as it completes. When
+                          given, results are not kept in memory and an empty list is returned.
+        :return: List of per-file result dicts in completion order.
+        """
+        from drive_service import auth_request
+        # Reuses a token from the on-disk cache when there is one, otherwise mints it once for all workers;
+        # a DownloadQueue has already done so for the batches it runs side by side
+        if not self.downloader.credentials.valid:
+            self.downloader.credentials.refresh(auth_request(self.downloader.transport))
+        started = time.perf_counter()
+        results = []
+        totals = {'files': 0, 'succeeded': 0, 'bytes': 0}
+
+        # Futures are put here by their done callbacks, so they are collected in the order they finished
+        finished = queue.Queue()
+        in_flight = 0
+
+        def collect():
+            nonlocal in_flight
+            result = finished.get().result()
+            in_flight -= 1
+            totals['files'] += 1
+            totals['succeeded'] += result['status'] == 'ok'
+            totals['bytes'] += result['bytes']
+            if on_result:
+                on_result(result)
+            else:
+                results.append(result)
+
+        jobs = iter(jobs)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for group in iter(lambda: list(islice(jobs, BATCH_LIMIT)), []):
+                self._prefetch(file_id for file_id, _ in group)
+                for file_id, destination in group:
+                    if in_flight >= self.workers * 2:
+                        collect()
+                    pool.submit(self._download_one, file_id, destination).add_done_callback(finished.put)
+                    in_flight += 1
+            while in_flight:
+                collect()
+        self.summary = summarize(totals, time.perf_counter() - started)
+        return results
+
+
+def summarize(totals, elapsed):
+    """
+    Turn running totals into a batch summary with throughput figures.
+
+    :param totals: Dict with the number of files, succeeded files and bytes downloaded.
+    :param elapsed: Wall-clock seconds for the whole batch.
+    :return: Summary dict.
+    """
+    return {
+        'files': totals['files'],
+        'succeeded': totals['succeeded'],
+        'failed': totals['files'] - totals['succeeded'],
+        'bytes': totals['bytes'],
+        'seconds': round(elapsed, 3),
+        'files_per_second': round(totals['files'] / elapsed, 2) if elapsed else 0.0,
+        'mib_per_second': round(totals['bytes'] / (1024 * 1024) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def make_downloader(options, index=None):
+    """
+    Build a GoogleDriveDownloader from command line options, in the process that uses it.
+
+    :param options: Dict of the options of batch_download.py or mirror_folder.py (vars(args));
+                    missing options take their defaults.
+    :param index: Number of this process when it is one of options['processes'] processes.
+                  Rate caps and the memory budget are split evenly between the processes and
+                  each one writes its own Prometheus file, suffixed with the process number.
+    """
+    processes = options.get('processes') or 1
+    requests_per_second = options.get('max_requests_per_second')
+    bandwidth = options.get('max_bandwidth')
+    scheduler = RequestScheduler(
+        requests_per_second=requests_per_second / processes if requests_per_second else None,
+        bytes_per_second=bandwidth * 1024 * 1024 / processes if bandwidth else None)
+    blob_cache = None
+    if options.get('blob_cache'):
+        blob_cache = BlobCache(options['blob_cache'],
+                               max_size=(options.get('blob_cache_size') or DEFAULT_MAX_SIZE // (1024 * 1024)) * 1024 * 1024,
+                               mode=options.get('blob_cache_mode') or 'auto')
+    metadata_cache = None
+    if options.get('metadata_cache'):
+        metadata_cache = MetadataCache(ttl=options.get('metadata_ttl') or DEFAULT_TTL, path=options['metadata_cache'])
+    memory_budget = (options.get('memory_budget') or DEFAULT_MEMORY_BUDGET // (1024 * 1024)) * 1024 * 1024
+    metrics_prom = options.get('metrics_prom')
+    if metrics_prom and index is not None:
+        root, extension = os.path.splitext(metrics_prom)
+        metrics_prom = f"{root}-{index}{extension}"
+    return GoogleDriveDownloader(options['credentials'], api_endpoint=options.get('api_endpoint'),
+                                 retries=options.get('retries', DEFAULT_RETRIES),
+                                 transport=PooledHttp(pool_size=options.get('pool_size') or DEFAULT_POOL_SIZE),
+                                 scheduler=scheduler, wait_for_lock=not options.get('no_wait'),
+                                 blob_cache=blob_cache, export_formats=options.get('export_format'),
+                                 metadata_cache=metadata_cache,
+                                 buffer_pool=BufferPool(budget=memory_budget // processes),
+                                 metrics_hooks=metrics_sinks(options.get('metrics_jsonl'), metrics_prom))
+
+
+def _shard_worker(downloader_factory, index, workers, inbox, outbox):
+    """Entry point of a ProcessPoolBatch process: download the jobs from its inbox."""
+    downloader = downloader_factory(index)
+
+    def jobs():
+        while True:
+            job = inbox.get()
+            if job is None:
+                return
+            file_id, destination, metadata = job
+            if metadata is not None:
+                # Listed by the parent already, so the download needs no metadata lookup
+                downloader.metadata_cache.put(file_id, metadata)
+            yield file_id, destination
+
+    try:
+        BatchDownloader(downloader, workers=workers).run(jobs(), on_result=outbox.put)
+    finally:
+        outbox.put(None)
+
+
+class ProcessPoolBatch:
+    """
+    Download many files on several processes, each a BatchDownloader with its own
+    GoogleDriveDownloader, so TLS, hashing and JSON parsing are not bound by one GIL.
+
+    Jobs are routed to the processes by shard_of(file_id) through bounded queues, so a lazy
+    job iterable is still read only as fast as the processes keep up. Results come back to
+    this process, where run() and summary behave like BatchDownloader's.
+    """
+
+    def __init__(self, downloader_factory, processes, workers=DEFAULT_BATCH_WORKERS, metadata_cache=None):
+        """
+        :param downloader_factory: Picklable callable returning a GoogleDriveDownloader for a
+                                   process number, e.g. functools.partial(make_downloader, options).
+        :param processes: Number of download processes.
+        :param workers: Download threads in each process.
+        :param metadata_cache: Optional MetadataCache whose entries are sent along with the
+                               jobs, e.g. the one a FolderWalker fills while listing.
+        """
+        self.downloader_factory = downloader_factory
+        self.processes = processes
+        self.workers = workers
+        self.metadata_cache = metadata_cache
+        self.summary = None
+
+    def _put(self, process, inbox, job):
+        while True:
+            try:
+                inbox.put(job, timeout=0.5)
+                return
+            except queue.Full:
+                if not process.is_alive():
+                    raise RuntimeError(f"Download process {process.name} exited with code {process.exitcode}")
+
+    def run(self, jobs, on_result=None):
+        """
+        Download every (file_id, destination) pair from jobs; see BatchDownloader.run.
+
+        :raises RuntimeError: When a download process dies.
+        """
+        context = multiprocessing.get_context('spawn')
+        started = time.perf_counter()
+        inboxes = [context.Queue(maxsize=self.workers * 2) for _ in range(self.processes)]
+        outbox = context.Queue()
+        processes = [context.Process(target=_shard_worker, name=f"download-{index}", daemon=True,
+                                     args=(self.downloader_factory, index, self.workers, inboxes[index], outbox))
+                     for index in range(self.processes)]
+        for process in processes:
+            process.start()
+
+        results = []
+        totals = {'files': 0, 'succeeded': 0, 'bytes': 0}
+
+        def collect():
+            finished, exited = 0, False
+            while finished < len(processes):
+                try:
+                    result = outbox.get(timeout=0.1 if exited else 0.5)
+                except queue.Empty:
+                    if exited:
+                        return
+                    # A process that died without its end marker; read what it sent before leaving
+                    exited = not any(process.is_alive() for process in processes)
+                    continue
+                if result is None:
+                    finished += 1
+                    continue
+                totals['files'] += 1
+                totals['succeeded'] += result['status'] == 'ok'
+                totals['bytes'] += result['bytes']
+                if on_result:
+                    on_result(result)
+                else:
+                    results.append(result)
+
+        collector = threading.Thread(target=collect, daemon=True)
+        collector.start()
+        try:
+            for file_id, destination in jobs:
+                index = shard_of(file_id, self.processes)
+                metadata = self.metadata_cache.get(file_id) if self.metadata_cache is not None else None
+                self._put(processes[index], inboxes[index], (file_id, destination, metadata))
+        finally:
+            for process, inbox in zip(processes, inboxes):
+                try:
+                    self._put(process, inbox, None)
+                except RuntimeError:
+                    pass
+            collector.join()
+            for process in processes:
+                process.join()
+        failed = [process for process in processes if process.exitcode]
+        if failed:
+            raise RuntimeError(f"Download process {failed[0].name} exited with code {failed[0].exitcode}")
+        self.summary = summarize(totals, time.perf_counter() - started)
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download many files from Google Drive in one or more processes')
+    parser.add_argument('manifest', type=str, nargs='?',
+                        help='JSON or CSV manifest of file_id -> destination, or - to read it from stdin; '
+                             'may be left out to resume the jobs of a --work-log')
+    parser.add_argument('--credentials', type=str, required=True,
+                        help='Path to the Google Drive API credentials JSON file')
+    parser.add_argument('--workers', type=int, default=DEFAULT_BATCH_WORKERS,
+                        help='Number of files downloaded concurrently')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='Number of times an interrupted download is resumed before giving up')
+    parser.add_argument('--report', type=str,
+                        help='Write per-file results and the summary to this JSON file')
+    parser.add_argument('--metrics-jsonl', type=str,
+                        help='Append per-file phase timings, progress, retries and summaries to this JSON lines file')
+    parser.add_argument('--metrics-prom', type=str,
+                        help='Write download counters and phase timings to this file in Prometheus text format')
+    parser.add_argument('--api-endpoint', type=str,
+                        help='Override the Drive API base URL (e.g. a local test server)')
+    parser.add_argument('--pool-size', type=int,
+                        help=f'Keep-alive connections per host, shared by all workers (default {DEFAULT_POOL_SIZE}; '
+                             f'the asyncio backend has its own default)')
+    parser.add_argument('--max-requests-per-second', type=float,
+                        help='Cap on Drive API requests per second shared by all workers (e.g. the project quota)')
+    parser.add_argument('--max-bandwidth', type=float,
+                        help='Cap on the total download bandwidth in MiB/s')
+    parser.add_argument('--export-format', type=parse_formats,
+                        help='Comma separated formats Google Docs Editors files are exported to, e.g. pdf,docx or '
+                             'csv,ods; several formats are written side by side with their own extensions')
+    parser.add_argument('--blob-cache', type=str,
+                        help='Directory of a local content cache; files already in it are linked or copied instead of downloaded')
+    parser.add_argument('--blob-cache-size', type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help='Size limit of the blob cache in MiB; least recently used files are evicted beyond it')
+    parser.add_argument('--blob-cache-mode', choices=MATERIALIZE_MODES, default='auto',
+                        help='How cached files are placed at the destination (auto: reflink where supported, else copy)')
+    parser.add_argument('--no-wait', action='store_true',
+                        help='Fail files whose destination another process is downloading to instead of waiting')
+    parser.add_argument('--metadata-cache', type=str,
+                        help='Path of an on-disk metadata cache, e.g. an index written by verify_files_util.py --inventory')
+    parser.add_argument('--metadata-ttl', type=float, default=DEFAULT_TTL,
+                        help='Seconds cached metadata is trusted, e.g. longer to reuse an inventory index')
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                        help='Read buffers all workers may hold at once in MiB (threads backend), '
+                             'shared between --processes; workers wait for a buffer beyond it')
+    parser.add_argument('--backend', choices=['threads', 'asyncio'], default='threads',
+                        help='Download on a thread pool or with the asyncio client (use hundreds of --workers)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Download on this many processes of --workers threads each (threads backend); '
+                             'rate caps are shared between them')
+    parser.add_argument('--shard', type=parse_shard,
+                        help='Only download the files of shard i/N (e.g. 0/4), to split one manifest across nodes')
+    parser.add_argument('--order', choices=['manifest', 'size'],
+                        help='Download by manifest priority and then smallest first (size), or by priority and then '
+                             'in manifest order; either way large files go to their own lane (default size with '
+                             '--work-log, otherwise plain manifest order)')
+    parser.add_argument('--work-log', type=str,
+                        help='Append every job\'s state to this log; a rerun with it skips the files already downloaded')
+    parser.add_argument('--large-workers', type=int, default=1,
+                        help='Files larger than the part size downloaded at once, beside the --workers small ones')
+    parser.add_argument('--part-workers', type=int, default=DEFAULT_WORKERS,
+                        help='Ranged parts fetched at once for each large file')
+
+    args = parser.parse_args()
+    queued = bool(args.order or args.work_log)
+    if args.processes > 1 and args.backend == 'asyncio':
+        parser.error('--processes needs the threads backend')
+    if queued and (args.processes > 1 or args.backend == 'asyncio'):
+        parser.error('--order and --work-log need the threads backend in one process')
+    if args.manifest is None and not args.work_log:
+        parser.error('a manifest is needed unless --work-log names an earlier run')
+
+    try:
+        jobs = list(select_shard(load_manifest(args.manifest, with_priority=queued), args.shard)) \
+            if args.manifest else None
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Failed to read manifest {args.manifest}: {e}")
+        sys.exit(-1)
+
+    blob_cache = None
+    if args.backend == 'asyncio':
+        from async_download import AsyncDriveDownloader
+        from async_http import DEFAULT_POOL_SIZE as ASYNC_POOL_SIZE
+        scheduler = RequestScheduler(requests_per_second=args.max_requests_per_second,
+                                     bytes_per_second=args.max_bandwidth * 1024 * 1024 if args.max_bandwidth else None)
+        blob_cache = BlobCache(args.blob_cache, max_size=args.blob_cache_size * 1024 * 1024,
+                               mode=args.blob_cache_mode) if args.blob_cache else None
+        # Same run() and summary as BatchDownloader, with --workers downloads in flight on one thread
+        batch = AsyncDriveDownloader(args.credentials, api_endpoint=args.api_endpoint, retries=args.retries,
+                                     concurrency=args.workers, pool_size=args.pool_size or ASYNC_POOL_SIZE, scheduler=scheduler,
+                                     wait_for_lock=not args.no_wait, blob_cache=blob_cache, export_formats=args.export_format,
+                                     metadata_cache=MetadataCache(ttl=args.metadata_ttl, path=args.metadata_cache)
+                                     if args.metadata_cache else None,
+                                     metrics_hooks=metrics_sinks(args.metrics_jsonl, args.metrics_prom))
+    elif args.processes > 1:
+        batch = ProcessPoolBatch(partial(make_downloader, vars(args)), args.processes, workers=args.workers)
+    elif queued:
+        from download_queue import DownloadQueue, WorkLog
+        downloader = make_downloader(vars(args))
+        blob_cache = downloader.blob_cache
+        batch = DownloadQueue(downloader, workers=args.workers, log=WorkLog(args.work_log) if args.work_log else None,
+                              order=args.order or 'size', large_workers=args.large_workers,
+                              part_workers=args.part_workers)
+    else:
+        downloader = make_downloader(vars(args))
+        blob_cache = downloader.blob_cache
+        batch = BatchDownloader(downloader, workers=args.workers)
+    try:
+        results = batch.run(jobs)
+    except Exception as e:
+        logger.error(f"Batch download failed: {e}")
+        sys.exit(1)
+
+    if args.shard:
+        batch.summary['shard'] = f"{args.shard[0]}/{args.shard[1]}"
+    logger.info(f"Batch finished: {json.dumps(batch.summary)}")
+    if blob_cache is not None:
+        batch.summary['cache'] = blob_cache.stats()
+        logger.info(f"Blob cache: {json.dumps(batch.summary['cache'])}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'summary': batch.summary, 'results': results}, f, indent=2)
+    sys.exit(0 if batch.summary['failed'] == 0 else 1)
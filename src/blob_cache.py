@@ -0,0 +1,214 @@
+import os
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger()
+
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+# ioctl that clones a file's extents on filesystems with copy-on-write (btrfs, XFS, ...)
+FICLONE = 0x40049409
+MATERIALIZE_MODES = ('auto', 'reflink', 'hardlink', 'copy')
+
+
+def blob_key(file_id, file_info, export_mime_type=None):
+    """
+    Cache key of a file's content.
+
+    Binary files are keyed by their md5Checksum, so the same content is shared between
+    file IDs. Exports have no checksum and are keyed by file ID, revision time and format.
+
+    :param file_id: ID of the Drive file.
+    :param file_info: Metadata of the file (md5Checksum, modifiedTime).
+    :param export_mime_type: Export format for Google Docs Editors files.
+    :return: Key string, or None when the content cannot be identified.
+    """
+    if export_mime_type:
+        if not file_info.get('modifiedTime'):
+            return None
+        name = f"{file_id}\n{file_info['modifiedTime']}\n{export_mime_type}"
+        return 'export-' + hashlib.sha256(name.encode('utf-8')).hexdigest()
+    if file_info.get('md5Checksum'):
+        return 'md5-' + file_info['md5Checksum']
+    return None
+
+
+def reflink(source, target):
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def place(source, target, mode='auto'):
+    """
+    Make target a copy of source without downloading it again.
+
+    :param mode: 'hardlink' shares the file, so editing target in place also changes the
+                 source; 'reflink' clones its extents; 'copy' copies the bytes; 'auto'
+                 tries a reflink and falls back to a copy.
+    :return: The method that worked.
+    """
+    methods = ('reflink', 'copy') if mode == 'auto' else (mode,)
+    for method in methods:
+        try:
+            if method == 'hardlink':
+                os.link(source, target)
+            elif method == 'reflink':
+                reflink(source, target)
+            else:
+                shutil.copyfile(source, target)
+            return method
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            # Filesystem without reflink support, a link across devices, ...
+            logger.debug(f"Could not {method} {source} to {target}: {e}")
+            if os.path.lexists(target):
+                os.remove(target)
+            if method == methods[-1]:
+                raise
+
+
+class BlobCache:
+    """
+    Local, content-addressed store of downloaded files with a size limit.
+
+    Blobs live under path/blobs and are listed in path/index.sqlite, which also records
+    when each was last used, so several processes can share one cache. Once the total
+    size exceeds max_size, the least recently used blobs are evicted. hits, misses and
+    evictions count what this instance did.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE, mode='auto'):
+        if mode not in MATERIALIZE_MODES:
+            raise ValueError(f"Unknown cache mode {mode}; expected one of {', '.join(MATERIALIZE_MODES)}")
+        self.path = path
+        self.max_size = max_size
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(path, 'blobs'), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, 'index.sqlite'), timeout=30, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS blobs "
+                           "(key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        self._conn.commit()
+
+    def _blob_path(self, key):
+        return os.path.join(self.path, 'blobs', key[-2:], key)
+
+    def stats(self):
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'blobs': count, 'bytes': size}
+
+    def materialize(self, key, target):
+        """
+        Create target from the cached blob for key.
+
+        :param key: Key from blob_key().
+        :param target: Path to create; an existing file there is replaced.
+        :return: True on a hit, False when the blob is not cached.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM blobs WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return False
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            method = place(self._blob_path(key), target, self.mode)
+        except FileNotFoundError:
+            # Evicted by another process since the lookup
+            with self._lock:
+                self._conn.execute("DELETE FROM blobs WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+            return False
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        logger.info(f"Served {target} from the blob cache ({method}).")
+        return True
+
+    def open(self, key):
+        """
+        Open the cached blob for key, for reading it without creating a file.
+
+        :return: Binary file object, or None when the blob is not cached.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM blobs WHERE key = ?", (key,)).fetchone()
+        try:
+            blob = open(self._blob_path(key), 'rb') if row else None
+        except FileNotFoundError:
+            blob = None
+        with self._lock:
+            if blob is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE blobs SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return blob
+
+    def store(self, key, source):
+        """
+        Add a finished download to the cache, then evict blobs over the size limit.
+
+        :param key: Key from blob_key().
+        :param source: Path of the downloaded file.
+        """
+        size = os.path.getsize(source)
+        if size > self.max_size:
+            return
+        blob = self._blob_path(key)
+        with self._lock:
+            known = self._conn.execute("SELECT 1 FROM blobs WHERE key = ?", (key,)).fetchone()
+        if not known or not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp_path = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                place(source, tmp_path, self.mode)
+                os.replace(tmp_path, blob)
+            except OSError as e:
+                logger.warning(f"Could not add {source} to the blob cache: {e}")
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (key, size, time.time()))
+            self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used blobs until the cache fits in max_size."""
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_size:
+                return
+            evicted = []
+            for key, size in self._conn.execute("SELECT key, size FROM blobs ORDER BY last_used").fetchall():
+                if total <= self.max_size:
+                    break
+                evicted.append(key)
+                total -= size
+            self._conn.executemany("DELETE FROM blobs WHERE key = ?", [(key,) for key in evicted])
+            self._conn.commit()
+            self.evictions += len(evicted)
+        for key in evicted:
+            try:
+                os.remove(self._blob_path(key))
+            except FileNotFoundError:
+                pass
+        logger.debug(f"Evicted {len(evicted)} blobs from the cache.")
+
+    def close(self):
+        self._conn.close()
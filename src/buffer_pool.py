@@ -0,0 +1,126 @@
+import threading
+from contextlib import contextmanager
+
+# Responses are read in pieces of this size, whatever the size of the request
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# Memory all downloads in a process may hold at once for read buffers and reordering
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# Share of the budget kept for parts waiting in OrderedHasher reorder buffers
+REORDER_SHARE = 0.25
+
+
+class BufferPool:
+    """
+    Reusable read buffers shared by every download in a process, under one memory budget.
+
+    Responses are read into a buffer with readinto() and written out from a memoryview of
+    it, so no bytes object is created per read, and the buffer goes back to the pool for
+    the next read. Buffers are allocated on first use and kept; once the budget is taken,
+    further downloads wait for a buffer instead of allocating, so memory stays flat however
+    many downloads run at once and however large their files or chunks are.
+
+    A share of the budget is kept for copies of ranged parts that arrive ahead of the
+    hashing position (see OrderedHasher). Reserving it never blocks: a part that does not
+    fit is read back from disk later instead, so reordering cannot hold up the reads.
+    """
+
+    def __init__(self, budget=DEFAULT_MEMORY_BUDGET, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        :param budget: Bytes all buffers and reordered parts together may take.
+        :param buffer_size: Size of each buffer, i.e. of each read.
+        """
+        self.reorder_budget = int(budget * REORDER_SHARE)
+        buffers = budget - self.reorder_budget
+        self.buffer_size = max(1, min(buffer_size, buffers))
+        self.capacity = max(1, buffers // self.buffer_size)
+        # Number of times a download had to wait for a buffer
+        self.waits = 0
+        self._free = []
+        self._allocated = 0
+        self._reserved = 0
+        self._condition = threading.Condition()
+
+    @property
+    def allocated(self):
+        """Number of buffers allocated so far."""
+        return self._allocated
+
+    def acquire(self):
+        with self._condition:
+            while not self._free and self._allocated >= self.capacity:
+                self.waits += 1
+                self._condition.wait()
+            if self._free:
+                return self._free.pop()
+            self._allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        with self._condition:
+            self._free.append(buffer)
+            self._condition.notify()
+
+    def reserve(self, nbytes):
+        """Take nbytes of the reorder share if they are free; returns whether they were."""
+        with self._condition:
+            if self._reserved + nbytes > self.reorder_budget:
+                return False
+            self._reserved += nbytes
+            return True
+
+    def unreserve(self, nbytes):
+        with self._condition:
+            self._reserved -= nbytes
+
+    @contextmanager
+    def buffer(self):
+        """Yield a memoryview of a buffer for the duration of one read loop."""
+        buffer = self.acquire()
+        try:
+            with memoryview(buffer) as view:
+                yield view
+        finally:
+            self.release(buffer)
+
+
+def copy_stream(source, buffer, write, length=None, skip=0):
+    """
+    Read source into buffer until it ends, or until length bytes were passed on, and
+    hand each piece to write() as a memoryview of the buffer. The view is only valid
+    during the call, so write() must not keep it.
+
+    :param source: Object with readinto(), e.g. an http.client.HTTPResponse or a file.
+    :param buffer: Writable memoryview to read into, e.g. from BufferPool.buffer().
+    :param write: Callable receiving each piece.
+    :param length: Optional number of bytes to pass on before stopping.
+    :param skip: Number of leading bytes to read and drop, e.g. from a server that ignored a Range.
+    :return: Number of bytes passed to write().
+    """
+    copied = 0
+    while length is None or copied < length:
+        wanted = len(buffer) if length is None else min(len(buffer), length - copied + skip)
+        n = source.readinto(buffer[:wanted])
+        if not n:
+            break
+        piece = buffer[:n]
+        if skip:
+            dropped = min(skip, n)
+            piece, skip = piece[dropped:], skip - dropped
+            if not piece:
+                continue
+        write(piece)
+        copied += len(piece)
+    return copied
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def shared_buffer_pool():
+    """The BufferPool used by downloaders that are not given their own."""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = BufferPool()
+        return _shared_pool
@@ -0,0 +1,52 @@
+import logging
+
+logger = logging.getLogger()
+
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Each chunk request should take about this long: long enough that per-request latency is
+# a small share of the transfer, short enough that a failed chunk is cheap to fetch again
+DEFAULT_TARGET_SECONDS = 1.0
+
+
+class AdaptiveChunkSize:
+    """
+    Chunk size for sequential ranged downloads, tuned from how long each chunk took.
+
+    The size doubles while chunks finish in under half the target time and halves when
+    they take more than twice as long. Every failed chunk halves it too, so flaky links
+    retry smaller requests. Sizes stay multiples of MIN_CHUNK_SIZE.
+    """
+
+    def __init__(self, initial, minimum=MIN_CHUNK_SIZE, maximum=MAX_CHUNK_SIZE,
+                 target_seconds=DEFAULT_TARGET_SECONDS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.size = self._clamp(initial)
+
+    def _clamp(self, size):
+        size = max(self.minimum, min(self.maximum, size))
+        return size - size % self.minimum
+
+    def record(self, nbytes, seconds):
+        """
+        Adjust the size after a chunk of nbytes was fetched and written in seconds.
+
+        Short final chunks say nothing about the link and are ignored.
+        """
+        if nbytes < self.size:
+            return
+        if seconds < self.target_seconds / 2:
+            self._resize(self.size * 2)
+        elif seconds > self.target_seconds * 2:
+            self._resize(self.size // 2)
+
+    def record_error(self):
+        self._resize(self.size // 2)
+
+    def _resize(self, size):
+        size = self._clamp(size)
+        if size != self.size:
+            logger.debug(f"Chunk size {self.size} -> {size} bytes.")
+            self.size = size
@@ -1,38 +1,171 @@
 import os
 import io
 import sys
+import time
 import logging
 import argparse
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-from googleapiclient.errors import HttpError
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from ranged_download import DEFAULT_PART_SIZE
+from metadata_cache import MetadataCache, METADATA_FIELDS, DEFAULT_TTL, shared_cache, fetch_metadata, batch_uri_for
+from chunk_tuning import AdaptiveChunkSize
+from download_metrics import DownloadMetrics, metrics_sinks, DEFAULT_PROGRESS_INTERVAL
+from http_pool import PooledHttp, DEFAULT_POOL_SIZE
+from rate_limit import RequestScheduler, is_rate_limited, retry_after_seconds
+from atomic_write import destination_lock, part_path, preallocate, commit, file_identity, finished_elsewhere
+from blob_cache import BlobCache, blob_key, DEFAULT_MAX_SIZE, MATERIALIZE_MODES
+from export_formats import EXPORT_MIME_TYPES, EXPORT_EXTENSIONS, GOOGLE_APPS_PREFIX, UnsupportedExportError, \
+    select_export_formats, export_paths, export_url, parse_formats
+from stream_sink import STDOUT, is_sink, open_sink, sink_name, media_url
+from buffer_pool import BufferPool, shared_buffer_pool, copy_stream, DEFAULT_MEMORY_BUDGET
+# googleapiclient and google.auth take longer to import than a cached run takes to finish,
+# so they are imported where they are first needed rather than here
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_RETRIES = 5
 
 # Configure logging to redirect stdout and stderr
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger()
 
 class GoogleDriveDownloader:
-    def __init__(self, credentials_file):
+    def __init__(self, credentials_file, api_endpoint=None, workers=1, part_size=DEFAULT_PART_SIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE, retries=DEFAULT_RETRIES, retry_delay=1.0, credentials=None,
+                 metadata_cache=None, verify=True, sha256=False, adaptive_chunks=False, write_buffer=0,
+                 metrics_hooks=None, progress_interval=DEFAULT_PROGRESS_INTERVAL, fsync=False, transport=None,
+                 scheduler=None, wait_for_lock=True, blob_cache=None, export_formats=None, buffer_pool=None):
         self.credentials_file = credentials_file
-        self.service = self.authenticate_drive()
+        # api_endpoint overrides the Drive base URL, e.g. to point at a local fake server
+        self.api_endpoint = api_endpoint
+        # Binary files larger than part_size are fetched as parallel byte ranges when workers > 1
+        self.workers = workers
+        self.part_size = part_size
+        # Interrupted binary downloads are resumed from the part journal, chunk by chunk
+        self.chunk_size = chunk_size
+        # In adaptive mode the chunk size starts at chunk_size and follows the measured link speed
+        self.adaptive_chunks = adaptive_chunks
+        self.chunk_tuner = AdaptiveChunkSize(chunk_size) if adaptive_chunks else None
+        # Chunks are collected in a write buffer of this many bytes before reaching the file and
+        # the journal; 0 writes every chunk straight through
+        self.write_buffer = write_buffer
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # Already loaded credentials can be passed in so several downloaders share one token
+        self.credentials = credentials
+        # File metadata is looked up once per file and shared by every downloader in the process
+        self.metadata_cache = metadata_cache or shared_cache
+        # Binary files are hashed as they are written and checked against Drive's checksums
+        self.verify = verify
+        self.sha256 = sha256
+        # Every download reports phase timings, progress, retries and a summary to these hooks;
+        # see DownloadMetrics. The metrics of the most recent download stay in last_metrics.
+        self.metrics_hooks = list(metrics_hooks or [])
+        self.progress_interval = progress_interval
+        self.last_metrics = None
+        # Flush finished files to stable storage before reporting them as downloaded
+        self.fsync = fsync
+        # Requests go through this PooledHttp (the process-wide one by default), whose
+        # keep-alive connections are shared with worker copies and other downloaders
+        self.transport = transport
+        # Every request is paced by this RequestScheduler (the process-wide one by default),
+        # which also retries rate limited requests once Drive allows it
+        self.scheduler = scheduler
+        # Another process downloading to the same destination is waited for (and its result
+        # reused) rather than making this download fail
+        self.wait_for_lock = wait_for_lock
+        # Optional BlobCache: files whose content is already cached are linked or copied from
+        # it after the metadata lookup instead of being downloaded
+        self.blob_cache = blob_cache
+        # Google Docs Editors files are exported to each of these formats they offer (names
+        # or MIME types, see export_formats.select_export_formats); None is one default format
+        self.export_formats = export_formats
+        # Every response is read into buffers from this BufferPool (the process-wide one by
+        # default), whose budget caps the memory all concurrent downloads take together
+        self.buffer_pool = buffer_pool or shared_buffer_pool()
+        if self.credentials is None:
+            self.credentials = self.load_credentials()
+        self._service = None
+
+    def load_credentials(self):
+        try:
+            from drive_service import load_credentials
+            # Access tokens are cached on disk, so only the first process in an hour mints one
+            return load_credentials(self.credentials_file)
+        except Exception as e:
+            logger.error(f"Failed to authenticate Google Drive: {e}")
+            sys.exit(-1)
+
+    @property
+    def service(self):
+        # Built on first use; downloads answered from the caches never need it
+        if self._service is None:
+            self._service = self.authenticate_drive()
+        return self._service
 
     def authenticate_drive(self):
         try:
-            credentials = service_account.Credentials.from_service_account_file(
-                self.credentials_file, scopes=['https://www.googleapis.com/auth/drive']
-            )
-            service = build('drive', 'v3', credentials=credentials)
+            from drive_service import build_drive_service
+            service = build_drive_service(self.credentials, self.api_endpoint, self.transport, self.scheduler)
             logger.info("Authentication successful.")
             return service
         except Exception as e:
             logger.error(f"Failed to authenticate Google Drive: {e}")
             sys.exit(-1)
 
+    def worker_copy(self):
+        """
+        Create a downloader with the same settings, credentials and transport, for a worker
+        thread that needs its own per-download state (last_metrics, the chunk tuner).
+        """
+        return GoogleDriveDownloader(self.credentials_file, api_endpoint=self.api_endpoint, workers=self.workers,
+                                     part_size=self.part_size, chunk_size=self.chunk_size, retries=self.retries,
+                                     retry_delay=self.retry_delay, credentials=self.credentials,
+                                     metadata_cache=self.metadata_cache, verify=self.verify, sha256=self.sha256,
+                                     adaptive_chunks=self.adaptive_chunks, write_buffer=self.write_buffer,
+                                     metrics_hooks=self.metrics_hooks, progress_interval=self.progress_interval,
+                                     fsync=self.fsync, transport=self.transport, scheduler=self.scheduler,
+                                     wait_for_lock=self.wait_for_lock, blob_cache=self.blob_cache,
+                                     export_formats=self.export_formats, buffer_pool=self.buffer_pool)
+
+    def _authorize(self):
+        # The token is fetched (or read from the token cache) up front rather than inside the
+        # first API call, so that its cost is reported as auth time
+        self.service
+        if not self.credentials.valid:
+            from drive_service import auth_request
+            self.credentials.refresh(auth_request(self.transport))
+
     def get_file_metadata(self, file_id):
+        return self.get_file_info(file_id)['mimeType']
+
+    def prefetch_metadata(self, file_ids):
+        """
+        Look up metadata for many files with Drive batch requests and keep it in the cache.
+
+        :param file_ids: Iterable of Drive file IDs.
+        """
+        fetch_metadata(self.service, file_ids, self.metadata_cache, batch_uri=batch_uri_for(self.api_endpoint))
+
+    def get_file_info(self, file_id, fields=None, refresh=False):
+        """
+        Return the metadata of a file, from the cache when possible.
+
+        :param file_id: ID of the Drive file.
+        :param fields: Specific fields to request, bypassing the cache. By default all of
+                       METADATA_FIELDS are requested and the result is cached.
+        :param refresh: Skip the cached copy and fetch fresh metadata.
+        """
+        from googleapiclient.errors import HttpError
+        if fields is None and not refresh:
+            cached = self.metadata_cache.get(file_id)
+            if cached is not None:
+                return cached
         try:
-            file = self.service.files().get(fileId=file_id, fields='mimeType').execute()
-            return file['mimeType']
+            file_info = self.service.files().get(fileId=file_id, fields=fields or METADATA_FIELDS,
+                                                 supportsAllDrives=True).execute()
+            if fields is None:
+                self.metadata_cache.put(file_id, file_info)
+            return file_info
         except HttpError as error:
             logger.error(f"An HTTP error occurred while retrieving metadata: {error}")
             raise
@@ -40,39 +173,381 @@ class GoogleDriveDownloader:
             logger.error(f"An error occurred while retrieving metadata: {e}")
             raise
 
+    @contextmanager
+    def _open_stream(self, url, headers=None):
+        """
+        GET url with the access token over the pooled transport and yield the response
+        with its body unread. Rate limited requests are retried as the scheduler allows and
+        other error responses are raised as HttpErrors.
+        """
+        from googleapiclient.errors import HttpError
+        from drive_service import shared_transport, shared_scheduler, scheduler_key, auth_request
+        import httplib2
+        transport = self.transport or shared_transport()
+        scheduler = self.scheduler or shared_scheduler()
+        key = scheduler_key(self.credentials)
+        attempt = 0
+        refreshed = False
+        while True:
+            scheduler.wait_for_request(key)
+            request_headers = dict(headers or {})
+            self.credentials.apply(request_headers)
+            with transport.stream(url, headers=request_headers) as response:
+                if response.status < 400:
+                    yield response
+                    return
+                body = response.read()
+            if is_rate_limited(response.status, body) and attempt < scheduler.retries:
+                attempt += 1
+                delay = scheduler.rate_limited_delay(key, attempt, retry_after_seconds(response.getheader('retry-after')))
+                logger.warning(f"Rate limited by Drive; retrying in {delay:.2f}s (attempt {attempt}/{scheduler.retries}).")
+                continue
+            if response.status != 401 or refreshed:
+                raise HttpError(httplib2.Response(response), body, uri=url)
+            self.credentials.refresh(auth_request(self.transport))
+            refreshed = True
+
+    def _stream_export(self, url, path, metrics):
+        from drive_service import shared_scheduler
+        scheduler = self.scheduler or shared_scheduler()
+
+        def write(piece):
+            fh.write(piece)
+            metrics.add_bytes(len(piece))
+            scheduler.wait_for_bytes(len(piece))
+
+        try:
+            with io.FileIO(path, 'wb') as fh, self.buffer_pool.buffer() as buffer, \
+                    self._open_stream(url) as response:
+                metrics.start_transfer(None)
+                copy_stream(response, buffer, write)
+        except BaseException:
+            # Exports cannot be resumed, so a partial one is of no use
+            os.remove(path)
+            raise
+
+    def _export(self, file_id, file_info, export_mime_type, destination, metrics):
+        """Export the file in one format to destination, through the blob cache when there is one."""
+        from resumable_download import retry_with_backoff
+        key = self.blob_cache and blob_key(file_id, file_info, export_mime_type)
+        if key and self._from_cache(key, destination, metrics):
+            return
+        url = export_url(file_id, file_info, export_mime_type, self.api_endpoint)
+        retry_with_backoff(lambda: self._stream_export(url, part_path(destination), metrics),
+                           self.retries, base_delay=self.retry_delay, on_retry=metrics.record_retry)
+        self._commit(destination, key, metrics)
+
+    def _export_all(self, file_id, file_info, destination, metrics):
+        """
+        Export a Google Docs Editors file to every selected format, concurrently when there
+        are several.
+        """
+        paths = export_paths(destination, select_export_formats(file_info, self.export_formats))
+        if len(paths) == 1:
+            for export_mime_type, path in paths.items():
+                self._export(file_id, file_info, export_mime_type, path, metrics)
+            return
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            futures = [executor.submit(self._export, file_id, file_info, export_mime_type, path, metrics)
+                       for export_mime_type, path in paths.items()]
+        for future in futures:
+            future.result()
+
+    def _from_cache(self, key, destination, metrics):
+        """Create destination from the blob cache; returns whether it was a hit."""
+        from resumable_download import JOURNAL_SUFFIX
+        with metrics.phase('cache'):
+            hit = self.blob_cache.materialize(key, part_path(destination))
+        metrics.cache = 'hit' if hit else 'miss'
+        if hit:
+            commit(part_path(destination), destination, fsync=self.fsync)
+            # A part file left by an earlier attempt was just replaced
+            if os.path.exists(destination + JOURNAL_SUFFIX):
+                os.remove(destination + JOURNAL_SUFFIX)
+        return hit
+
+    def _commit(self, destination, key, metrics):
+        """Move the finished part file over destination and add it to the blob cache."""
+        if self.fsync:
+            with metrics.phase('fsync'):
+                commit(part_path(destination), destination, fsync=True)
+        else:
+            commit(part_path(destination), destination)
+        if key:
+            self.blob_cache.store(key, destination)
+
+    def _stream_chunks(self, file_id, fh, raw, journal, offset, size, hasher, metrics):
+        """
+        Fetch the rest of a file from offset, one ranged request per chunk, writing through
+        fh (raw is the unbuffered file underneath it) and recording progress in the journal.
+        Each response is read into one buffer from the BufferPool and written out piece by
+        piece, so the chunk size sets the number of requests, not the memory taken.
+        """
+        from drive_service import shared_scheduler
+        from resumable_download import IncompleteRangeError
+        from integrity import HashingWriter
+        scheduler = self.scheduler or shared_scheduler()
+        if hasher:
+            if hasher.offset > offset:
+                hasher.reset()
+            hasher.add_written([(0, offset - 1)] if offset else [])
+            fh = HashingWriter(fh, hasher, offset)
+        tuner = self.chunk_tuner
+        url = media_url(file_id, self.api_endpoint)
+        marked = offset
+        metrics.start_transfer(size, offset)
+
+        def write(piece):
+            fh.write(piece)
+            metrics.add_bytes(len(piece))
+            scheduler.wait_for_bytes(len(piece))
+
+        with self.buffer_pool.buffer() as buffer:
+            while offset < size:
+                end = min(offset + (tuner.size if tuner else self.chunk_size), size) - 1
+                started = time.perf_counter()
+                try:
+                    with self._open_stream(url, {'Range': f"bytes={offset}-{end}"}) as response:
+                        # A server that ignores the range sends the whole file
+                        received = copy_stream(response, buffer, write, end - offset + 1,
+                                               offset if response.status == 200 else 0)
+                    if received < end - offset + 1:
+                        raise IncompleteRangeError(f"Chunk {offset}-{end} ended after {received} bytes")
+                except Exception:
+                    if tuner:
+                        tuner.record_error()
+                    raise
+                if tuner:
+                    tuner.record(received, time.perf_counter() - started)
+                offset = end + 1
+                # Only bytes that left the write buffer are recorded as on disk
+                written = raw.tell()
+                if written > marked:
+                    journal.mark(0, written - 1)
+                    marked = written
+
+    def _download_binary(self, file_id, destination, file_info, hasher=None, metrics=None):
+        from ranged_download import RangedDownload
+        from resumable_download import PartJournal
+        from integrity import ChecksumMismatchError
+        metrics = metrics or DownloadMetrics(file_id, destination)
+        # The bytes go to the part file; the destination is only replaced once they are verified
+        part = part_path(destination)
+        journal = PartJournal(destination, file_id, file_info, data_path=part)
+        size = journal.identity['size']
+        if self.workers > 1 and size > self.part_size:
+            # Handle large binary files as parallel byte ranges
+            from drive_service import shared_scheduler
+            RangedDownload(self._open_stream, media_url(file_id, self.api_endpoint), part, size, journal,
+                           part_size=self.part_size, workers=self.workers, hasher=hasher, metrics=metrics,
+                           buffer_pool=self.buffer_pool, scheduler=self.scheduler or shared_scheduler()).run()
+        else:
+            offset = journal.contiguous_offset()
+            raw = io.FileIO(part, 'r+b' if offset else 'wb')
+            raw.seek(offset)
+            raw.truncate()
+            # Ranges written past the gap by an earlier ranged run are gone from disk now
+            if journal.completed_bytes() > offset:
+                journal.truncate(offset)
+            preallocate(raw.fileno(), size)
+            fh = io.BufferedWriter(raw, self.write_buffer) if self.write_buffer else raw
+            written = offset
+            try:
+                with fh:
+                    try:
+                        self._stream_chunks(file_id, fh, raw, journal, offset, size, hasher, metrics)
+                    finally:
+                        fh.flush()
+                        written = raw.tell()
+            finally:
+                # Whatever was flushed when the stream stopped is on disk and can be resumed from;
+                # the file size says nothing since the part file is preallocated
+                if written > journal.contiguous_offset():
+                    journal.mark(0, written - 1)
+        if hasher:
+            try:
+                digests = hasher.verify(file_info)
+            except ChecksumMismatchError:
+                # The bytes on disk cannot be trusted, so the next attempt starts from scratch,
+                # and a later run looks the checksum up again in case the cached one was stale
+                journal.remove()
+                hasher.reset()
+                self.metadata_cache.invalidate(file_id)
+                raise
+            logger.info(f"Checksum verified: {', '.join(f'{name} {digest}' for name, digest in digests.items())}.")
+        journal.remove()
+
     def download_file(self, file_id, destination):
-        mime_type = self.get_file_metadata(file_id)
+        """
+        Download a file, or export a Google Docs Editors file.
+
+        :param file_id: ID of the Drive file.
+        :param destination: Local path to write to, '-' for standard output, or any object
+                            with a write() method. Streams are written to as the data
+                            arrives, without part files, locking or resuming from disk.
+        :return: None on success, the HTTP response when the file was not found.
+        """
+        if is_sink(destination):
+            return self._download_to_sink(file_id, destination)
+        metrics = DownloadMetrics(file_id, destination, self.metrics_hooks, self.progress_interval)
+        self.last_metrics = metrics
+        try:
+            previous = file_identity(destination)
+            with destination_lock(destination, wait=self.wait_for_lock) as waited:
+                response = self._download_file(file_id, destination, metrics, previous if waited else False)
+        except BaseException as e:
+            # KeyboardInterrupt included: an interrupted download still ends its metrics
+            metrics.finish('failed', e)
+            raise
+        if response is None:
+            metrics.finish('ok')
+        else:
+            metrics.finish('failed', f"HTTP {response.status}")
+        return response
+
+    def _download_to_sink(self, file_id, destination):
+        from googleapiclient.errors import HttpError
+        metrics = DownloadMetrics(file_id, sink_name(destination), self.metrics_hooks, self.progress_interval)
+        self.last_metrics = metrics
+        try:
+            with metrics.phase('auth'):
+                self._authorize()
+            with metrics.phase('metadata'):
+                file_info = self.get_file_info(file_id)
+            self._stream_to_sink(file_id, file_info, open_sink(destination), metrics)
+            logger.info(f"File streamed successfully to {sink_name(destination)}.")
+        except HttpError as error:
+            if error.resp.status == 404:
+                logger.error(f"Error: File not found with ID {file_id}.")
+                metrics.finish('failed', f"HTTP {error.resp.status}")
+                return error.resp
+            logger.error(f"An HTTP error occurred: {error}")
+            metrics.finish('failed', error)
+            raise
+        except BaseException as e:
+            logger.error(f"An error occurred during the download: {e}")
+            metrics.finish('failed', e)
+            raise
+        metrics.finish('ok')
+        return None
+
+    def _stream_to_sink(self, file_id, file_info, sink, metrics):
+        """
+        Write a file's content to sink through one buffer from the BufferPool, so no more than
+        one read is held in memory and a slow consumer slows the download down. sink.write()
+        receives memoryviews of that buffer, valid only until it returns. Binary downloads
+        that are interrupted continue with a Range request from the last byte written and
+        are verified once complete; exports can only be retried before their first byte.
+        """
+        from drive_service import shared_scheduler
+        from resumable_download import retry_with_backoff, IncompleteRangeError
+        from integrity import OrderedHasher
+        scheduler = self.scheduler or shared_scheduler()
+        export = file_info['mimeType'].startswith(GOOGLE_APPS_PREFIX)
+        if export:
+            formats = select_export_formats(file_info, self.export_formats)
+            if len(formats) > 1:
+                raise UnsupportedExportError(f"Only one export format can be streamed, not {len(formats)}")
+            key = self.blob_cache and blob_key(file_id, file_info, formats[0])
+            url = export_url(file_id, file_info, formats[0], self.api_endpoint)
+            size = None
+            hasher = None
+        else:
+            key = self.blob_cache and blob_key(file_id, file_info)
+            url = media_url(file_id, self.api_endpoint)
+            size = int(file_info['size']) if 'size' in file_info else None
+            hasher = OrderedHasher(metrics.destination, ('md5', 'sha256') if self.sha256 else ('md5',)) \
+                if self.verify else None
+
+        if key:
+            with metrics.phase('cache'):
+                blob = self.blob_cache.open(key)
+            metrics.cache = 'hit' if blob else 'miss'
+            if blob is not None:
+                def write_cached(piece):
+                    sink.write(piece)
+                    metrics.add_bytes(len(piece))
+
+                with blob, self.buffer_pool.buffer() as buffer:
+                    metrics.start_transfer(size)
+                    copy_stream(blob, buffer, write_cached)
+                return
+
+        written = 0
+
+        def write(piece):
+            nonlocal written
+            scheduler.wait_for_bytes(len(piece))
+            sink.write(piece)
+            if hasher:
+                hasher.update(written, piece)
+            written += len(piece)
+            metrics.add_bytes(len(piece))
+
+        def attempt():
+            if export and written:
+                raise IOError(f"Export stream interrupted after {written} bytes; it cannot be resumed")
+            headers = {'Range': f"bytes={written}-"} if written else None
+            with self.buffer_pool.buffer() as buffer, self._open_stream(url, headers) as response:
+                metrics.start_transfer(size, written)
+                # A server that ignores the range sends the bytes already written again
+                copy_stream(response, buffer, write, skip=written if response.status == 200 else 0)
+            if size is not None and written < size:
+                raise IncompleteRangeError(f"Stream ended after {written} of {size} bytes")
+
+        retry_with_backoff(attempt, self.retries, base_delay=self.retry_delay, on_retry=metrics.record_retry)
+        if hasattr(sink, 'flush'):
+            sink.flush()
+        if hasher:
+            # The bytes have already been handed to the consumer, which must discard them
+            digests = hasher.verify(file_info)
+            logger.info(f"Checksum verified: {', '.join(f'{name} {digest}' for name, digest in digests.items())}.")
+
+    def _download_file(self, file_id, destination, metrics, previous=False):
+        """
+        :param previous: file_identity() of the destination before waiting for another
+                         process's lock, or False when there was no wait.
+        """
+        from googleapiclient.errors import HttpError
+        from resumable_download import retry_with_backoff, JOURNAL_SUFFIX
+        from integrity import OrderedHasher
+        with metrics.phase('auth'):
+            self._authorize()
+        # A resumed download must compare the journal against current metadata, not a cached copy
+        with metrics.phase('metadata'):
+            file_info = self.get_file_info(file_id, refresh=os.path.exists(destination + JOURNAL_SUFFIX))
+        mime_type = file_info['mimeType']
+        if previous is not False and finished_elsewhere(destination, previous, file_info):
+            logger.info(f"File was downloaded to {destination} by another process; reusing it.")
+            return None
+        part = part_path(destination)
 
         try:
-            if mime_type.startswith('application/vnd.google-apps'):
-                # Handle Google Docs Editors files
-                export_mime_types = {
-                    'application/vnd.google-apps.document': 'application/pdf',
-                    'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
-                }
-                export_mime_type = export_mime_types.get(mime_type)
-                if not export_mime_type:
-                    logger.error(f"Unsupported Google Docs Editors file type: {mime_type}")
-                    sys.exit(-1)
-
-                request = self.service.files().export_media(fileId=file_id, mimeType=export_mime_type)
-                with io.FileIO(destination, 'wb') as fh:
-                    downloader = MediaIoBaseDownload(fh, request)
-                    done = False
-                    while not done:
-                        status, done = downloader.next_chunk()
-                        logger.info(f"Export and download {int(status.progress() * 100)}%.")
+            if mime_type.startswith(GOOGLE_APPS_PREFIX):
+                # Handle Google Docs Editors files, in one or several formats
+                self._export_all(file_id, file_info, destination, metrics)
             else:
-                # Handle binary files
-                request = self.service.files().get_media(fileId=file_id)
-                with io.FileIO(destination, 'wb') as fh:
-                    downloader = MediaIoBaseDownload(fh, request)
-                    done = False
-                    while not done:
-                        status, done = downloader.next_chunk()
-                        logger.info(f"Download {int(status.progress() * 100)}%.")
+                key = self.blob_cache and blob_key(file_id, file_info)
+                if key and self._from_cache(key, destination, metrics):
+                    return None
+                # Handle binary files, resuming from the part journal after interruptions. The
+                # hasher outlives the retries, so bytes already hashed are never read again.
+                # Metadata comes from the cache on every attempt, so an attempt after a checksum
+                # mismatch (which invalidates the entry) compares against fresh checksums.
+                hasher = OrderedHasher(part, ('md5', 'sha256') if self.sha256 else ('md5',),
+                                       pool=self.buffer_pool) if self.verify else None
+                try:
+                    retry_with_backoff(lambda: self._download_binary(file_id, destination,
+                                                                     self.get_file_info(file_id), hasher, metrics),
+                                       self.retries, base_delay=self.retry_delay, on_retry=metrics.record_retry)
+                finally:
+                    if hasher:
+                        hasher.release()
+                self._commit(destination, key, metrics)
             logger.info(f"File downloaded successfully to {destination}.")
+        except UnsupportedExportError as e:
+            logger.error(str(e))
+            raise
         except HttpError as error:
             if error.resp.status == 404:
                 logger.error(f"Error: File not found with ID {file_id}.")
@@ -87,15 +562,105 @@ class GoogleDriveDownloader:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Download files from Google Drive')
     parser.add_argument('file_id', type=str, help='The ID of the file on Google Drive')
-    parser.add_argument('destination', type=str, help='The local path where the file should be saved')
+    parser.add_argument('destination', type=str, help='The local path where the file should be saved, or - for stdout')
     parser.add_argument('--credentials', type=str,
                         help='Path to the Google Drive API credentials JSON file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of parallel connections used for large binary files')
+    parser.add_argument('--part-size', type=int, default=DEFAULT_PART_SIZE // (1024 * 1024),
+                        help='Size in MiB of each byte range fetched in parallel mode')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='Number of times an interrupted download is resumed before giving up')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                        help='Size in MiB of each request in single-stream mode (the starting size with --adaptive-chunks)')
+    parser.add_argument('--adaptive-chunks', action='store_true',
+                        help='Grow the chunk size on fast links and shrink it after errors')
+    parser.add_argument('--write-buffer', type=int, default=0,
+                        help='Size in KiB of the buffer chunks are collected in before being written (0 = unbuffered)')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='Skip checking binary downloads against the md5Checksum reported by Drive')
+    parser.add_argument('--sha256', action='store_true',
+                        help='Also compute SHA-256 while downloading and check it when Drive reports one')
+    parser.add_argument('--fsync', action='store_true',
+                        help='Flush the file and its directory to stable storage before reporting it as downloaded')
+    parser.add_argument('--no-wait', action='store_true',
+                        help='Fail instead of waiting when another process is downloading to the same destination')
+    parser.add_argument('--progress-interval', type=float, default=DEFAULT_PROGRESS_INTERVAL,
+                        help='Seconds between progress log lines')
+    parser.add_argument('--metrics-jsonl', type=str,
+                        help='Append phase timings, progress, retries and a summary to this JSON lines file')
+    parser.add_argument('--metrics-prom', type=str,
+                        help='Write download counters and phase timings to this file in Prometheus text format')
+    parser.add_argument('--metadata-cache', type=str,
+                        help='Path of an on-disk metadata cache shared with other processes')
+    parser.add_argument('--metadata-ttl', type=float, default=DEFAULT_TTL,
+                        help='Seconds cached metadata is trusted, e.g. longer to reuse an inventory index')
+    parser.add_argument('--api-endpoint', type=str,
+                        help='Override the Drive API base URL (e.g. a local test server)')
+    parser.add_argument('--pool-size', type=int,
+                        help=f'Keep-alive connections per host, reused across requests (default {DEFAULT_POOL_SIZE}; '
+                             f'the asyncio backend has its own default)')
+    parser.add_argument('--max-requests-per-second', type=float,
+                        help='Cap on Drive API requests per second for the credentials (e.g. the project quota)')
+    parser.add_argument('--max-bandwidth', type=float,
+                        help='Cap on download bandwidth in MiB/s')
+    parser.add_argument('--export-format', type=parse_formats,
+                        help='Comma separated formats Google Docs Editors files are exported to, e.g. pdf,docx or '
+                             'csv,ods; several formats are written side by side with their own extensions')
+    parser.add_argument('--blob-cache', type=str,
+                        help='Directory of a local content cache; files already in it are linked or copied instead of downloaded')
+    parser.add_argument('--blob-cache-size', type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help='Size limit of the blob cache in MiB; least recently used files are evicted beyond it')
+    parser.add_argument('--blob-cache-mode', choices=MATERIALIZE_MODES, default='auto',
+                        help='How cached files are placed at the destination (auto: reflink where supported, else copy)')
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                        help='Read buffers all downloads may hold at once in MiB; peak memory stays flat beyond it')
+    parser.add_argument('--backend', choices=['threads', 'asyncio'], default='threads',
+                        help='Download with httplib2 threads or the asyncio client (single stream, no --workers)')
 
     args = parser.parse_args()
+    if args.destination == STDOUT:
+        # The file's bytes go to stdout, so the log moves to stderr
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+                handler.setStream(sys.stderr)
+    scheduler = RequestScheduler(requests_per_second=args.max_requests_per_second,
+                                 bytes_per_second=args.max_bandwidth * 1024 * 1024 if args.max_bandwidth else None)
+    blob_cache = BlobCache(args.blob_cache, max_size=args.blob_cache_size * 1024 * 1024,
+                           mode=args.blob_cache_mode) if args.blob_cache else None
+    metadata_cache = MetadataCache(ttl=args.metadata_ttl, path=args.metadata_cache) if args.metadata_cache else None
 
     try:
-        downloader = GoogleDriveDownloader(credentials_file=args.credentials)
-        downloader.download_file(args.file_id, args.destination)
+        if args.backend == 'asyncio':
+            from async_download import AsyncDriveDownloader
+            from async_http import DEFAULT_POOL_SIZE as ASYNC_POOL_SIZE
+            downloader = AsyncDriveDownloader(credentials_file=args.credentials, api_endpoint=args.api_endpoint,
+                                              pool_size=args.pool_size or ASYNC_POOL_SIZE, scheduler=scheduler,
+                                              retries=args.retries, verify=not args.no_verify, sha256=args.sha256,
+                                              fsync=args.fsync, wait_for_lock=not args.no_wait, blob_cache=blob_cache,
+                                              export_formats=args.export_format,
+                                              progress_interval=args.progress_interval,
+                                              metrics_hooks=metrics_sinks(args.metrics_jsonl, args.metrics_prom),
+                                              metadata_cache=metadata_cache)
+            response = downloader.download(args.file_id, args.destination)
+        else:
+            downloader = GoogleDriveDownloader(credentials_file=args.credentials, api_endpoint=args.api_endpoint,
+                                               workers=args.workers, part_size=args.part_size * 1024 * 1024,
+                                               chunk_size=args.chunk_size * 1024 * 1024, adaptive_chunks=args.adaptive_chunks,
+                                               write_buffer=args.write_buffer * 1024,
+                                               retries=args.retries, verify=not args.no_verify, sha256=args.sha256,
+                                               fsync=args.fsync, wait_for_lock=not args.no_wait, blob_cache=blob_cache,
+                                               export_formats=args.export_format,
+                                               progress_interval=args.progress_interval,
+                                               metrics_hooks=metrics_sinks(args.metrics_jsonl, args.metrics_prom),
+                                               metadata_cache=metadata_cache,
+                                               transport=PooledHttp(pool_size=args.pool_size or DEFAULT_POOL_SIZE),
+                                               scheduler=scheduler,
+                                               buffer_pool=BufferPool(budget=args.memory_budget * 1024 * 1024))
+            response = downloader.download_file(args.file_id, args.destination)
     except Exception as e:
         logger.error(f"Failed to download file: {e}")
         sys.exit(1)
+    # An error response, e.g. a missing file streamed to stdout, is already logged but must fail a pipeline
+    if response is not None:
+        sys.exit(1)
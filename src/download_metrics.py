@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+PHASES = ('auth', 'metadata', 'cache', 'first_byte', 'transfer', 'fsync')
+# Progress is logged (and sent to hooks) at most this often per download
+DEFAULT_PROGRESS_INTERVAL = 5.0
+MIB = 1024 * 1024
+
+
+class DownloadMetrics:
+    """
+    Timings and counters for one file download.
+
+    Phases are timed with phase(); transfer progress is reported with add_bytes(), which
+    is thread safe so parallel range workers can share one instance. Every hook is called
+    as hook(event, data) where event is 'phase', 'progress', 'retry' or 'done' and data is
+    a dict (see snapshot()). Progress is logged and sent to hooks at most once every
+    progress_interval seconds, plus once when the transfer completes.
+    """
+
+    def __init__(self, file_id, destination, hooks=(), progress_interval=DEFAULT_PROGRESS_INTERVAL):
+        self.file_id = file_id
+        self.destination = destination
+        self.hooks = list(hooks)
+        self.progress_interval = progress_interval
+        self.phases = {}
+        self.bytes = 0
+        self.total_bytes = None
+        self.retries = 0
+        self.status = 'running'
+        self.error = None
+        # 'hit' or 'miss' when a blob cache was consulted
+        self.cache = None
+        self.started = time.perf_counter()
+        self._transfer_started = None
+        self._done_before = 0
+        self._last_progress = (self.started, 0)
+        self._lock = threading.Lock()
+
+    def _emit(self, event, data):
+        for hook in self.hooks:
+            try:
+                hook(event, data)
+            except Exception as e:
+                # A broken metrics sink must never fail the download itself
+                logger.warning(f"Metrics hook failed on {event}: {e}")
+
+    def _add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self._emit('phase', {'file_id': self.file_id, 'phase': name, 'seconds': round(seconds, 6)})
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block and add it to the named phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_phase(name, time.perf_counter() - started)
+
+    def start_transfer(self, total_bytes, done_bytes=0):
+        """
+        Mark the start of the data transfer.
+
+        :param total_bytes: Size of the file, or None when unknown.
+        :param done_bytes: Bytes already on disk from an earlier attempt, not counted as transferred.
+        """
+        with self._lock:
+            self.total_bytes = total_bytes
+            # Retries call this again; only the bytes on disk before the first attempt count as done
+            if self._transfer_started is None:
+                self._done_before = done_bytes
+                self._transfer_started = time.perf_counter()
+                self._last_progress = (self._transfer_started, self.bytes)
+
+    def add_bytes(self, count):
+        """Record count bytes received and written, logging progress when it is due."""
+        now = time.perf_counter()
+        with self._lock:
+            if self._transfer_started is None:
+                self._transfer_started = now
+            if self.bytes == 0 and count and 'first_byte' not in self.phases:
+                self.phases['first_byte'] = now - self._transfer_started
+            self.bytes += count
+            last_time, last_bytes = self._last_progress
+            complete = self.total_bytes is not None and self._done_before + self.bytes >= self.total_bytes
+            if not complete and now - last_time < self.progress_interval:
+                return
+            self._last_progress = (now, self.bytes)
+            instant = (self.bytes - last_bytes) / (now - last_time) if now > last_time else 0.0
+            data = self.snapshot(now)
+        data['instant_bytes_per_second'] = round(instant, 1)
+        if self.total_bytes:
+            done = self._done_before + data['bytes']
+            logger.info(f"Download {int(done * 100 / self.total_bytes)}% ({done / MIB:.1f} of "
+                        f"{self.total_bytes / MIB:.1f} MiB, {instant / MIB:.1f} MiB/s).")
+        else:
+            logger.info(f"Downloaded {data['bytes'] / MIB:.1f} MiB ({instant / MIB:.1f} MiB/s).")
+        self._emit('progress', data)
+
+    def record_retry(self, error, delay):
+        with self._lock:
+            self.retries += 1
+        self._emit('retry', {'file_id': self.file_id, 'retries': self.retries, 'delay': round(delay, 3),
+                             'error': str(error) or type(error).__name__})
+
+    def finish(self, status, error=None):
+        """Close the transfer phase and send the final 'done' event."""
+        now = time.perf_counter()
+        with self._lock:
+            self.status = status
+            self.error = str(error) if error is not None else None
+            if self._transfer_started is not None and 'transfer' not in self.phases:
+                self.phases['transfer'] = now - self._transfer_started - self.phases.get('fsync', 0.0)
+            data = self.snapshot(now)
+        self._emit('done', data)
+        return data
+
+    def snapshot(self, now=None):
+        """
+        Current state as a JSON-serializable dict: file_id, destination, status, bytes,
+        total_bytes, seconds, per-phase seconds, average throughput and retries.
+        """
+        now = now or time.perf_counter()
+        transfer_seconds = self.phases.get('transfer') or (
+            now - self._transfer_started if self._transfer_started is not None else 0.0)
+        data = {
+            'file_id': self.file_id,
+            'destination': self.destination,
+            'status': self.status,
+            'bytes': self.bytes,
+            'total_bytes': self.total_bytes,
+            'seconds': round(now - self.started, 6),
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'average_bytes_per_second': round(self.bytes / transfer_seconds, 1) if transfer_seconds else 0.0,
+            'retries': self.retries,
+        }
+        if self.cache:
+            data['cache'] = self.cache
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class JsonLinesSink:
+    """Metrics hook that appends every event as one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def __call__(self, event, data):
+        line = json.dumps(dict(data, event=event, time=round(time.time(), 3)))
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class PrometheusTextfile:
+    """
+    Metrics hook that aggregates finished downloads and rewrites a file in the Prometheus
+    text exposition format after each one, e.g. for node_exporter's textfile collector.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.bytes = 0
+        self.retries = 0
+        self.cache = {}
+        self.phase_seconds = {}
+        self.phase_counts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event, data):
+        if event != 'done':
+            return
+        with self._lock:
+            self.files[data['status']] = self.files.get(data['status'], 0) + 1
+            self.bytes += data['bytes']
+            self.retries += data['retries']
+            if 'cache' in data:
+                self.cache[data['cache']] = self.cache.get(data['cache'], 0) + 1
+            for name, seconds in data['phases'].items():
+                self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+                self.phase_counts[name] = self.phase_counts.get(name, 0) + 1
+            self._write()
+
+    def render(self):
+        lines = [
+            '# HELP drive_download_files_total Files whose download finished, by status.',
+            '# TYPE drive_download_files_total counter',
+        ]
+        lines += [f'drive_download_files_total{{status="{status}"}} {count}' for status, count in sorted(self.files.items())]
+        lines += [
+            '# HELP drive_download_bytes_total Bytes transferred from Drive.',
+            '# TYPE drive_download_bytes_total counter',
+            f'drive_download_bytes_total {self.bytes}',
+            '# HELP drive_download_retries_total Retried transfer attempts.',
+            '# TYPE drive_download_retries_total counter',
+            f'drive_download_retries_total {self.retries}',
+            '# HELP drive_download_cache_total Blob cache lookups, by result.',
+            '# TYPE drive_download_cache_total counter',
+        ]
+        lines += [f'drive_download_cache_total{{result="{result}"}} {count}' for result, count in sorted(self.cache.items())]
+        lines += [
+            '# HELP drive_download_phase_seconds Time spent in each download phase.',
+            '# TYPE drive_download_phase_seconds summary',
+        ]
+        for name in sorted(self.phase_seconds):
+            lines.append(f'drive_download_phase_seconds_sum{{phase="{name}"}} {self.phase_seconds[name]:.6f}')
+            lines.append(f'drive_download_phase_seconds_count{{phase="{name}"}} {self.phase_counts[name]}')
+        return '\n'.join(lines) + '\n'
+
+    def _write(self):
+        # Scrapers may read the file at any time, so it is replaced atomically
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+
+def metrics_sinks(jsonl_path=None, prometheus_path=None):
+    """
+    Build the metrics hooks requested on a command line.
+
+    :param jsonl_path: Optional path of a JSON lines file receiving every event.
+    :param prometheus_path: Optional path of a Prometheus text file with aggregated counters.
+    :return: List of hooks for GoogleDriveDownloader(metrics_hooks=...).
+    """
+    hooks = []
+    if jsonl_path:
+        hooks.append(JsonLinesSink(jsonl_path))
+    if prometheus_path:
+        hooks.append(PrometheusTextfile(prometheus_path))
+    return hooks
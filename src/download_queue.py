@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import logging
+import threading
+from itertools import islice
+from batch_download import BatchDownloader, summarize, DEFAULT_BATCH_WORKERS
+from metadata_cache import BATCH_LIMIT
+from ranged_download import DEFAULT_WORKERS
+
+logger = logging.getLogger()
+
+# Large files downloaded at once, each as ranged parts
+DEFAULT_LARGE_WORKERS = 1
+# Sort by priority, then smallest first; or by priority, then in manifest order
+ORDERS = ('size', 'manifest')
+
+
+class WorkLog:
+    """
+    Append-only JSON lines log of the state of every job in a batch: pending once queued,
+    then ok or failed. Each line is one change of state, and the last line of a
+    (file_id, destination) pair wins, so replaying the log after a crash tells which jobs
+    are done and which still have to run.
+
+    Lines are appended with a single write to an O_APPEND descriptor, so they survive the
+    process dying; with fsync they also survive the machine going down. A line cut short
+    by a crash is skipped on replay and the job keeps its earlier state.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def replay(self):
+        """
+        Read the log back.
+
+        :return: Dict of (file_id, destination) -> the job's fields merged over all its
+                 lines, in the order the jobs were first logged.
+        """
+        jobs = {}
+        if not os.path.exists(self.path):
+            return jobs
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                key = (record['file_id'], record['destination'])
+                jobs[key] = dict(jobs.get(key, {}), **record)
+        return jobs
+
+    def record(self, file_id, destination, state, **fields):
+        self.record_many([dict(fields, file_id=file_id, destination=destination, state=state)])
+
+    def record_many(self, records):
+        """
+        Append several job states with one write.
+
+        :param records: Dicts with file_id, destination, state and any other fields.
+        """
+        now = round(time.time(), 3)
+        data = ''.join(json.dumps(dict(record, time=now)) + '\n' for record in records).encode()
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                # Start on a fresh line after one left unfinished by a crash
+                if os.fstat(self._fd).st_size and not self._ends_with_newline():
+                    data = b'\n' + data
+            os.write(self._fd, data)
+            if self.fsync:
+                os.fsync(self._fd)
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class DownloadQueue:
+    """
+    Download a batch of files by priority and size rather than in manifest order, so a few
+    huge files cannot hold up hundreds of small ones.
+
+    Jobs are sorted by priority, highest first, then (with order='size') smallest first.
+    Files up to large_file_size go to a lane of `workers` single-stream downloads; larger
+    files go to a lane of large_workers downloads at a time, each fetched as ranged parts
+    by part_workers threads. Both lanes run side by side. Sizes come from batched metadata
+    lookups, so unlike BatchDownloader the whole job list is read before the first download.
+
+    With a WorkLog, every job's state is appended to it as it changes, and jobs the log
+    already has as downloaded are skipped: a restarted run only does the pending and failed
+    ones, and it can take its jobs from the log alone.
+    """
+
+    def __init__(self, downloader, workers=DEFAULT_BATCH_WORKERS, log=None, order='size', large_file_size=None,
+                 large_workers=DEFAULT_LARGE_WORKERS, part_workers=DEFAULT_WORKERS):
+        """
+        :param downloader: GoogleDriveDownloader whose settings both lanes use.
+        :param workers: Small files downloaded at once.
+        :param log: Optional WorkLog.
+        :param order: One of ORDERS.
+        :param large_file_size: Files larger than this many bytes use the large lane; by
+                                default the downloader's part_size, above which files are split.
+        :param large_workers: Large files downloaded at once.
+        :param part_workers: Ranged parts fetched at once for each large file.
+        """
+        if order not in ORDERS:
+            raise ValueError(f"order must be one of {', '.join(ORDERS)}, got {order!r}")
+        self.downloader = downloader
+        self.workers = workers
+        self.log = log
+        self.order = order
+        self.large_file_size = downloader.part_size if large_file_size is None else large_file_size
+        self.large_workers = large_workers
+        self.part_workers = part_workers
+        self.summary = None
+
+    def _lane_downloader(self, workers):
+        downloader = self.downloader.worker_copy()
+        downloader.workers = workers
+        return downloader
+
+    def _plan(self, jobs):
+        """
+        Drop the jobs the log has as done, look up the sizes of the rest and sort them.
+
+        :return: Tuple of the sorted (file_id, destination, priority, size) jobs and the number skipped.
+        """
+        logged = self.log.replay() if self.log else {}
+        if jobs is None:
+            jobs = [(file_id, destination, record.get('priority', 0))
+                    for (file_id, destination), record in logged.items()]
+        queued, skipped = [], 0
+        for job in jobs:
+            file_id, destination = job[:2]
+            if logged.get((file_id, destination), {}).get('state') == 'ok':
+                skipped += 1
+                continue
+            queued.append((file_id, destination, job[2] if len(job) > 2 else 0))
+
+        file_ids = iter([file_id for file_id, _, _ in queued])
+        for group in iter(lambda: list(islice(file_ids, BATCH_LIMIT)), []):
+            try:
+                self.downloader.prefetch_metadata(group)
+            except Exception as e:
+                # Not fatal: those files are taken as small and look their metadata up themselves
+                logger.warning(f"Batched metadata lookup failed: {e}")
+        planned = []
+        for file_id, destination, priority in queued:
+            metadata = self.downloader.metadata_cache.get(file_id) or {}
+            planned.append((file_id, destination, priority, int(metadata.get('size', 0))))
+        planned.sort(key=lambda job: (-job[2], job[3]) if self.order == 'size' else -job[2])
+
+        if self.log:
+            self.log.record_many({'file_id': file_id, 'destination': destination, 'state': 'pending',
+                                  'priority': priority, 'size': size}
+                                 for file_id, destination, priority, size in planned
+                                 if (file_id, destination) not in logged)
+        return planned, skipped
+
+    def run(self, jobs=None, on_result=None):
+        """
+        Download every job; see BatchDownloader.run for on_result and the results.
+
+        :param jobs: Iterable of (file_id, destination) or (file_id, destination, priority)
+                     tuples, or None to run the jobs in the log that are not done yet.
+        :return: List of per-file result dicts in completion order, each with the lane it ran in.
+        """
+        from drive_service import auth_request
+        if jobs is None and self.log is None:
+            raise ValueError('Jobs are needed when there is no work log to take them from')
+        started = time.perf_counter()
+        if not self.downloader.credentials.valid:
+            self.downloader.credentials.refresh(auth_request(self.downloader.transport))
+        planned, skipped = self._plan(jobs)
+        small = [(file_id, destination) for file_id, destination, _, size in planned if size <= self.large_file_size]
+        large = [(file_id, destination) for file_id, destination, _, size in planned if size > self.large_file_size]
+        logger.info(f"Queued {len(planned)} files ({len(small)} small, {len(large)} large); "
+                    f"{skipped} already downloaded.")
+
+        results = []
+        totals = {'files': 0, 'succeeded': 0, 'bytes': 0}
+        first_file = []
+        lock = threading.Lock()
+
+        def collect(lane, result):
+            result['lane'] = lane
+            if self.log:
+                fields = {'bytes': result['bytes'], 'seconds': result['seconds']}
+                if 'error' in result:
+                    fields['error'] = result['error']
+                self.log.record(result['file_id'], result['destination'], result['status'], **fields)
+            with lock:
+                totals['files'] += 1
+                totals['succeeded'] += result['status'] == 'ok'
+                totals['bytes'] += result['bytes']
+                if result['status'] == 'ok' and not first_file:
+                    first_file.append(time.perf_counter() - started)
+                if on_result:
+                    on_result(result)
+                else:
+                    results.append(result)
+
+        errors = []
+
+        def run_large():
+            try:
+                BatchDownloader(self._lane_downloader(self.part_workers), workers=self.large_workers).run(
+                    large, on_result=lambda result: collect('large', result))
+            except BaseException as e:
+                errors.append(e)
+
+        large_lane = threading.Thread(target=run_large, name='large-files', daemon=True)
+        if large:
+            large_lane.start()
+        if small:
+            BatchDownloader(self._lane_downloader(1), workers=self.workers).run(
+                small, on_result=lambda result: collect('small', result))
+        if large:
+            large_lane.join()
+        if errors:
+            raise errors[0]
+        self.summary = dict(summarize(totals, time.perf_counter() - started), skipped=skipped,
+                            first_file_seconds=round(first_file[0], 3) if first_file else None)
+        return results
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+import google_auth_httplib2
+from http_pool import PooledHttp
+from rate_limit import RequestScheduler, ScheduledHttp
+
+logger = logging.getLogger()
+
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive']
+# Directory of the on-disk token cache; an empty value turns the cache off
+TOKEN_CACHE_ENV = 'DRIVE_TOKEN_CACHE'
+DEFAULT_TOKEN_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'drive_download', 'tokens')
+# Cached tokens this close to expiry are not handed out, so a download never starts on one
+TOKEN_EXPIRY_MARGIN = 300
+
+_services = {}
+_services_lock = threading.Lock()
+_transport = None
+_scheduler = None
+
+
+class TokenCache:
+    """
+    Access tokens kept on disk until they expire, one small JSON file per service account,
+    token endpoint and scope set.
+
+    Refreshes hold an exclusive lock on the entry, so processes and threads that start
+    together wait for the first one to mint a token and then reuse it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    @contextmanager
+    def locked(self, key):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        with open(self._path(key) + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self, key):
+        """
+        Return the cached (token, expiry) for key, or None when missing, unreadable or
+        about to expire. expiry is a naive UTC datetime, as google-auth expects.
+        """
+        try:
+            with open(self._path(key), 'r') as f:
+                entry = json.load(f)
+            token, expires_at = entry['token'], float(entry['expiry'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if expires_at - time.time() < TOKEN_EXPIRY_MARGIN:
+            return None
+        expiry = datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc).replace(tzinfo=None)
+        return token, expiry
+
+    def store(self, key, token, expiry):
+        """
+        Save a token, readable by the owner only. The file is replaced atomically so
+        readers never see a half written entry.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        expires_at = expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'token': token, 'expiry': expires_at}, f)
+        os.replace(tmp_path, path)
+
+
+def token_cache_key(credentials):
+    identity = '|'.join([credentials.service_account_email, credentials._token_uri,
+                         ' '.join(sorted(credentials.scopes or []))])
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+
+class CachedTokenCredentials(service_account.Credentials):
+    """
+    Service account credentials that take their access token from a TokenCache when a
+    valid one is cached, and store freshly minted tokens in it.
+    """
+
+    token_cache = None
+
+    def _make_copy(self):
+        copy = super()._make_copy()
+        copy.token_cache = self.token_cache
+        return copy
+
+    def refresh(self, request):
+        if self.token_cache is None:
+            return super().refresh(request)
+        key = token_cache_key(self)
+        with self.token_cache.locked(key):
+            cached = self.token_cache.load(key)
+            # A refresh while already holding the cached token means the server rejected it
+            if cached is not None and cached[0] != self.token:
+                self.token, self.expiry = cached
+                return
+            super().refresh(request)
+            self.token_cache.store(key, self.token, self.expiry)
+            logger.debug(f"Cached a new access token for {self.service_account_email}")
+
+
+def default_token_cache():
+    """
+    The token cache configured by the DRIVE_TOKEN_CACHE environment variable, or the
+    per-user default. Returns None when the variable is set to an empty value.
+    """
+    directory = os.environ.get(TOKEN_CACHE_ENV, DEFAULT_TOKEN_CACHE_DIR)
+    return TokenCache(directory) if directory else None
+
+
+def load_credentials(credentials_file, scopes=DRIVE_SCOPES, token_cache=None):
+    """
+    Load service account credentials whose access tokens are shared through a token cache.
+
+    :param credentials_file: Path to the service account JSON key file.
+    :param scopes: OAuth scopes to request.
+    :param token_cache: TokenCache to use; defaults to default_token_cache().
+    :return: CachedTokenCredentials instance.
+    """
+    credentials = CachedTokenCredentials.from_service_account_file(credentials_file, scopes=scopes)
+    credentials.token_cache = token_cache or default_token_cache()
+    return credentials
+
+
+def shared_transport():
+    """
+    The PooledHttp used by default for every Drive request in the process, created on
+    first use.
+    """
+    global _transport
+    with _services_lock:
+        if _transport is None:
+            _transport = PooledHttp()
+        return _transport
+
+
+def shared_scheduler():
+    """
+    The RequestScheduler used by default in the process, created on first use. It has no
+    rate caps of its own but still backs off every worker together on rate limit errors.
+    """
+    global _scheduler
+    with _services_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+def scheduler_key(credentials):
+    """Requests are paced per service account."""
+    return getattr(credentials, 'service_account_email', None)
+
+
+def authorized_http(credentials, transport=None, scheduler=None):
+    """
+    An AuthorizedHttp sending requests with credentials over a pooled transport, paced
+    by a request scheduler.
+
+    :param credentials: Loaded Google credentials.
+    :param transport: PooledHttp to send through; defaults to shared_transport().
+    :param scheduler: RequestScheduler to go through; defaults to shared_scheduler().
+    """
+    http = ScheduledHttp(transport or shared_transport(), scheduler or shared_scheduler(),
+                         key=scheduler_key(credentials))
+    return google_auth_httplib2.AuthorizedHttp(credentials, http=http)
+
+
+def auth_request(transport=None):
+    """
+    A google-auth request adapter for refreshing credentials over a pooled transport.
+
+    :param transport: PooledHttp to send through; defaults to shared_transport().
+    """
+    return google_auth_httplib2.Request(transport or shared_transport())
+
+
+def build_drive_service(credentials, api_endpoint=None, transport=None, scheduler=None):
+    """
+    Return a Drive v3 service, building it on first use.
+
+    The discovery document is always read from the static copy bundled with
+    googleapiclient, never fetched. Requests go through a thread safe PooledHttp, so one
+    service per credentials, endpoint, transport and scheduler is shared by every thread
+    and keeps its connections alive between metadata, export and media requests.
+
+    :param credentials: Loaded Google credentials.
+    :param api_endpoint: Optional override of the Drive base URL.
+    :param transport: PooledHttp to send requests through; defaults to shared_transport().
+    :param scheduler: RequestScheduler pacing the requests; defaults to shared_scheduler().
+    :return: Google Drive service instance.
+    """
+    transport = transport or shared_transport()
+    scheduler = scheduler or shared_scheduler()
+    key = (id(credentials), api_endpoint, id(transport), id(scheduler))
+    with _services_lock:
+        # The objects are kept alongside the service so their ids cannot be reused
+        cached = _services.get(key)
+        if cached is not None and cached[0] == (credentials, transport, scheduler):
+            return cached[1]
+        client_options = {'api_endpoint': api_endpoint} if api_endpoint else None
+        service = build('drive', 'v3', http=authorized_http(credentials, transport, scheduler),
+                        client_options=client_options, static_discovery=True)
+        _services[key] = ((credentials, transport, scheduler), service)
+        return service
@@ -0,0 +1,116 @@
+import os
+from urllib.parse import quote, urlencode
+
+GOOGLE_APPS_PREFIX = 'application/vnd.google-apps'
+DEFAULT_API_ENDPOINT = 'https://www.googleapis.com/drive/v3/'
+
+# Google Docs Editors files have no binary content and are exported to these formats by default
+EXPORT_MIME_TYPES = {
+    'application/vnd.google-apps.document': 'application/pdf',
+    'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+}
+
+# Short names accepted wherever a format is selected, with the MIME types Drive may list
+# for them in exportLinks (the first one is used when a file has no exportLinks)
+EXPORT_FORMATS = {
+    'pdf': ('application/pdf',),
+    'docx': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document',),
+    'odt': ('application/vnd.oasis.opendocument.text',),
+    'rtf': ('application/rtf',),
+    'txt': ('text/plain',),
+    'html': ('text/html',),
+    'zip': ('application/zip',),
+    'epub': ('application/epub+zip',),
+    'md': ('text/markdown',),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',),
+    'ods': ('application/vnd.oasis.opendocument.spreadsheet', 'application/x-vnd.oasis.opendocument.spreadsheet'),
+    'csv': ('text/csv',),
+    'tsv': ('text/tab-separated-values',),
+    'pptx': ('application/vnd.openxmlformats-officedocument.presentationml.presentation',),
+    'odp': ('application/vnd.oasis.opendocument.presentation',),
+    'png': ('image/png',),
+    'jpeg': ('image/jpeg',),
+    'svg': ('image/svg+xml',),
+}
+EXPORT_EXTENSIONS = {mime_type: '.' + name for name, mime_types in EXPORT_FORMATS.items() for mime_type in mime_types}
+
+
+class UnsupportedExportError(ValueError):
+    pass
+
+
+def parse_formats(spec):
+    """
+    Split a comma separated list of format names or MIME types, e.g. from a command line.
+
+    :return: List of formats, or None for the default format of each file type.
+    """
+    if not spec:
+        return None
+    formats = [part.strip() for part in spec.split(',') if part.strip()]
+    for name in formats:
+        if '/' not in name and name not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {name}; expected a MIME type or one of {', '.join(EXPORT_FORMATS)}")
+    return formats
+
+
+def select_export_formats(file_info, formats=None):
+    """
+    Choose the formats a Google Docs Editors file is exported to.
+
+    The formats a file offers are the keys of its exportLinks. Files whose metadata has no
+    exportLinks can only be exported to the default format of their type.
+
+    :param file_info: Metadata of the file (mimeType, optionally exportLinks).
+    :param formats: Wanted format names or MIME types, or None for the default format.
+                    Formats the file does not offer are left out, so one list can cover
+                    documents, spreadsheets and presentations at once.
+    :return: List of export MIME types, in the order asked for.
+    :raises UnsupportedExportError: When the file offers none of the formats.
+    """
+    mime_type = file_info['mimeType']
+    default = EXPORT_MIME_TYPES.get(mime_type)
+    offered = list(file_info.get('exportLinks') or ([default] if default else []))
+    if not offered:
+        raise UnsupportedExportError(f"Unsupported Google Docs Editors file type: {mime_type}")
+    if formats is None:
+        return [default if default in offered else offered[0]]
+    selected = []
+    for name in formats:
+        candidates = EXPORT_FORMATS.get(name, (name,))
+        match = next((candidate for candidate in candidates if candidate in offered), None)
+        if match and match not in selected:
+            selected.append(match)
+    if not selected:
+        raise UnsupportedExportError(f"{mime_type} cannot be exported as {', '.join(formats)}; "
+                                     f"available: {', '.join(offered)}")
+    return selected
+
+
+def export_paths(destination, export_mime_types):
+    """
+    Where each export is written. A single export goes to destination itself; several
+    exports share destination's name, each with the extension of its format.
+
+    :return: Dict of export MIME type -> path.
+    """
+    if len(export_mime_types) == 1:
+        return {export_mime_types[0]: destination}
+    base, extension = os.path.splitext(destination)
+    if extension not in EXPORT_EXTENSIONS.values():
+        base = destination
+    return {mime_type: base + EXPORT_EXTENSIONS.get(mime_type, '.' + mime_type.rsplit('/', 1)[-1])
+            for mime_type in export_mime_types}
+
+
+def export_url(file_id, file_info, export_mime_type, api_endpoint=None):
+    """
+    URL streaming the file in one format: its exportLinks entry when there is one, which
+    also works for files above the 10 MB limit of files.export, otherwise files.export.
+    """
+    link = (file_info.get('exportLinks') or {}).get(export_mime_type)
+    if link:
+        return link
+    endpoint = (api_endpoint or DEFAULT_API_ENDPOINT).rstrip('/') + '/'
+    return f"{endpoint}files/{quote(file_id, safe='')}/export?{urlencode({'mimeType': export_mime_type})}"
@@ -0,0 +1,170 @@
+import ssl
+import zlib
+import logging
+import threading
+import http.client
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urljoin
+
+logger = logging.getLogger()
+
+# Idle keep-alive connections kept open per host; busier moments open extra connections
+# that are closed after their request
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 60
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+def _decompress(response, content):
+    encoding = response.get('content-encoding')
+    if encoding not in ('gzip', 'deflate') or not content:
+        return content
+    if encoding == 'gzip':
+        content = zlib.decompress(content, zlib.MAX_WBITS | 16)
+    else:
+        try:
+            content = zlib.decompress(content)
+        except zlib.error:
+            content = zlib.decompress(content, -zlib.MAX_WBITS)
+    # Same bookkeeping as httplib2, which googleapiclient expects
+    response['content-length'] = str(len(content))
+    response['-content-encoding'] = response.pop('content-encoding')
+    return content
+
+
+class PooledHttp:
+    """
+    Thread safe replacement for httplib2.Http that keeps HTTP/1.1 connections alive and
+    reuses them for later requests to the same host.
+
+    One instance can back every Drive service, AuthorizedHttp and token refresh in the
+    process, so metadata, export and media requests from all worker threads share a few
+    TLS connections instead of each opening its own. Each request borrows a connection
+    for its duration; a reused connection that the server has closed in the meantime is
+    replaced and the request sent again.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, ssl_context=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.follow_redirects = True
+        self.redirect_codes = frozenset(REDIRECT_STATUSES)
+        self.connections_opened = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+            if key[0] == 'https' and self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            self.connections_opened += 1
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    @staticmethod
+    def _target(uri):
+        parts = urlsplit(uri)
+        key = (parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme])
+        return key, (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+
+    def _open(self, key, target, method, body, headers):
+        """Send a request and return the connection with its response, body unread."""
+        while True:
+            connection, reused = self._checkout(key)
+            try:
+                connection.request(method, target, body=body, headers=headers)
+                return connection, connection.getresponse()
+            except ConnectionError:
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+
+    def _release(self, key, connection, response):
+        # Only a connection whose response was read to the end can carry another request
+        if response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self._checkin(key, connection)
+
+    def _send(self, uri, method, body, headers):
+        key, target = self._target(uri)
+        connection, response = self._open(key, target, method, body, headers)
+        try:
+            content = response.read()
+        except BaseException:
+            connection.close()
+            raise
+        self._release(key, connection, response)
+        return response, content
+
+    @contextmanager
+    def stream(self, uri, headers=None, redirections=5):
+        """
+        GET uri and yield the http.client.HTTPResponse with its body unread, for bodies too
+        large to hold in memory. Redirects are followed. The connection goes back to the
+        pool if the body was read to the end.
+        """
+        headers = dict(headers or {})
+        while True:
+            key, target = self._target(uri)
+            connection, response = self._open(key, target, 'GET', None, headers)
+            location = response.getheader('location')
+            if self.follow_redirects and response.status in self.redirect_codes and location and redirections > 0:
+                response.read()
+                self._release(key, connection, response)
+                uri = urljoin(uri, location)
+                redirections -= 1
+                continue
+            try:
+                yield response
+            finally:
+                self._release(key, connection, response)
+            return
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        """
+        Send a request, with the same signature and return value as httplib2.Http.request.
+
+        :return: Tuple of (httplib2.Response, content bytes).
+        """
+        import httplib2
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        headers = dict(headers or {})
+        while True:
+            response, content = self._send(uri, method, body, headers)
+            location = response.getheader('location')
+            if not (self.follow_redirects and response.status in self.redirect_codes and location
+                    and method in ('GET', 'HEAD') and redirections > 0):
+                break
+            uri = urljoin(uri, location)
+            redirections -= 1
+        resp = httplib2.Response(response)
+        resp['content-location'] = uri
+        return resp, _decompress(resp, content)
+
+    def close(self):
+        with self._lock:
+            idle = [connection for connections in self._idle.values() for connection in connections]
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger()
+
+# Drive metadata field holding the expected digest for each supported algorithm
+CHECKSUM_FIELDS = {'md5': 'md5Checksum', 'sha256': 'sha256Checksum'}
+# Parts that arrive ahead of the hashing position are kept in memory up to this many bytes;
+# beyond it they are read back from the destination (normally still in the page cache)
+DEFAULT_REORDER_BUFFER = 64 * 1024 * 1024
+HASH_READ_SIZE = 1024 * 1024
+
+
+class ChecksumMismatchError(IOError):
+    pass
+
+
+class OrderedHasher:
+    """
+    Compute digests of a file while it is being written, in byte order, even when its
+    parts are written out of order by parallel workers.
+
+    Data written at the current hashing position is hashed straight away. Parts that
+    arrive early wait in a bounded reorder buffer; parts that do not fit, and ranges
+    written by an earlier, interrupted run, are read back from the destination when the
+    hashing position reaches them. With a BufferPool, the reorder buffer also has to fit
+    in the pool's reorder share, which all downloads in the process draw from.
+    """
+
+    def __init__(self, path, algorithms=('md5',), buffer_limit=DEFAULT_REORDER_BUFFER, pool=None):
+        self.path = path
+        self.hashes = {name: hashlib.new(name) for name in algorithms}
+        self.buffer_limit = buffer_limit
+        self.pool = pool
+        self.offset = 0
+        self._buffered = {}
+        self._buffered_bytes = 0
+        self._on_disk = {}
+        self._lock = threading.Lock()
+
+    def update(self, start, data):
+        """
+        Account for data that has been written at offset start.
+
+        :param start: Offset in the file at which data was written.
+        :param data: The bytes written.
+        """
+        if not data:
+            return
+        with self._lock:
+            if start == self.offset:
+                self._hash(data)
+                self._drain()
+            elif self._buffered_bytes + len(data) <= self.buffer_limit and \
+                    (self.pool is None or self.pool.reserve(len(data))):
+                self._buffered[start] = bytes(data)
+                self._buffered_bytes += len(data)
+            else:
+                self._on_disk[start] = start + len(data) - 1
+
+    def add_written(self, ranges):
+        """
+        Account for inclusive byte ranges already on disk, e.g. from an earlier attempt.
+        Bytes this hasher has already seen are skipped, so it can be kept across retries.
+
+        :param ranges: Sorted, non-overlapping (start, end) tuples as kept by PartJournal.
+        """
+        with self._lock:
+            seen = sorted([(0, self.offset - 1)] +
+                          [(start, start + len(data) - 1) for start, data in self._buffered.items()] +
+                          list(self._on_disk.items()))
+            for start, end in ranges:
+                for seen_start, seen_end in seen:
+                    if seen_end < start or seen_start > end:
+                        continue
+                    if seen_start > start:
+                        self._on_disk[start] = seen_start - 1
+                    start = seen_end + 1
+                if start <= end:
+                    self._on_disk[start] = end
+            self._drain()
+
+    def reset(self):
+        """Forget everything hashed so far, for a download that starts over."""
+        with self._lock:
+            self.hashes = {name: hashlib.new(name) for name in self.hashes}
+            self.offset = 0
+            self._release_buffered()
+            self._on_disk.clear()
+
+    def release(self):
+        """Give the memory of parts still waiting in the reorder buffer back to the pool."""
+        with self._lock:
+            for start, data in self._buffered.items():
+                self._on_disk[start] = start + len(data) - 1
+            self._release_buffered()
+
+    def _release_buffered(self):
+        if self.pool:
+            self.pool.unreserve(self._buffered_bytes)
+        self._buffered.clear()
+        self._buffered_bytes = 0
+
+    def _hash(self, data):
+        for digest in self.hashes.values():
+            digest.update(data)
+        self.offset += len(data)
+
+    def _drain(self):
+        while True:
+            if self.offset in self._buffered:
+                data = self._buffered.pop(self.offset)
+                self._buffered_bytes -= len(data)
+                if self.pool:
+                    self.pool.unreserve(len(data))
+                self._hash(data)
+            elif self.offset in self._on_disk:
+                self._hash_from_disk(self.offset, self._on_disk.pop(self.offset))
+            else:
+                return
+
+    def _hash_from_disk(self, start, end):
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                data = f.read(min(HASH_READ_SIZE, remaining))
+                if not data:
+                    raise ChecksumMismatchError(f"{self.path} is shorter than {end + 1} bytes")
+                self._hash(data)
+                remaining -= len(data)
+
+    def hexdigests(self):
+        return {name: digest.hexdigest() for name, digest in self.hashes.items()}
+
+    def verify(self, file_info):
+        """
+        Compare the digests with the checksums Drive reports for the file.
+
+        :param file_info: Drive metadata with size and md5Checksum/sha256Checksum.
+        :return: Dict of algorithm -> hex digest.
+        :raises ChecksumMismatchError: When not every byte was hashed or a digest differs.
+        """
+        size = int(file_info.get('size', 0))
+        if self.offset != size:
+            raise ChecksumMismatchError(f"Hashed {self.offset} of {size} bytes of {self.path}")
+        digests = self.hexdigests()
+        for name, digest in digests.items():
+            expected = file_info.get(CHECKSUM_FIELDS.get(name))
+            if expected and digest != expected.lower():
+                raise ChecksumMismatchError(f"{name} mismatch for {self.path}: expected {expected}, got {digest}")
+        return digests
+
+
+class HashingWriter:
+    """
+    Minimal writable wrapper that feeds every write to an OrderedHasher before passing
+    it on, for code such as the chunked download that writes sequentially to a file object.
+    """
+
+    def __init__(self, fh, hasher, offset=0):
+        self.fh = fh
+        self.hasher = hasher
+        self.offset = offset
+
+    def write(self, data):
+        written = self.fh.write(data)
+        self.hasher.update(self.offset, data)
+        self.offset += len(data)
+        return written
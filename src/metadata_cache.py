@@ -0,0 +1,153 @@
+import json
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger()
+
+# Everything the download, verify and sync paths need, fetched in one request
+METADATA_FIELDS = 'id, name, mimeType, size, md5Checksum, sha256Checksum, modifiedTime, exportLinks'
+# Drive accepts at most 100 calls in one batch HTTP request
+BATCH_LIMIT = 100
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_TTL = 300
+DEFAULT_BATCH_URI = 'https://www.googleapis.com/batch/drive/v3'
+
+
+class MetadataCache:
+    """
+    Thread safe LRU cache of file metadata with a time to live.
+
+    With a path, entries are also stored in a small SQLite file so that separate
+    processes (the CLI, the verifier, the tests) can reuse each other's lookups.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_TTL, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS metadata "
+                               "(file_id TEXT PRIMARY KEY, data TEXT, fetched_at REAL)")
+            self._conn.commit()
+
+    def get(self, file_id):
+        """
+        Return cached metadata for a file, or None when missing or expired.
+
+        :param file_id: ID of the Drive file.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute("SELECT data, fetched_at FROM metadata WHERE file_id = ?",
+                                         (file_id,)).fetchone()
+                if row:
+                    entry = (row[1], json.loads(row[0]))
+                    self._store(file_id, entry)
+            if entry is None or now - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(file_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, file_id, metadata):
+        self.put_many({file_id: metadata})
+
+    def put_many(self, items):
+        """
+        Cache several entries at once, with a single write to the on-disk cache.
+
+        :param items: Dict of file_id -> metadata.
+        """
+        now = time.time()
+        with self._lock:
+            for file_id, metadata in items.items():
+                self._store(file_id, (now, dict(metadata)))
+            if self._conn is not None:
+                self._conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)",
+                                       [(file_id, json.dumps(metadata, separators=(',', ':')), now)
+                                        for file_id, metadata in items.items()])
+                self._conn.commit()
+
+    def _store(self, file_id, entry):
+        self._entries[file_id] = entry
+        self._entries.move_to_end(file_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM metadata")
+                self._conn.commit()
+
+    def invalidate(self, file_id):
+        with self._lock:
+            self._entries.pop(file_id, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM metadata WHERE file_id = ?", (file_id,))
+                self._conn.commit()
+
+
+def batch_uri_for(api_endpoint):
+    """
+    The batch endpoint that belongs to an overridden API endpoint.
+
+    :param api_endpoint: Base URL passed to the Drive service, or None for the default.
+    :return: Batch URL.
+    """
+    if not api_endpoint:
+        return DEFAULT_BATCH_URI
+    url = urlparse(api_endpoint)
+    return f"{url.scheme}://{url.netloc}/batch/drive/v3"
+
+
+def fetch_metadata(service, file_ids, cache, batch_uri=None):
+    """
+    Fill the cache for every ID that is not cached yet, using Drive batch requests of up
+    to BATCH_LIMIT lookups each. IDs that fail are left out; a later single lookup will
+    raise the error for them.
+
+    :param service: Authenticated Google Drive service instance.
+    :param file_ids: Iterable of Drive file IDs.
+    :param cache: MetadataCache to read from and fill.
+    :param batch_uri: Batch endpoint, see batch_uri_for.
+    :return: Number of batch HTTP requests made.
+    """
+    from googleapiclient.http import BatchHttpRequest
+    missing = [file_id for file_id in dict.fromkeys(file_ids) if cache.get(file_id) is None]
+
+    def store(request_id, response, exception):
+        if exception is None:
+            fetched[request_id] = response
+        else:
+            logger.debug(f"Batched metadata lookup failed for {request_id}: {exception}")
+
+    requests = 0
+    for start in range(0, len(missing), BATCH_LIMIT):
+        fetched = {}
+        batch = BatchHttpRequest(callback=store, batch_uri=batch_uri)
+        for file_id in missing[start:start + BATCH_LIMIT]:
+            batch.add(service.files().get(fileId=file_id, fields=METADATA_FIELDS, supportsAllDrives=True),
+                      request_id=file_id)
+        batch.execute()
+        cache.put_many(fetched)
+        requests += 1
+    return requests
+
+
+# Default cache shared by every downloader in the process
+shared_cache = MetadataCache()
@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import queue
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from download_files_gdrive import EXPORT_MIME_TYPES, EXPORT_EXTENSIONS, DEFAULT_RETRIES
+from batch_download import BatchDownloader, ProcessPoolBatch, make_downloader, DEFAULT_BATCH_WORKERS
+from sharding import parse_shard, select_shard
+from metadata_cache import METADATA_FIELDS
+from buffer_pool import DEFAULT_MEMORY_BUDGET
+
+logger = logging.getLogger()
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+LIST_PAGE_SIZE = 1000
+# Listing returns the full download metadata, so files need no separate lookup later
+LIST_FIELDS = f"nextPageToken, files({METADATA_FIELDS})"
+DEFAULT_LIST_WORKERS = 4
+_DONE = object()
+
+
+def local_name(item, taken):
+    """
+    Build a file system safe, unique name for a Drive item inside one local folder.
+
+    :param item: Drive file resource with id, name and mimeType.
+    :param taken: Names already used in the same folder; updated in place.
+    :return: The local file or directory name.
+    """
+    name = item['name'].replace('/', '_').replace('\0', '') or item['id']
+    if name in ('.', '..'):
+        name = item['id']
+    export_mime_type = EXPORT_MIME_TYPES.get(item['mimeType'])
+    if export_mime_type:
+        name += EXPORT_EXTENSIONS[export_mime_type]
+    if name in taken:
+        root, extension = os.path.splitext(name)
+        name = f"{root} ({item['id']}){extension}"
+    taken.add(name)
+    return name
+
+
+class FolderWalker:
+    """
+    Walk a Drive folder tree and yield every downloadable file as soon as it is listed.
+
+    Subfolders are listed concurrently through the downloader's Drive service, whose
+    pooled transport all worker threads share.
+    Discovered files go through a bounded queue, so listing pauses while the consumer
+    catches up and memory does not grow with the size of the tree.
+    """
+
+    def __init__(self, downloader, workers=DEFAULT_LIST_WORKERS, queue_size=LIST_PAGE_SIZE, fields=LIST_FIELDS):
+        self.downloader = downloader
+        self.workers = workers
+        self.fields = fields
+        self.queue_size = queue_size
+        self.errors = []
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._cancelled = threading.Event()
+
+    def list_children(self, folder_id):
+        """
+        Yield the children of a folder, following nextPageToken until the last page.
+
+        :param folder_id: ID of the Drive folder.
+        """
+        page_token = None
+        while True:
+            response = self.downloader.service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                pageSize=LIST_PAGE_SIZE,
+                fields=self.fields,
+                pageToken=page_token,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+            ).execute()
+            yield from response.get('files', [])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+
+    def _put(self, out, item):
+        # Give up instead of blocking forever once the consumer has stopped reading
+        while not self._cancelled.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _list_folder(self, pool, out, folder_id, directory):
+        try:
+            os.makedirs(directory, exist_ok=True)
+            taken = set()
+            for item in self.list_children(folder_id):
+                if self._cancelled.is_set():
+                    return
+                name = local_name(item, taken)
+                path = os.path.join(directory, name)
+                if item['mimeType'] == FOLDER_MIME_TYPE:
+                    self._put(out, (item, path))
+                    self._submit(pool, out, item['id'], path)
+                elif item['mimeType'].startswith('application/vnd.google-apps') \
+                        and item['mimeType'] not in EXPORT_MIME_TYPES:
+                    logger.info(f"Skipping {path}: {item['mimeType']} cannot be downloaded.")
+                else:
+                    self.downloader.metadata_cache.put(item['id'], item)
+                    self._put(out, (item, path))
+        except Exception as e:
+            # Dropped connections included: the future is never checked, so a folder listed
+            # only in part has to show up in errors
+            logger.error(f"Failed to list folder {folder_id}: {e}")
+            with self._lock:
+                self.errors.append({'folder_id': folder_id, 'destination': directory, 'error': str(e)})
+        finally:
+            with self._lock:
+                self._outstanding -= 1
+                finished = self._outstanding == 0
+            if finished:
+                self._put(out, _DONE)
+
+    def _submit(self, pool, out, folder_id, directory):
+        with self._lock:
+            self._outstanding += 1
+        pool.submit(self._list_folder, pool, out, folder_id, directory)
+
+    def walk(self, folder_id, destination):
+        """
+        Yield (file_id, local_path) for every file below folder_id.
+
+        :param folder_id: ID of the Drive folder to mirror.
+        :param destination: Local directory that mirrors the folder.
+        """
+        for item, path in self.walk_items(folder_id, destination):
+            if item['mimeType'] != FOLDER_MIME_TYPE:
+                yield item['id'], path
+
+    def walk_items(self, folder_id, destination):
+        """
+        Yield (item, local_path) for every downloadable file and every subfolder below
+        folder_id, where item is the Drive resource with the fields requested by the walker.
+        Local directories are created as folders are listed.
+        """
+        out = queue.Queue(maxsize=self.queue_size)
+        self._cancelled.clear()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            self._submit(pool, out, folder_id, destination)
+            try:
+                while True:
+                    item = out.get()
+                    if item is _DONE:
+                        return
+                    yield item
+            finally:
+                self._cancelled.set()
+
+
+def mirror_folder(downloader, folder_id, destination, workers=DEFAULT_BATCH_WORKERS,
+                  list_workers=DEFAULT_LIST_WORKERS, on_result=None, shard=None, processes=1,
+                  downloader_factory=None):
+    """
+    Download every file below a Drive folder into a local directory tree.
+
+    :param on_result: Optional callable receiving each per-file result; see BatchDownloader.run.
+    :param shard: Optional (index, count): the whole tree is listed, but only the files of
+                  this shard are downloaded, so count nodes can mirror one tree between them.
+    :param processes: Number of download processes; more than one needs downloader_factory.
+    :param downloader_factory: Picklable callable building the downloader of each process;
+                               see ProcessPoolBatch.
+    :return: Tuple of (per-file results, batch summary, listing errors).
+    """
+    walker = FolderWalker(downloader, workers=list_workers)
+    if processes > 1:
+        batch = ProcessPoolBatch(downloader_factory, processes, workers=workers,
+                                 metadata_cache=downloader.metadata_cache)
+    else:
+        batch = BatchDownloader(downloader, workers=workers)
+    results = batch.run(select_shard(walker.walk(folder_id, destination), shard), on_result=on_result)
+    return results, batch.summary, walker.errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mirror a Google Drive folder tree to a local directory')
+    parser.add_argument('folder_id', type=str, help='The ID of the folder on Google Drive')
+    parser.add_argument('destination', type=str, help='The local directory that mirrors the folder')
+    parser.add_argument('--credentials', type=str, required=True,
+                        help='Path to the Google Drive API credentials JSON file')
+    parser.add_argument('--workers', type=int, default=DEFAULT_BATCH_WORKERS,
+                        help='Number of files downloaded concurrently')
+    parser.add_argument('--list-workers', type=int, default=DEFAULT_LIST_WORKERS,
+                        help='Number of folders listed concurrently')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='Number of times an interrupted download is resumed before giving up')
+    parser.add_argument('--report', type=str,
+                        help='Write per-file results and the summary to this JSON lines file')
+    parser.add_argument('--api-endpoint', type=str,
+                        help='Override the Drive API base URL (e.g. a local test server)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Download on this many processes of --workers threads each')
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                        help='Read buffers all workers may hold at once in MiB, shared between --processes')
+    parser.add_argument('--shard', type=parse_shard,
+                        help='Only download the files of shard i/N (e.g. 0/4), to split one tree across nodes')
+
+    args = parser.parse_args()
+
+    downloader = make_downloader(vars(args))
+    # Results are streamed to the report as JSON lines so memory stays flat for very large trees
+    report = open(args.report, 'w') if args.report else None
+    try:
+        _, summary, errors = mirror_folder(
+            downloader, args.folder_id, args.destination, workers=args.workers, list_workers=args.list_workers,
+            on_result=(lambda result: report.write(json.dumps(result) + '\n')) if report else (lambda result: None),
+            shard=args.shard, processes=args.processes, downloader_factory=partial(make_downloader, vars(args)))
+        if args.shard:
+            summary['shard'] = f"{args.shard[0]}/{args.shard[1]}"
+        if report:
+            for error in errors:
+                report.write(json.dumps(dict(error, status='listing_failed')) + '\n')
+            report.write(json.dumps({'summary': summary}) + '\n')
+    except Exception as e:
+        logger.error(f"Folder mirror failed: {e}")
+        sys.exit(1)
+    finally:
+        if report:
+            report.close()
+
+    logger.info(f"Mirror finished: {json.dumps(summary)}")
+    sys.exit(0 if summary['failed'] == 0 and not errors else 1)
@@ -0,0 +1,114 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from download_metrics import DownloadMetrics
+from atomic_write import preallocate
+from buffer_pool import shared_buffer_pool, copy_stream
+
+logger = logging.getLogger()
+
+DEFAULT_PART_SIZE = 32 * 1024 * 1024
+DEFAULT_WORKERS = 4
+
+
+def plan_ranges(total_size, part_size):
+    """
+    Split a file of known size into inclusive byte ranges.
+
+    :param total_size: Size of the file in bytes.
+    :param part_size: Maximum size of each range in bytes.
+    :return: List of (start, end) tuples covering the whole file.
+    """
+    if part_size <= 0:
+        raise ValueError(f"part_size must be positive, got {part_size}")
+    return [(start, min(start + part_size, total_size) - 1)
+            for start in range(0, total_size, part_size)]
+
+
+class RangedDownload:
+    """
+    Fetch a binary file as concurrent byte ranges and write each range at its
+    offset in a preallocated destination file. Finished ranges are recorded in
+    the PartJournal so a later run only fetches what is still missing.
+
+    Every worker streams its range through a buffer from the BufferPool and writes it
+    piece by piece with pwrite, so memory is bounded by the pool rather than by
+    part_size times workers. The requests go through open_stream (the downloader's
+    pooled, paced transport), whose keep-alive connections all workers reuse. With a
+    hasher, every piece is also fed to it as soon as it is written, so the whole file
+    is verified without reading it back. Progress goes to the shared DownloadMetrics.
+    """
+
+    def __init__(self, open_stream, url, destination, total_size, journal,
+                 part_size=DEFAULT_PART_SIZE, workers=DEFAULT_WORKERS, hasher=None, metrics=None,
+                 buffer_pool=None, scheduler=None):
+        """
+        :param open_stream: Callable(url, headers) returning a context manager that yields
+                            the response with its body unread, e.g. GoogleDriveDownloader._open_stream.
+        :param url: Media URL of the file.
+        """
+        self.open_stream = open_stream
+        self.url = url
+        self.destination = destination
+        self.total_size = total_size
+        self.journal = journal
+        self.part_size = part_size
+        self.workers = workers
+        self.hasher = hasher
+        self.metrics = metrics or DownloadMetrics(url, destination)
+        self.buffer_pool = buffer_pool or shared_buffer_pool()
+        self.scheduler = scheduler
+
+    def _fetch_range(self, fd, start, end):
+        from resumable_download import IncompleteRangeError
+        expected = end - start + 1
+        position = start
+
+        def write(piece):
+            nonlocal position
+            written = 0
+            while written < len(piece):
+                written += os.pwrite(fd, piece[written:], position + written)
+            if self.hasher:
+                self.hasher.update(position, piece)
+            position += len(piece)
+            self.metrics.add_bytes(len(piece))
+            if self.scheduler:
+                self.scheduler.wait_for_bytes(len(piece))
+
+        try:
+            with self.buffer_pool.buffer() as buffer, \
+                    self.open_stream(self.url, {'Range': f"bytes={start}-{end}"}) as response:
+                # A server that ignores the range sends the whole file
+                received = copy_stream(response, buffer, write, expected, start if response.status == 200 else 0)
+            if received != expected:
+                raise IncompleteRangeError(f"Range {start}-{end} returned {received} bytes, expected {expected}")
+        finally:
+            # What arrived before a failure is on disk, so a retry only asks for the rest
+            if position > start:
+                self.journal.mark(start, position - 1)
+
+    def run(self):
+        ranges = self.journal.missing_ranges(self.part_size)
+        done_bytes = self.journal.completed_bytes()
+        logger.info(f"Downloading {self.total_size - done_bytes} of {self.total_size} bytes "
+                    f"in {len(ranges)} parts with {self.workers} workers.")
+        self.metrics.start_transfer(self.total_size, done_bytes)
+        flags = os.O_WRONLY | os.O_CREAT | (0 if self.journal.has_progress() else os.O_TRUNC)
+        fd = os.open(self.destination, flags, 0o644)
+        try:
+            os.ftruncate(fd, self.total_size)
+            preallocate(fd, self.total_size)
+            if self.hasher:
+                self.hasher.add_written(self.journal.completed)
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(self._fetch_range, fd, start, end) for start, end in ranges]
+                try:
+                    for future in futures:
+                        future.result()
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            os.close(fd)
@@ -0,0 +1,193 @@
+import json
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger()
+
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded')
+# Rate limited requests are sent again this many times before the error reaches the caller
+DEFAULT_RATE_LIMIT_RETRIES = 8
+# Drive's guidance is to back off exponentially up to about a minute
+DEFAULT_MAX_DELAY = 64.0
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """
+    Delay before retry number attempt (starting at 1): exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def is_rate_limited(status, content):
+    """
+    Decide whether a response is Drive telling the client to slow down.
+
+    :param status: HTTP status of the response.
+    :param content: Response body, bytes or str.
+    :return: True for 429 and for 403 errors with a rate limit reason.
+    """
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    try:
+        errors = json.loads(content)['error'].get('errors', [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return any(isinstance(e, dict) and e.get('reason') in RATE_LIMIT_REASONS for e in errors)
+
+
+def retry_after_seconds(value):
+    """
+    Parse a Retry-After header, given in seconds or as an HTTP date.
+
+    :return: Seconds to wait, or None when the header is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket refilled at rate tokens per second, holding at most burst.
+
+    reserve() never blocks: it takes the tokens, going into debt when there are not
+    enough, and returns how long the caller has to wait before using them. Threads sleep
+    and coroutines await that delay, so both can share one bucket.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RequestScheduler:
+    """
+    Shared pacing for every Drive request in the process.
+
+    Requests are limited to requests_per_second per credential and downloaded bytes to
+    bytes_per_second in total; both are off when None. When Drive answers a request with
+    a rate limit error, every request for that credential is held back for the
+    Retry-After the server sent, or an exponential backoff with jitter, so the workers
+    slow down together instead of all retrying into the quota at once.
+    """
+
+    def __init__(self, requests_per_second=None, bytes_per_second=None, retries=DEFAULT_RATE_LIMIT_RETRIES,
+                 base_delay=1.0, max_delay=DEFAULT_MAX_DELAY):
+        self.requests_per_second = requests_per_second
+        self.bytes = TokenBucket(bytes_per_second) if bytes_per_second else None
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Counters for reports and tests
+        self.rate_limited = 0
+        self.waited = 0.0
+        self._buckets = {}
+        self._paused_until = {}
+        self._lock = threading.Lock()
+
+    def request_delay(self, key=None):
+        """
+        Reserve a request slot for credential key.
+
+        :return: Seconds to wait before sending the request.
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None and self.requests_per_second:
+                bucket = self._buckets[key] = TokenBucket(self.requests_per_second)
+            delay = self._paused_until.get(key, 0.0) - time.monotonic()
+        if bucket is not None:
+            delay = max(delay, bucket.reserve())
+        return self._count_wait(delay)
+
+    def bytes_delay(self, nbytes):
+        """
+        Account for nbytes received.
+
+        :return: Seconds to wait before receiving more, to stay under the bandwidth cap.
+        """
+        return self._count_wait(self.bytes.reserve(nbytes) if self.bytes and nbytes else 0.0)
+
+    def rate_limited_delay(self, key, attempt, retry_after=None):
+        """
+        Record a rate limit response and hold back every request for key while backing off.
+
+        :param key: Credential the rejected request was sent with.
+        :param attempt: Number of this retry, starting at 1.
+        :param retry_after: Seconds from the response's Retry-After header, if any.
+        :return: The delay applied.
+        """
+        delay = retry_after if retry_after is not None else backoff_delay(attempt, self.base_delay, self.max_delay)
+        with self._lock:
+            self.rate_limited += 1
+            self._paused_until[key] = max(self._paused_until.get(key, 0.0), time.monotonic() + delay)
+        return delay
+
+    def _count_wait(self, delay):
+        if delay <= 0:
+            return 0.0
+        with self._lock:
+            self.waited += delay
+        return delay
+
+    def wait_for_request(self, key=None):
+        delay = self.request_delay(key)
+        if delay:
+            time.sleep(delay)
+
+    def wait_for_bytes(self, nbytes):
+        delay = self.bytes_delay(nbytes)
+        if delay:
+            time.sleep(delay)
+
+
+class ScheduledHttp:
+    """
+    httplib2-compatible wrapper that sends every request through a RequestScheduler and
+    retries rate limited ones. Once the retries are used up the rate limit response is
+    returned as is, so the caller raises its usual HttpError.
+    """
+
+    def __init__(self, http, scheduler, key=None):
+        self.http = http
+        self.scheduler = scheduler
+        self.key = key
+
+    def __getattr__(self, name):
+        # timeout, close() and friends are the wrapped transport's
+        return getattr(self.http, name)
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        attempt = 0
+        while True:
+            self.scheduler.wait_for_request(self.key)
+            response, content = self.http.request(uri, method, body=body, headers=headers, **kwargs)
+            self.scheduler.wait_for_bytes(len(content))
+            if attempt >= self.scheduler.retries or not is_rate_limited(response.status, content):
+                return response, content
+            attempt += 1
+            delay = self.scheduler.rate_limited_delay(self.key, attempt, retry_after_seconds(response.get('retry-after')))
+            logger.warning(f"Rate limited by Drive; retrying in {delay:.2f}s (attempt {attempt}/{self.scheduler.retries}).")
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import http.client
+import httplib2
+from googleapiclient.errors import HttpError
+from integrity import ChecksumMismatchError
+from rate_limit import backoff_delay, RATE_LIMIT_REASONS
+
+logger = logging.getLogger()
+
+JOURNAL_SUFFIX = '.journal'
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+class IncompleteRangeError(IOError):
+    pass
+
+
+def is_transient_error(error):
+    """
+    Decide whether a failed request is worth retrying.
+
+    :param error: The exception raised by the request.
+    :return: True for network drops, 5xx/429 responses, Drive rate limit errors and
+             downloads whose checksum did not match.
+    """
+    if isinstance(error, HttpError):
+        if error.resp.status in TRANSIENT_STATUSES:
+            return True
+        if error.resp.status == 403:
+            details = error.error_details if isinstance(error.error_details, list) else []
+            return any(isinstance(d, dict) and d.get('reason') in RATE_LIMIT_REASONS for d in details)
+        return False
+    return isinstance(error, (ConnectionError, socket.timeout, http.client.HTTPException,
+                              httplib2.HttpLib2Error, IncompleteRangeError, ChecksumMismatchError))
+
+
+def retry_with_backoff(func, retries, base_delay=1.0, max_delay=60.0, on_retry=None):
+    """
+    Call func, retrying transient failures with exponential backoff and full jitter.
+
+    :param func: Callable taking no arguments. It is expected to resume from wherever the
+                 previous attempt stopped.
+    :param retries: Number of retries after the first attempt.
+    :param base_delay: Delay ceiling in seconds for the first retry; doubles on each retry.
+    :param max_delay: Upper bound for any single delay in seconds.
+    :param on_retry: Optional callable receiving (error, delay) before each retry.
+    :return: Whatever func returns.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= retries or not is_transient_error(e):
+                raise
+            attempt += 1
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"Transfer interrupted ({e}); retrying in {delay:.2f}s (attempt {attempt}/{retries}).")
+            if on_retry:
+                on_retry(e, delay)
+            time.sleep(delay)
+
+
+class PartJournal:
+    """
+    Sidecar file next to a partially downloaded destination recording which byte ranges
+    are already on disk, keyed by the remote file's identity so a changed file is never
+    stitched together with stale bytes. The bytes themselves are in data_path, by
+    default the destination itself.
+    """
+
+    def __init__(self, destination, file_id, file_info, data_path=None):
+        self.path = destination + JOURNAL_SUFFIX
+        self.destination = data_path or destination
+        self.identity = {
+            'file_id': file_id,
+            'size': int(file_info.get('size', 0)),
+            'md5Checksum': file_info.get('md5Checksum'),
+            'modifiedTime': file_info.get('modifiedTime'),
+        }
+        self.completed = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable download journal {self.path}: {e}")
+            return
+        if {key: data.get(key) for key in self.identity} != self.identity:
+            logger.info(f"Remote file changed since the last attempt; discarding journal {self.path}.")
+            self.remove()
+            return
+        if not os.path.exists(self.destination):
+            logger.info(f"Partial file {self.destination} is missing; discarding journal.")
+            self.remove()
+            return
+        self.completed = [tuple(r) for r in data.get('completed', [])]
+        if self.completed:
+            logger.info(f"Resuming download: {self.completed_bytes()} of {self.identity['size']} bytes already on disk.")
+
+    def has_progress(self):
+        return bool(self.completed)
+
+    def completed_bytes(self):
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def contiguous_offset(self):
+        """Number of bytes already on disk from the start of the file without a gap."""
+        if self.completed and self.completed[0][0] == 0:
+            return self.completed[0][1] + 1
+        return 0
+
+    def missing_ranges(self, part_size):
+        """
+        Byte ranges not yet on disk, split into parts of at most part_size bytes.
+
+        :param part_size: Maximum size of each returned range in bytes.
+        :return: List of inclusive (start, end) tuples.
+        """
+        gaps = []
+        offset = 0
+        for start, end in self.completed:
+            if start > offset:
+                gaps.append((offset, start - 1))
+            offset = end + 1
+        if offset < self.identity['size']:
+            gaps.append((offset, self.identity['size'] - 1))
+        return [(start, min(start + part_size, end + 1) - 1)
+                for gap_start, end in gaps
+                for start in range(gap_start, end + 1, part_size)]
+
+    def mark(self, start, end):
+        """Record an inclusive byte range as written and persist the journal."""
+        with self._lock:
+            merged = []
+            for r_start, r_end in sorted(self.completed + [(start, end)]):
+                if merged and r_start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+                else:
+                    merged.append((r_start, r_end))
+            self.completed = merged
+            self._save()
+
+    def truncate(self, offset):
+        """Forget every byte from offset on, e.g. once the data file was cut off there, and persist the journal."""
+        with self._lock:
+            self.completed = [(start, min(end, offset - 1)) for start, end in self.completed if start < offset]
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(self.identity, completed=self.completed), f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        self.completed = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,123 @@
+import sys
+import json
+import zlib
+import logging
+import argparse
+
+logger = logging.getLogger()
+
+
+def parse_shard(spec):
+    """
+    Parse a shard given as 'i/N': this node handles shard i (counting from 0) of N.
+
+    :return: Tuple of (index, count).
+    """
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like i/N, e.g. 0/4: {spec}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be between 0 and {count - 1}: {spec}")
+    return index, count
+
+
+def shard_of(file_id, count):
+    """
+    The shard a file belongs to. The hash only depends on the file ID, so every node and
+    every run agrees on it without coordinating.
+    """
+    return zlib.crc32(file_id.encode('utf-8')) % count
+
+
+def select_shard(jobs, shard):
+    """
+    Keep the (file_id, destination) jobs that belong to shard.
+
+    :param jobs: Iterable of (file_id, destination) tuples; read lazily.
+    :param shard: Tuple of (index, count), or None to keep every job.
+    """
+    if shard is None:
+        yield from jobs
+        return
+    index, count = shard
+    for job in jobs:
+        if shard_of(job[0], count) == index:
+            yield job
+
+
+def _read_report(path):
+    """
+    Yield the entries of a report: the JSON object written by batch_download.py --report
+    or the JSON lines written by mirror_folder.py --report.
+    """
+    with open(path) as f:
+        first = f.readline()
+        try:
+            data = json.loads(first)
+        except ValueError:
+            # Not one object per line: a pretty-printed batch report
+            data = json.loads(first + f.read())
+            yield from data.get('results', [])
+            yield {'summary': data['summary']}
+            return
+        yield data
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def merge_reports(paths, out):
+    """
+    Combine the reports of several shards into one JSON lines report: every per-file
+    result and listing error (each listing error once, since every shard lists the whole
+    tree), followed by a summary over all shards. Reports are read one entry at a time.
+
+    :param paths: Report files to merge.
+    :param out: Writable text file receiving the merged report.
+    :return: The merged summary.
+    """
+    totals = {'files': 0, 'succeeded': 0, 'failed': 0, 'bytes': 0}
+    seconds = 0.0
+    listing_errors = set()
+    for path in paths:
+        for entry in _read_report(path):
+            if 'summary' in entry:
+                # Shards run side by side, so the slowest one is the wall-clock time
+                seconds = max(seconds, entry['summary']['seconds'])
+                continue
+            if entry.get('status') == 'listing_failed':
+                if entry['folder_id'] in listing_errors:
+                    continue
+                listing_errors.add(entry['folder_id'])
+            else:
+                totals['files'] += 1
+                totals['succeeded' if entry['status'] == 'ok' else 'failed'] += 1
+                totals['bytes'] += entry.get('bytes', 0)
+            out.write(json.dumps(entry) + '\n')
+    summary = dict(totals, seconds=round(seconds, 3), shards=len(paths), listing_errors=len(listing_errors),
+                   files_per_second=round(totals['files'] / seconds, 2) if seconds else 0.0,
+                   mib_per_second=round(totals['bytes'] / (1024 * 1024) / seconds, 2) if seconds else 0.0)
+    out.write(json.dumps({'summary': summary}) + '\n')
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Merge the reports of sharded batch or mirror runs')
+    parser.add_argument('reports', nargs='+', help='Report files written by each shard')
+    parser.add_argument('--output', type=str, help='Write the merged JSON lines report here instead of stdout')
+
+    args = parser.parse_args()
+    try:
+        output = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            summary = merge_reports(args.reports, output)
+        finally:
+            if args.output:
+                output.close()
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Failed to merge reports: {e}")
+        sys.exit(1)
+    logger.info(f"Merged {len(args.reports)} reports: {json.dumps(summary)}")
+    sys.exit(0 if summary['failed'] == 0 and not summary['listing_errors'] else 1)
@@ -0,0 +1,65 @@
+import os
+import sys
+import asyncio
+import inspect
+from urllib.parse import quote
+
+from export_formats import DEFAULT_API_ENDPOINT
+
+# Destination meaning standard output
+STDOUT = '-'
+
+
+def is_sink(destination):
+    """Whether destination is a stream to write to rather than a filesystem path."""
+    if isinstance(destination, (str, bytes, os.PathLike)):
+        return destination == STDOUT
+    return hasattr(destination, 'write')
+
+
+def open_sink(destination):
+    """The writable object behind a sink destination."""
+    return sys.stdout.buffer if destination == STDOUT else destination
+
+
+def sink_name(destination):
+    if destination == STDOUT:
+        return '<stdout>'
+    return str(getattr(destination, 'name', None) or f"<{type(destination).__name__}>")
+
+
+def media_url(file_id, api_endpoint=None):
+    endpoint = (api_endpoint or DEFAULT_API_ENDPOINT).rstrip('/') + '/'
+    return f"{endpoint}files/{quote(file_id, safe='')}?alt=media&supportsAllDrives=true"
+
+
+class AsyncSink:
+    """
+    Uniform awaitable write() over the sinks accepted by the asyncio backend: objects with
+    a coroutine write(), asyncio.StreamWriter-like objects with write() and drain(), and
+    plain blocking writables, which are written to on the default executor. Each write()
+    returns once the consumer has accepted the data, so a slow consumer slows the download
+    down instead of letting data pile up in memory.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    async def write(self, data):
+        write = self.sink.write
+        if inspect.iscoroutinefunction(write):
+            await write(data)
+        elif hasattr(self.sink, 'drain'):
+            write(data)
+            await self.sink.drain()
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, write, data)
+
+    async def flush(self):
+        flush = getattr(self.sink, 'flush', None)
+        if flush is None or hasattr(self.sink, 'drain'):
+            return
+        if inspect.iscoroutinefunction(flush):
+            await flush()
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, flush)
@@ -0,0 +1,364 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import sqlite3
+import argparse
+from download_files_gdrive import GoogleDriveDownloader, EXPORT_MIME_TYPES, DEFAULT_RETRIES
+from batch_download import BatchDownloader, DEFAULT_BATCH_WORKERS
+from mirror_folder import FolderWalker, FOLDER_MIME_TYPE, DEFAULT_LIST_WORKERS, LIST_PAGE_SIZE, local_name
+
+logger = logging.getLogger()
+
+INDEX_NAME = '.drive_sync.sqlite'
+FILE_FIELDS = 'id, name, mimeType, md5Checksum, size, modifiedTime, parents, trashed'
+SYNC_FIELDS = f"nextPageToken, files({FILE_FIELDS})"
+CHANGE_FIELDS = f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+
+
+def is_downloadable(item):
+    mime_type = item['mimeType']
+    return not mime_type.startswith('application/vnd.google-apps') or mime_type in EXPORT_MIME_TYPES
+
+
+class SyncIndex:
+    """
+    SQLite index of what a local mirror holds: one row per file and folder with the
+    Drive metadata it was downloaded at, plus the saved Changes API page token.
+    Local paths are stored relative to the mirror root.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY, parent_id TEXT, name TEXT, mime_type TEXT,
+                md5 TEXT, size INTEGER, modified_time TEXT, local_path TEXT);
+            CREATE INDEX IF NOT EXISTS files_parent ON files (parent_id);
+            CREATE TABLE IF NOT EXISTS folders (
+                folder_id TEXT PRIMARY KEY, parent_id TEXT, name TEXT, local_path TEXT);
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+    def get_state(self, key):
+        row = self.conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_state(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    def get_file(self, file_id):
+        return self.conn.execute("SELECT * FROM files WHERE file_id = ?", (file_id,)).fetchone()
+
+    def put_file(self, item, parent_id, local_path):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (item['id'], parent_id, item['name'], item['mimeType'], item.get('md5Checksum'),
+             int(item['size']) if 'size' in item else None, item.get('modifiedTime'), local_path))
+
+    def delete_file(self, file_id):
+        self.conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+
+    def get_folder(self, folder_id):
+        return self.conn.execute("SELECT * FROM folders WHERE folder_id = ?", (folder_id,)).fetchone()
+
+    def put_folder(self, folder_id, parent_id, name, local_path):
+        self.conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)",
+                          (folder_id, parent_id, name, local_path))
+
+    def move_folder(self, folder_id, parent_id, name, local_path):
+        """Re-home a folder and rewrite the paths of everything below it."""
+        old_path = self.get_folder(folder_id)['local_path']
+        self.put_folder(folder_id, parent_id, name, local_path)
+        prefix = old_path + os.sep
+        for table in ('files', 'folders'):
+            self.conn.execute(
+                f"UPDATE {table} SET local_path = ? || substr(local_path, ?) WHERE substr(local_path, 1, ?) = ?",
+                (local_path, len(old_path) + 1, len(prefix), prefix))
+
+    def delete_folder(self, folder_id):
+        """Forget a folder and everything below it."""
+        prefix = self.get_folder(folder_id)['local_path'] + os.sep
+        self.conn.execute("DELETE FROM folders WHERE folder_id = ?", (folder_id,))
+        for table in ('files', 'folders'):
+            self.conn.execute(f"DELETE FROM {table} WHERE substr(local_path, 1, ?) = ?", (len(prefix), prefix))
+
+    def names_in(self, parent_id, exclude=None):
+        """Local names already used inside a folder, for keeping new names unique."""
+        rows = self.conn.execute(
+            "SELECT file_id AS id, local_path FROM files WHERE parent_id = ? "
+            "UNION ALL SELECT folder_id AS id, local_path FROM folders WHERE parent_id = ?",
+            (parent_id, parent_id))
+        return {os.path.basename(row['local_path']) for row in rows if row['id'] != exclude}
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class DriveSync:
+    """
+    Keep a local directory in sync with a Drive folder.
+
+    The first run records a Changes API start token, mirrors the whole tree and fills
+    the index. Later runs only read the changes since the saved token and download
+    files that were added or modified; renames and moves are applied locally without
+    downloading again. The token only advances after a run without failed downloads or,
+    on the first run, failed folder listings.
+    """
+
+    def __init__(self, downloader, folder_id, destination, index_path=None, workers=DEFAULT_BATCH_WORKERS,
+                 list_workers=DEFAULT_LIST_WORKERS, delete_removed=False):
+        self.downloader = downloader
+        self.folder_id = folder_id
+        self.destination = destination
+        self.index_path = index_path or os.path.join(destination, INDEX_NAME)
+        self.workers = workers
+        self.list_workers = list_workers
+        self.delete_removed = delete_removed
+        self.index = None
+        self.stats = None
+
+    def run(self):
+        """
+        Run a full or incremental sync depending on whether a page token is saved.
+
+        :return: Dict of counters for the run.
+        """
+        os.makedirs(self.destination, exist_ok=True)
+        self.index = SyncIndex(self.index_path)
+        self.stats = {'downloaded': 0, 'skipped': 0, 'moved': 0, 'removed': 0, 'failed': 0}
+        try:
+            token = self.index.get_state('page_token')
+            if self.index.get_state('folder_id') not in (None, self.folder_id):
+                raise ValueError(f"Index {self.index_path} belongs to folder {self.index.get_state('folder_id')}")
+            if token is None:
+                self.stats['mode'] = 'full'
+                new_token = self._full_sync()
+            else:
+                self.stats['mode'] = 'incremental'
+                new_token = self._incremental_sync(token)
+            if self.stats['failed'] == 0:
+                self.index.set_state('folder_id', self.folder_id)
+                self.index.set_state('page_token', new_token)
+            else:
+                logger.warning(f"{self.stats['failed']} downloads or folder listings failed; the next run will retry them.")
+        finally:
+            self.index.close()
+        return self.stats
+
+    def _path(self, relative_path):
+        return os.path.join(self.destination, relative_path)
+
+    def _download(self, jobs):
+        """Download (item, parent_id, relative_path) jobs and record successes in the index."""
+        pending = {}
+
+        def job_stream():
+            for item, parent_id, relative_path in jobs:
+                pending[item['id']] = (item, parent_id, relative_path)
+                self.downloader.metadata_cache.put(item['id'], item)
+                yield item['id'], self._path(relative_path)
+
+        def record(result):
+            item, parent_id, relative_path = pending.pop(result['file_id'])
+            if result['status'] != 'ok':
+                self.stats['failed'] += 1
+                return
+            previous = self.index.get_file(item['id'])
+            if previous and previous['local_path'] != relative_path and os.path.exists(self._path(previous['local_path'])):
+                os.remove(self._path(previous['local_path']))
+            self.index.put_file(item, parent_id, relative_path)
+            self.stats['downloaded'] += 1
+            if self.stats['downloaded'] % LIST_PAGE_SIZE == 0:
+                self.index.commit()
+
+        BatchDownloader(self.downloader, workers=self.workers).run(job_stream(), on_result=record)
+        self.index.commit()
+
+    def _unchanged(self, item, row):
+        return (row is not None
+                and row['md5'] == item.get('md5Checksum')
+                and row['modified_time'] == item.get('modifiedTime')
+                and os.path.exists(self._path(row['local_path'])))
+
+    def _full_sync(self):
+        service = self.downloader.service
+        token = service.changes().getStartPageToken(supportsAllDrives=True).execute()['startPageToken']
+        self.index.put_folder(self.folder_id, None, '', '')
+        walker = FolderWalker(self.downloader, workers=self.list_workers, fields=SYNC_FIELDS)
+
+        def jobs():
+            for item, path in walker.walk_items(self.folder_id, self.destination):
+                relative_path = os.path.relpath(path, self.destination)
+                parent_id = self._parent_of(item, os.path.dirname(relative_path))
+                if item['mimeType'] == FOLDER_MIME_TYPE:
+                    self.index.put_folder(item['id'], parent_id, item['name'], relative_path)
+                    continue
+                row = self.index.get_file(item['id'])
+                if self._unchanged(item, row) and row['local_path'] == relative_path:
+                    self.stats['skipped'] += 1
+                    continue
+                yield item, parent_id, relative_path
+
+        self._download(jobs())
+        if walker.errors:
+            self.stats['failed'] += len(walker.errors)
+        return token
+
+    def _parent_of(self, item, parent_path):
+        for parent_id in item.get('parents', []):
+            folder = self.index.get_folder(parent_id)
+            if folder and folder['local_path'] == ('' if parent_path == '.' else parent_path):
+                return parent_id
+        return None
+
+    def _fetch_changes(self, token):
+        """Collapse every change since token into the latest state per file ID."""
+        service = self.downloader.service
+        changes = {}
+        while True:
+            response = service.changes().list(
+                pageToken=token, pageSize=LIST_PAGE_SIZE, fields=CHANGE_FIELDS,
+                includeItemsFromAllDrives=True, supportsAllDrives=True,
+            ).execute()
+            for change in response.get('changes', []):
+                changes.pop(change['fileId'], None)
+                changes[change['fileId']] = change
+            if 'newStartPageToken' in response:
+                return changes, response['newStartPageToken']
+            token = response['nextPageToken']
+
+    def _tracked_parent(self, item):
+        for parent_id in item.get('parents', []):
+            folder = self.index.get_folder(parent_id)
+            if folder:
+                return parent_id, folder['local_path']
+        return None, None
+
+    def _remove_file(self, file_id):
+        row = self.index.get_file(file_id)
+        if not row:
+            return
+        if self.delete_removed and os.path.exists(self._path(row['local_path'])):
+            os.remove(self._path(row['local_path']))
+        self.index.delete_file(file_id)
+        self.stats['removed'] += 1
+
+    def _remove_folder(self, folder_id):
+        row = self.index.get_folder(folder_id)
+        if not row or folder_id == self.folder_id:
+            return
+        if self.delete_removed and os.path.isdir(self._path(row['local_path'])):
+            shutil.rmtree(self._path(row['local_path']))
+        self.index.delete_folder(folder_id)
+        self.stats['removed'] += 1
+
+    def _apply_folder(self, item):
+        """Create, rename or move a folder; returns False while its parent is not known yet."""
+        parent_id, parent_path = self._tracked_parent(item)
+        if parent_id is None:
+            return False
+        row = self.index.get_folder(item['id'])
+        if row and row['parent_id'] == parent_id and row['name'] == item['name']:
+            return True
+        name = local_name(item, self.index.names_in(parent_id, exclude=item['id']))
+        relative_path = os.path.join(parent_path, name)
+        if row:
+            if os.path.isdir(self._path(row['local_path'])):
+                os.makedirs(os.path.dirname(self._path(relative_path)) or '.', exist_ok=True)
+                os.rename(self._path(row['local_path']), self._path(relative_path))
+            self.index.move_folder(item['id'], parent_id, item['name'], relative_path)
+            self.stats['moved'] += 1
+        else:
+            os.makedirs(self._path(relative_path), exist_ok=True)
+            self.index.put_folder(item['id'], parent_id, item['name'], relative_path)
+        return True
+
+    def _incremental_sync(self, token):
+        changes, new_token = self._fetch_changes(token)
+        logger.info(f"{len(changes)} files changed since the last sync.")
+
+        folders, files = [], []
+        for file_id, change in changes.items():
+            item = change.get('file')
+            if change.get('removed') or not item or item.get('trashed'):
+                self._remove_file(file_id)
+                self._remove_folder(file_id)
+            elif item['mimeType'] == FOLDER_MIME_TYPE:
+                folders.append(item)
+            else:
+                files.append(item)
+
+        # Apply folder changes parents-first; whatever never finds a tracked parent left the tree
+        while folders:
+            remaining = [item for item in folders if not self._apply_folder(item)]
+            if len(remaining) == len(folders):
+                for item in remaining:
+                    self._remove_folder(item['id'])
+                break
+            folders = remaining
+
+        def jobs():
+            for item in files:
+                parent_id, parent_path = self._tracked_parent(item)
+                if parent_id is None or not is_downloadable(item):
+                    self._remove_file(item['id'])
+                    continue
+                row = self.index.get_file(item['id'])
+                if row and row['parent_id'] == parent_id and row['name'] == item['name']:
+                    relative_path = row['local_path']
+                else:
+                    name = local_name(item, self.index.names_in(parent_id, exclude=item['id']))
+                    relative_path = os.path.join(parent_path, name)
+                if self._unchanged(item, row):
+                    if row['local_path'] != relative_path:
+                        os.rename(self._path(row['local_path']), self._path(relative_path))
+                        self.index.put_file(item, parent_id, relative_path)
+                        self.stats['moved'] += 1
+                    else:
+                        self.stats['skipped'] += 1
+                    continue
+                yield item, parent_id, relative_path
+
+        self._download(jobs())
+        return new_token
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Incrementally sync a Google Drive folder to a local directory')
+    parser.add_argument('folder_id', type=str, help='The ID of the folder on Google Drive')
+    parser.add_argument('destination', type=str, help='The local directory kept in sync with the folder')
+    parser.add_argument('--credentials', type=str, required=True,
+                        help='Path to the Google Drive API credentials JSON file')
+    parser.add_argument('--index', type=str,
+                        help=f"Path to the sync index (default: <destination>/{INDEX_NAME})")
+    parser.add_argument('--workers', type=int, default=DEFAULT_BATCH_WORKERS,
+                        help='Number of files downloaded concurrently')
+    parser.add_argument('--list-workers', type=int, default=DEFAULT_LIST_WORKERS,
+                        help='Number of folders listed concurrently during the first full sync')
+    parser.add_argument('--delete', action='store_true',
+                        help='Delete local copies of files that were removed or trashed on Drive')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='Number of times an interrupted download is resumed before giving up')
+    parser.add_argument('--api-endpoint', type=str,
+                        help='Override the Drive API base URL (e.g. a local test server)')
+
+    args = parser.parse_args()
+
+    downloader = GoogleDriveDownloader(args.credentials, api_endpoint=args.api_endpoint, retries=args.retries)
+    sync = DriveSync(downloader, args.folder_id, args.destination, index_path=args.index, workers=args.workers,
+                     list_workers=args.list_workers, delete_removed=args.delete)
+    try:
+        stats = sync.run()
+    except Exception as e:
+        logger.error(f"Sync failed: {e}")
+        sys.exit(1)
+
+    logger.info(f"Sync finished: {json.dumps(stats)}")
+    sys.exit(0 if stats['failed'] == 0 else 1)
@@ -1,26 +1,39 @@
 import argparse
 import sys
+import csv
+import json
+import queue
 import logging
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metadata_cache import MetadataCache, METADATA_FIELDS
 
 # Configure logging
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger()
 
-def authenticate_drive(credentials_file):
+INVENTORY_COLUMNS = ('id', 'name', 'mimeType', 'size', 'md5Checksum', 'modifiedTime', 'parents')
+INVENTORY_FORMATS = ('jsonl', 'csv')
+# Everything a later download needs too, so the listing can fill the metadata cache
+INVENTORY_FIELDS = f"nextPageToken, files({METADATA_FIELDS}, parents, driveId)"
+INVENTORY_PAGE_SIZE = 1000
+DEFAULT_INVENTORY_WORKERS = 4
+# Log the running count every this many files
+INVENTORY_PROGRESS = 100000
+_DONE = object()
+
+def authenticate_drive(credentials_file, api_endpoint=None):
     """
     Authenticate and create the Google Drive service.
 
     :param credentials_file: Path to the credentials JSON file.
+    :param api_endpoint: Optional override of the Drive base URL.
     :return: Authenticated Google Drive service instance.
     """
     try:
-        credentials = service_account.Credentials.from_service_account_file(
-            credentials_file, scopes=['https://www.googleapis.com/auth/drive']
-        )
-        service = build('drive', 'v3', credentials=credentials)
+        # Imported here so that --help and argument errors do not pay for googleapiclient
+        from drive_service import load_credentials, build_drive_service
+        service = build_drive_service(load_credentials(credentials_file), api_endpoint)
         logger.info("Authentication successful.")
         return service
     except FileNotFoundError:
@@ -30,31 +43,184 @@ def authenticate_drive(credentials_file):
         logger.error(f"Failed to authenticate Google Drive: {e}")
         sys.exit(-1)
 
-def list_files(service):
+def list_files(service, cache=None):
     """
     List the files and file IDs that are shared with the authenticated service account.
 
     :param service: Authenticated Google Drive service instance.
+    :param cache: Optional MetadataCache filled with the listed files, so later downloads skip their lookups.
     """
+    from googleapiclient.errors import HttpError
     try:
-        results = service.files().list(pageSize=100, fields="nextPageToken, files(id, name)").execute()
-        items = results.get('files', [])
-
-        if not items:
-            print('No files found.')
-        else:
-            print('Files:')
+        page_token = None
+        count = 0
+        while True:
+            results = service.files().list(pageSize=1000, fields=f"nextPageToken, files({METADATA_FIELDS})",
+                                           pageToken=page_token).execute()
+            items = results.get('files', [])
+            if cache is not None:
+                cache.put_many({item['id']: item for item in items})
             for item in items:
+                if count == 0:
+                    print('Files:')
                 print(f"{item['name']} ({item['id']})")
+                count += 1
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        if not count:
+            print('No files found.')
     except HttpError as error:
         logger.error(f"An HTTP error occurred: {error}")
     except Exception as e:
         logger.error(f"An error occurred while listing files: {e}")
 
+class InventoryLister:
+    """
+    List every file the service account can access: the user corpus (its own files and
+    files shared with it) and each shared drive it is a member of, one listing per worker
+    thread. Listed files go through a bounded queue, so listing pauses while the consumer
+    writes them out and memory stays flat however many files there are.
+    """
+
+    def __init__(self, service, workers=DEFAULT_INVENTORY_WORKERS, cache=None, shared_drives=True,
+                 queue_size=INVENTORY_PAGE_SIZE):
+        """
+        :param service: Authenticated Google Drive service instance; shared by the threads.
+        :param workers: Number of corpora listed concurrently.
+        :param cache: Optional MetadataCache filled page by page with the listed files.
+        :param shared_drives: Also list the shared drives, not only the user corpus.
+        """
+        self.service = service
+        self.workers = workers
+        self.cache = cache
+        self.shared_drives = shared_drives
+        self.queue_size = queue_size
+        self.errors = []
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._cancelled = threading.Event()
+
+    def list_drives(self):
+        """Yield the shared drives (id and name) the service account is a member of."""
+        page_token = None
+        while True:
+            response = self.service.drives().list(pageSize=100, fields='nextPageToken, drives(id, name)',
+                                                  pageToken=page_token).execute()
+            yield from response.get('drives', [])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+
+    def _put(self, out, item):
+        # Give up instead of blocking forever once the consumer has stopped reading
+        while not self._cancelled.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _list_corpus(self, out, name, skip_drives, **corpus):
+        try:
+            page_token = None
+            while not self._cancelled.is_set():
+                response = self.service.files().list(q='trashed = false', pageSize=INVENTORY_PAGE_SIZE,
+                                                     fields=INVENTORY_FIELDS, pageToken=page_token,
+                                                     supportsAllDrives=True, includeItemsFromAllDrives=True,
+                                                     **corpus).execute()
+                # Files of the drives listed on their own are left to those listings
+                items = [item for item in response.get('files', []) if item.get('driveId') not in skip_drives]
+                if self.cache is not None:
+                    self.cache.put_many({item['id']: item for item in items})
+                for item in items:
+                    self._put(out, item)
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    return
+        except Exception as e:
+            # Dropped connections and timeouts included: a corpus listed only in part has to
+            # show up as a listing error, not as a shorter inventory
+            logger.error(f"Failed to list {name}: {e}")
+            with self._lock:
+                self.errors.append({'corpus': name, 'error': str(e)})
+        finally:
+            with self._lock:
+                self._outstanding -= 1
+                finished = self._outstanding == 0
+            if finished:
+                self._put(out, _DONE)
+
+    def files(self):
+        """
+        Yield every accessible file as a Drive resource with the INVENTORY_FIELDS fields,
+        in no particular order. Corpora that fail to list are logged and recorded in errors.
+        """
+        drives = list(self.list_drives()) if self.shared_drives else []
+        skip_drives = {drive['id'] for drive in drives}
+        corpora = [('my drive and shared files', skip_drives, {'corpora': 'user'})] + \
+                  [(f"shared drive {drive['name']} ({drive['id']})", set(), {'corpora': 'drive', 'driveId': drive['id']})
+                   for drive in drives]
+        out = queue.Queue(maxsize=self.queue_size)
+        self._cancelled.clear()
+        self._outstanding = len(corpora)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for name, skip, corpus in corpora:
+                pool.submit(self._list_corpus, out, name, skip, **corpus)
+            try:
+                while True:
+                    item = out.get()
+                    if item is _DONE:
+                        return
+                    yield item
+            finally:
+                self._cancelled.set()
+
+
+def write_inventory(items, out, fmt='jsonl'):
+    """
+    Write one JSON object or CSV row per file with the INVENTORY_COLUMNS, as the files
+    arrive. In CSV, parents are separated by ';'.
+
+    :param items: Iterable of Drive file resources.
+    :param out: Writable text file.
+    :param fmt: 'jsonl' or 'csv'.
+    :return: Number of files written.
+    """
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(INVENTORY_COLUMNS)
+    count = 0
+    for item in items:
+        row = {column: item.get(column) for column in INVENTORY_COLUMNS}
+        row['parents'] = row['parents'] or []
+        if writer is not None:
+            writer.writerow(['' if row[column] is None else row[column] for column in INVENTORY_COLUMNS[:-1]]
+                            + [';'.join(row['parents'])])
+        else:
+            out.write(json.dumps(row) + '\n')
+        count += 1
+        if count % INVENTORY_PROGRESS == 0:
+            logger.info(f"Listed {count} files...")
+    return count
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Verify & get files that are shared with the service account')
 
     parser.add_argument('--credentials', required=True, type=str, help='Path to the Google Drive API credentials JSON file')
+    parser.add_argument('--metadata-cache', type=str, help='Path of an on-disk metadata cache to fill for later downloads')
+    parser.add_argument('--inventory', type=str,
+                        help='Write every accessible file, across all pages and shared drives, to this file (- for stdout)')
+    parser.add_argument('--format', choices=INVENTORY_FORMATS, default='jsonl', help='Format of the inventory')
+    parser.add_argument('--workers', type=int, default=DEFAULT_INVENTORY_WORKERS,
+                        help='Number of corpora (shared drives) listed concurrently for the inventory')
+    parser.add_argument('--no-shared-drives', action='store_true',
+                        help='Only take files owned by or shared with the service account into the inventory')
+    parser.add_argument('--api-endpoint', type=str,
+                        help='Override the Drive API base URL (e.g. a local test server)')
 
     args = parser.parse_args()
 
@@ -63,9 +229,31 @@ if __name__ == "__main__":
         logger.error("The credentials file path is required. Use --credentials to specify the path.")
         sys.exit(-1)
 
+    if args.inventory == '-':
+        # The inventory goes to stdout, so the log moves to stderr
+        for handler in logger.handlers:
+            if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+                handler.setStream(sys.stderr)
+
+    service = authenticate_drive(args.credentials, args.api_endpoint)
+    cache = MetadataCache(path=args.metadata_cache) if args.metadata_cache else None
+    if not args.inventory:
+        try:
+            list_files(service, cache)
+        except Exception as e:
+            logger.error(f"Failed to list files: {e}")
+            sys.exit(-1)
+        sys.exit(0)
+
+    lister = InventoryLister(service, workers=args.workers, cache=cache, shared_drives=not args.no_shared_drives)
+    output = sys.stdout if args.inventory == '-' else open(args.inventory, 'w', newline='')
     try:
-        service = authenticate_drive(args.credentials)
-        list_files(service)
+        count = write_inventory(lister.files(), output, args.format)
     except Exception as e:
         logger.error(f"Failed to list files: {e}")
         sys.exit(-1)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logger.info(f"Inventory finished: {count} files, {len(lister.errors)} listing errors.")
+    sys.exit(1 if lister.errors else 0)
@@ -0,0 +1,75 @@
+"""
+    Tests for adaptive chunk sizing and the write buffer of single-stream downloads
+"""
+import os, logging
+
+from download_files_gdrive import GoogleDriveDownloader
+from chunk_tuning import AdaptiveChunkSize, MIN_CHUNK_SIZE
+from resumable_download import JOURNAL_SUFFIX
+from conftest import read
+
+logger = logging.getLogger()
+
+
+def range_lengths(fake_drive, file_id):
+    lengths = []
+    for request in fake_drive.media_requests(file_id):
+        start, end = request['range'].replace('bytes=', '').split('-')
+        lengths.append(int(end) - int(start) + 1)
+    return lengths
+
+
+def test_tuner_grows_and_shrinks():
+    tuner = AdaptiveChunkSize(MIN_CHUNK_SIZE, maximum=8 * MIN_CHUNK_SIZE, target_seconds=1.0)
+    for _ in range(5):
+        tuner.record(tuner.size, 0.1)
+    assert tuner.size == 8 * MIN_CHUNK_SIZE
+
+    tuner.record(tuner.size, 3.0)
+    assert tuner.size == 4 * MIN_CHUNK_SIZE
+    tuner.record(10, 0.01)
+    assert tuner.size == 4 * MIN_CHUNK_SIZE
+    for _ in range(5):
+        tuner.record_error()
+    assert tuner.size == MIN_CHUNK_SIZE
+
+
+def test_adaptive_chunks_grow_on_fast_link(fake_drive, fake_cred_file, tmp_path):
+    logger.info("On a fast link each request asks for a larger chunk than the one before")
+    content = os.urandom(4 * 1024 * 1024)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, chunk_size=MIN_CHUNK_SIZE,
+                          adaptive_chunks=True).download_file('file', destination)
+
+    assert read(destination) == content
+    assert range_lengths(fake_drive, 'file')[:4] == [MIN_CHUNK_SIZE * 2 ** i for i in range(4)]
+
+
+def test_adaptive_chunks_shrink_after_errors(fake_drive, fake_cred_file, tmp_path):
+    content = os.urandom(2 * 1024 * 1024)
+    fake_drive.add_file('file', content)
+    fake_drive.inject_fault(status=503, count=2)
+
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, chunk_size=4 * MIN_CHUNK_SIZE,
+                          adaptive_chunks=True, retry_delay=0.01).download_file('file', str(tmp_path / 'file.bin'))
+
+    assert range_lengths(fake_drive, 'file')[:3] == [4 * MIN_CHUNK_SIZE, 2 * MIN_CHUNK_SIZE, MIN_CHUNK_SIZE]
+
+
+def test_write_buffer_resumes_from_flushed_bytes(fake_drive, fake_cred_file, tmp_path):
+    logger.info("With a write buffer, an interrupted download resumes from the bytes that reached the disk")
+    chunk = 64 * 1024
+    content = os.urandom(8 * chunk)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    fake_drive.inject_fault(drop_after=100, after=5)
+
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, chunk_size=chunk,
+                          write_buffer=3 * chunk, retry_delay=0.01).download_file('file', destination)
+
+    assert read(destination) == content
+    assert not os.path.exists(destination + JOURNAL_SUFFIX)
+    # The chunks in the buffer and the 100 bytes received before the drop were flushed
+    assert fake_drive.media_requests('file')[6]['range'] == f"bytes={5 * chunk + 100}-{6 * chunk + 99}"
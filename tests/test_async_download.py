@@ -0,0 +1,169 @@
+"""
+    Tests for the asyncio download backend
+"""
+import os, asyncio, hashlib, logging
+
+from async_download import AsyncDriveDownloader, ByteBudget
+from async_http import AsyncHTTPPool
+from resumable_download import PartJournal, JOURNAL_SUFFIX
+from atomic_write import part_path
+from download_files_gdrive import GoogleDriveDownloader
+
+logger = logging.getLogger()
+
+
+def test_async_download_single_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Download one binary file with the asyncio backend")
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    fake_drive.add_file('big', content)
+    destination = str(tmp_path / 'big.bin')
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, read_size=64 * 1024)
+    assert downloader.download('big', destination) is None
+
+    with open(destination, 'rb') as f:
+        assert f.read() == content
+    assert not os.path.exists(destination + JOURNAL_SUFFIX)
+
+
+def test_async_download_resumes_after_drop(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A dropped connection is resumed from the bytes already on disk")
+    content = os.urandom(2 * 1024 * 1024)
+    fake_drive.add_file('flaky', content)
+    fake_drive.inject_fault(drop_after=1024 * 1024)
+    destination = str(tmp_path / 'flaky.bin')
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, retry_delay=0.01)
+    assert downloader.download('flaky', destination) is None
+
+    with open(destination, 'rb') as f:
+        assert hashlib.md5(f.read()).hexdigest() == hashlib.md5(content).hexdigest()
+    ranges = [r['range'] for r in fake_drive.media_requests('flaky')]
+    assert ranges[0] is None
+    assert ranges[1] is not None and ranges[1] != 'bytes=0-'
+
+
+def test_async_download_retries_corrupted_content(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A checksum mismatch makes the download start over")
+    content = os.urandom(100 * 1024)
+    fake_drive.add_file('corrupt', content)
+    fake_drive.inject_fault(corrupt=True)
+    destination = str(tmp_path / 'corrupt.bin')
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, retry_delay=0.01)
+    assert downloader.download('corrupt', destination) is None
+
+    with open(destination, 'rb') as f:
+        assert f.read() == content
+    assert len(fake_drive.media_requests('corrupt')) == 2
+
+
+def test_async_download_missing_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Download results for a missing file are reported per file")
+    fake_drive.add_file('present', b'data')
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, retries=0)
+    results = {r['file_id']: r for r in downloader.run([('present', str(tmp_path / 'present.bin')),
+                                                        ('missing', str(tmp_path / 'missing.bin'))])}
+
+    assert results['present']['status'] == 'ok'
+    assert results['missing']['status'] == 'failed'
+    assert downloader.summary['failed'] == 1
+
+
+def test_async_download_exports_docs(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Google Docs Editors files are exported")
+    fake_drive.add_file('doc', b'%PDF-fake', mime_type='application/vnd.google-apps.document')
+    destination = str(tmp_path / 'doc.pdf')
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint)
+    assert downloader.download('doc', destination) is None
+
+    with open(destination, 'rb') as f:
+        assert f.read() == b'%PDF-fake'
+    assert any('/export' in r['path'] for r in fake_drive.requests)
+
+
+def test_async_download_many_small_files_reuse_connections(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Hundreds of small files share a few keep-alive connections")
+    contents = {f"small{i}": os.urandom(100 + i) for i in range(300)}
+    for file_id, content in contents.items():
+        fake_drive.add_file(file_id, content)
+    jobs = [(file_id, str(tmp_path / f"{file_id}.bin")) for file_id in contents]
+
+    async def main():
+        async with AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                                        concurrency=100, pool_size=10) as downloader:
+            results = await downloader.download_many(iter(jobs))
+            return downloader, results, downloader.pool.connections_opened
+
+    downloader, results, connections = asyncio.run(main())
+
+    assert all(r['status'] == 'ok' for r in results)
+    assert downloader.summary['succeeded'] == 300
+    for file_id, destination in jobs:
+        with open(destination, 'rb') as f:
+            assert f.read() == contents[file_id]
+    assert connections <= 10
+    assert len([r for r in fake_drive.requests if r['path'] == '/token']) == 1
+
+
+def test_byte_budget_bounds_reservations():
+    logger.info("Reservations wait until they fit in the budget")
+
+    async def main():
+        budget = ByteBudget(100)
+
+        async def hold(nbytes):
+            async with budget.reserve(nbytes):
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(hold(40) for _ in range(10)), hold(500))
+        return budget
+
+    budget = asyncio.run(main())
+    assert budget.peak <= 100
+    assert budget.used == 0
+
+
+def test_pool_retries_request_on_closed_idle_connection(fake_drive):
+    logger.info("An idle connection closed by the server is replaced transparently")
+    fake_drive.add_file('meta', b'x')
+
+    async def main():
+        pool = AsyncHTTPPool(pool_size=1)
+        url = fake_drive.api_endpoint + 'files/meta'
+        async with pool.request('GET', url) as response:
+            await response.read()
+        # Close the idle connection under the pool, as a server timeout would
+        pool._idle[next(iter(pool._idle))][0][1].close()
+        async with pool.request('GET', url) as response:
+            status = response.status
+            await response.read()
+        await pool.close()
+        return status, pool.connections_opened
+
+    assert asyncio.run(main()) == (200, 2)
+
+
+def test_async_resume_of_ranged_journal_forgets_cut_off_ranges(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A single stream resuming a multi-part journal drops the ranges it truncates away")
+    part_size = 64 * 1024
+    content = os.urandom(4 * part_size)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    with open(part_path(destination), 'wb') as f:
+        f.write(content[:part_size] + b'\0' * part_size + content[2 * part_size:3 * part_size])
+    journal = PartJournal(destination, 'file', fake_drive.metadata('file'), data_path=part_path(destination))
+    journal.mark(0, part_size - 1)
+    journal.mark(2 * part_size, 3 * part_size - 1)
+    fake_drive.inject_fault(drop_after=100)
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, retries=0, verify=False)
+    assert downloader.run([('file', destination)])[0]['status'] == 'failed'
+    journal = PartJournal(destination, 'file', fake_drive.metadata('file'), data_path=part_path(destination))
+    assert journal.completed == [(0, part_size + 99)]
+
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, workers=2, part_size=part_size,
+                          verify=False).download_file('file', destination)
+    with open(destination, 'rb') as f:
+        assert f.read() == content
@@ -0,0 +1,112 @@
+"""
+    Tests for atomic, lock protected writes through part files
+"""
+import os, time, logging, threading
+import pytest
+from googleapiclient.errors import HttpError
+
+from download_files_gdrive import GoogleDriveDownloader
+from async_download import AsyncDriveDownloader
+from atomic_write import destination_lock, DestinationBusyError, part_path, preallocate, LOCK_SUFFIX
+from resumable_download import JOURNAL_SUFFIX
+from conftest import CHUNK, make_downloader, read
+
+logger = logging.getLogger()
+
+
+def test_failed_download_keeps_previous_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("An interrupted download leaves the old file in place and resumes from the part file")
+    content = os.urandom(4 * CHUNK)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    with open(destination, 'wb') as f:
+        f.write(b'previous version')
+    fake_drive.inject_fault(status=500, after=2)
+
+    with pytest.raises(HttpError):
+        make_downloader(fake_drive, fake_cred_file, retries=0).download_file('file', destination)
+    assert read(destination) == b'previous version'
+    assert os.path.exists(part_path(destination))
+    assert os.path.exists(destination + JOURNAL_SUFFIX)
+    assert not os.path.exists(destination + LOCK_SUFFIX)
+
+    fake_drive.requests.clear()
+    make_downloader(fake_drive, fake_cred_file, fsync=True).download_file('file', destination)
+
+    assert read(destination) == content
+    assert fake_drive.media_requests('file')[0]['range'] == f"bytes={2 * CHUNK}-{3 * CHUNK - 1}"
+    assert not os.path.exists(part_path(destination))
+    assert not os.path.exists(destination + JOURNAL_SUFFIX)
+
+
+def test_async_failed_download_keeps_previous_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("The asyncio backend also writes through the part file")
+    fake_drive.add_file('file', os.urandom(4 * CHUNK))
+    destination = str(tmp_path / 'file.bin')
+    with open(destination, 'wb') as f:
+        f.write(b'previous version')
+    fake_drive.inject_fault(status=500)
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, retries=0)
+    with pytest.raises(HttpError):
+        downloader.download('file', destination)
+    assert read(destination) == b'previous version'
+    assert os.path.exists(part_path(destination))
+
+
+def test_lock_fails_fast_without_wait(tmp_path):
+    destination = str(tmp_path / 'file.bin')
+    with destination_lock(destination) as waited:
+        assert not waited
+        with pytest.raises(DestinationBusyError):
+            with destination_lock(destination, wait=False):
+                pass
+    assert not os.path.exists(destination + LOCK_SUFFIX)
+
+
+def test_missing_destination_directory(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A destination in a directory that does not exist fails with an error naming the directory")
+    fake_drive.add_file('file', b'content')
+    missing = str(tmp_path / 'missing')
+
+    for downloader in (GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint).download_file,
+                       AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint).download):
+        with pytest.raises(FileNotFoundError, match='Destination directory does not exist') as error:
+            downloader('file', os.path.join(missing, 'file.bin'))
+        assert error.value.filename == missing
+    assert not fake_drive.media_requests('file')
+
+
+def test_waiting_download_reuses_finished_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A download that waited on another process's lock reuses the file it finished")
+    content = os.urandom(2 * CHUNK)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    holding = threading.Event()
+
+    def other_process():
+        with destination_lock(destination):
+            holding.set()
+            time.sleep(0.3)
+            with open(part_path(destination), 'wb') as f:
+                f.write(content)
+            os.replace(part_path(destination), destination)
+
+    holder = threading.Thread(target=other_process)
+    holder.start()
+    holding.wait()
+    make_downloader(fake_drive, fake_cred_file).download_file('file', destination)
+    holder.join()
+
+    assert read(destination) == content
+    assert fake_drive.media_requests('file') == []
+
+
+def test_preallocate_reserves_size(tmp_path):
+    path = str(tmp_path / 'file.part')
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+    try:
+        preallocate(fd, 3 * CHUNK)
+    finally:
+        os.close(fd)
+    assert os.path.getsize(path) == 3 * CHUNK
@@ -0,0 +1,77 @@
+"""
+    Tests for downloading many files in one process
+"""
+import os, logging
+import pytest
+
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import BatchDownloader, parse_manifest, load_manifest
+
+logger = logging.getLogger()
+
+
+def test_parse_manifest_formats():
+    expected = [('a', 'out/a.bin'), ('b', 'out/b.bin')]
+    assert parse_manifest('{"a": "out/a.bin", "b": "out/b.bin"}') == expected
+    assert parse_manifest('[{"file_id": "a", "destination": "out/a.bin"},'
+                          ' {"file_id": "b", "destination": "out/b.bin"}]') == expected
+    assert parse_manifest('file_id,destination\na,out/a.bin\n\nb, out/b.bin\n') == expected
+
+
+def test_parse_manifest_rejects_incomplete_rows():
+    with pytest.raises(ValueError):
+        parse_manifest('a\n', 'csv')
+
+
+def test_load_manifest_from_csv_file(tmp_path):
+    path = tmp_path / 'manifest.csv'
+    path.write_text('a,out/a.bin\n')
+    assert load_manifest(str(path)) == [('a', 'out/a.bin')]
+
+
+def test_batch_download_shares_one_token(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Download many files on a worker pool with a single token")
+    contents = {f"file{i}": os.urandom(1000 + i) for i in range(20)}
+    for file_id, content in contents.items():
+        fake_drive.add_file(file_id, content)
+    jobs = [(file_id, str(tmp_path / f"{file_id}.bin")) for file_id in contents]
+
+    batch = BatchDownloader(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint), workers=4)
+    results = batch.run(iter(jobs))
+
+    assert sorted(r['file_id'] for r in results) == sorted(contents)
+    assert all(r['status'] == 'ok' for r in results)
+    for file_id, destination in jobs:
+        with open(destination, 'rb') as f:
+            assert f.read() == contents[file_id]
+    assert batch.summary['succeeded'] == 20
+    assert batch.summary['bytes'] == sum(len(c) for c in contents.values())
+    assert len([r for r in fake_drive.requests if r['path'] == '/token']) == 1
+
+
+def test_batch_download_reports_failures_per_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A missing file fails on its own without stopping the batch")
+    fake_drive.add_file('present', b'data')
+    jobs = [('present', str(tmp_path / 'present.bin')), ('missing', str(tmp_path / 'missing.bin'))]
+
+    batch = BatchDownloader(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, retries=0),
+                            workers=2)
+    results = {r['file_id']: r for r in batch.run(jobs)}
+
+    assert results['present']['status'] == 'ok'
+    assert results['missing']['status'] == 'failed'
+    assert 'error' in results['missing']
+    assert batch.summary['failed'] == 1
+
+
+def test_results_in_completion_order(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Results come back in the order the downloads finished, the last ones included")
+    for i in range(12):
+        fake_drive.add_file(f"file{i}", os.urandom(100))
+    jobs = [(f"file{i}", str(tmp_path / f"file{i}.bin")) for i in range(12)]
+
+    # One worker finishes the files one after the other, in manifest order
+    batch = BatchDownloader(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint), workers=1)
+    results = batch.run(jobs)
+
+    assert [result['file_id'] for result in results] == [file_id for file_id, _ in jobs]
@@ -0,0 +1,86 @@
+"""
+    Tests for the offline fake Drive server and the benchmark suite
+"""
+import sys, json, time, hashlib, logging, subprocess
+
+from download_files_gdrive import GoogleDriveDownloader
+from utils.fake_drive_server import FakeDriveServer, SyntheticContent
+
+logger = logging.getLogger()
+
+MIB = 1024 * 1024
+
+
+def test_synthetic_content_is_lazy_and_reproducible():
+    content = SyntheticContent(3 * MIB + 5, seed=7)
+    data = bytes(content)
+
+    assert len(data) == len(content) == 3 * MIB + 5
+    assert data == bytes(SyntheticContent(3 * MIB + 5, seed=7))
+    assert bytes(content[MIB - 3:MIB + 10]) == data[MIB - 3:MIB + 10]
+    assert bytes(content[2 * MIB:][100:200]) == data[2 * MIB + 100:2 * MIB + 200]
+    assert content.hexdigest('md5') == hashlib.md5(data).hexdigest()
+    assert data != bytes(SyntheticContent(3 * MIB + 5, seed=8))
+
+
+def test_download_synthetic_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A generated file downloads and verifies like a stored one, in ranges too")
+    content = SyntheticContent(5 * MIB, seed=1)
+    fake_drive.add_file('large', content)
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, workers=3,
+                                       part_size=MIB)
+
+    assert downloader.download_file('large', str(tmp_path / 'large.bin')) is None
+
+    with open(tmp_path / 'large.bin', 'rb') as f:
+        assert hashlib.md5(f.read()).hexdigest() == content.hexdigest('md5')
+
+
+def test_error_rate_is_seeded(tmp_path):
+    logger.info("Random errors hit the same responses for the same seed and are retried")
+    def failures(seed):
+        with FakeDriveServer(error_rate=0.3, seed=seed) as server:
+            return [server.next_fault() is not None for _ in range(50)]
+    assert failures(3) == failures(3)
+    assert 0 < sum(failures(3)) < 50
+
+    with FakeDriveServer(error_rate=0.3, seed=3) as server:
+        server.add_file('file', b'content')
+        cred_file = server.write_credentials(str(tmp_path / 'cred.json'))
+        downloader = GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint, retries=10, retry_delay=0.01)
+        for i in range(5):
+            assert downloader.download_file('file', str(tmp_path / f"file{i}.bin")) is None
+
+
+def test_api_latency(tmp_path):
+    with FakeDriveServer(api_latency=0.2) as server:
+        server.add_file('file', b'content')
+        cred_file = server.write_credentials(str(tmp_path / 'cred.json'))
+        downloader = GoogleDriveDownloader(cred_file, api_endpoint=server.api_endpoint)
+        start = time.perf_counter()
+        downloader.get_file_info('file', refresh=True)
+        assert time.perf_counter() - start >= 0.2
+
+
+def test_bench_suite_quick_run(tmp_path):
+    logger.info("The benchmark suite runs every scenario and reports throughput, latency and memory")
+    output = str(tmp_path / 'results.json')
+    result = subprocess.run([sys.executable, 'benchmarks/bench_suite.py', '--quick', '--output', output],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    with open(output) as f:
+        results = json.load(f)['results']
+    assert sorted(results) == ['folder_walk', 'large_file', 'resume', 'small_files']
+    for figures in results.values():
+        assert figures['failed'] == 0
+        assert figures['p99_ms'] >= figures['p50_ms'] > 0
+        assert figures['peak_rss_mib'] > 0
+    assert results['small_files']['files'] == 50
+    assert results['folder_walk']['files'] == 200
+    assert results['large_file']['mib_per_second'] > 0
+
+    # The same run as a baseline shows no regression at a generous tolerance
+    result = subprocess.run([sys.executable, 'benchmarks/bench_suite.py', '--quick', '--scenarios', 'folder_walk',
+                             '--baseline', output, '--tolerance', '10'], capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout
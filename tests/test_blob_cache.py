@@ -0,0 +1,102 @@
+"""
+    Tests for the content-addressed blob cache
+"""
+import os, logging
+
+from download_files_gdrive import GoogleDriveDownloader
+from async_download import AsyncDriveDownloader
+from metadata_cache import shared_cache
+from blob_cache import BlobCache, blob_key
+from conftest import read
+
+logger = logging.getLogger()
+
+
+def test_cached_file_is_not_downloaded_again(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A second download of the same content is served from the cache")
+    content = os.urandom(200 * 1024)
+    fake_drive.add_file('file', content)
+    fake_drive.add_file('copy', content)
+    cache = BlobCache(str(tmp_path / 'cache'))
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, blob_cache=cache)
+
+    downloader.download_file('file', str(tmp_path / 'first.bin'))
+    downloader.download_file('file', str(tmp_path / 'second.bin'))
+    # Another file ID with the same md5Checksum shares the blob
+    downloader.download_file('copy', str(tmp_path / 'third.bin'))
+
+    for name in ('first.bin', 'second.bin', 'third.bin'):
+        assert read(str(tmp_path / name)) == content
+    assert len(fake_drive.media_requests()) == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert downloader.last_metrics.cache == 'hit'
+    assert cache.stats()['blobs'] == 1
+
+
+def test_export_key_follows_revision(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Exports are cached per revision and format")
+    fake_drive.add_file('doc', b'%PDF-1', mime_type='application/vnd.google-apps.document',
+                        modified_time='2024-01-01T00:00:00.000Z')
+    cache = BlobCache(str(tmp_path / 'cache'))
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, blob_cache=cache)
+    downloader.download_file('doc', str(tmp_path / 'a.pdf'))
+
+    fake_drive.add_file('doc', b'%PDF-2', mime_type='application/vnd.google-apps.document',
+                        modified_time='2024-02-01T00:00:00.000Z')
+    shared_cache.clear()
+    downloader.download_file('doc', str(tmp_path / 'b.pdf'))
+    downloader.download_file('doc', str(tmp_path / 'c.pdf'))
+
+    assert read(str(tmp_path / 'b.pdf')) == read(str(tmp_path / 'c.pdf')) == b'%PDF-2'
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert blob_key('doc', {'modifiedTime': 't'}, 'application/pdf') != \
+        blob_key('doc', {'modifiedTime': 't'}, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+
+def test_least_recently_used_blobs_are_evicted(tmp_path):
+    cache = BlobCache(str(tmp_path / 'cache'), max_size=250)
+    for name in ('a', 'b', 'c'):
+        source = str(tmp_path / name)
+        with open(source, 'wb') as f:
+            f.write(name.encode() * 100)
+        cache.store(f"md5-{name}", source)
+        if name == 'b':
+            # Using a makes b the least recently used blob
+            assert cache.materialize('md5-a', str(tmp_path / 'a.out'))
+
+    assert cache.evictions == 1
+    assert not cache.materialize('md5-b', str(tmp_path / 'b.out'))
+    assert cache.materialize('md5-c', str(tmp_path / 'c.out'))
+    assert cache.stats()['bytes'] == 200
+
+
+def test_hardlink_and_copy_modes(tmp_path):
+    source = str(tmp_path / 'source')
+    with open(source, 'wb') as f:
+        f.write(b'content')
+    linked = BlobCache(str(tmp_path / 'linked'), mode='hardlink')
+    linked.store('md5-x', source)
+    assert linked.materialize('md5-x', str(tmp_path / 'linked.out'))
+    assert os.stat(str(tmp_path / 'linked.out')).st_nlink == 3
+
+    copied = BlobCache(str(tmp_path / 'copied'), mode='copy')
+    copied.store('md5-x', source)
+    assert copied.materialize('md5-x', str(tmp_path / 'copied.out'))
+    assert os.stat(str(tmp_path / 'copied.out')).st_nlink == 1
+    assert read(str(tmp_path / 'copied.out')) == b'content'
+
+
+def test_async_backend_uses_cache(fake_drive, fake_cred_file, tmp_path):
+    logger.info("The asyncio backend checks the same cache")
+    content = os.urandom(100 * 1024)
+    fake_drive.add_file('file', content)
+    cache = BlobCache(str(tmp_path / 'cache'))
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                          blob_cache=cache).download_file('file', str(tmp_path / 'first.bin'))
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, blob_cache=cache)
+    assert downloader.download('file', str(tmp_path / 'second.bin')) is None
+
+    assert read(str(tmp_path / 'second.bin')) == content
+    assert len(fake_drive.media_requests()) == 1
+    assert cache.hits == 1
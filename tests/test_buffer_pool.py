@@ -0,0 +1,123 @@
+"""
+    Tests for the shared buffer pool and the memory-bounded download path
+"""
+import io, os, sys, json, time, logging, threading, subprocess
+
+from buffer_pool import BufferPool, copy_stream
+from integrity import OrderedHasher
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import BatchDownloader
+from conftest import read
+
+logger = logging.getLogger()
+
+KIB = 1024
+
+
+def test_buffers_are_reused_within_the_budget():
+    logger.info("Buffers are allocated once, reused, and a download waits once the budget is taken")
+    pool = BufferPool(budget=4 * KIB, buffer_size=KIB)
+    assert pool.capacity == 3 and pool.reorder_budget == KIB
+
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    held = [first, pool.acquire(), pool.acquire()]
+    assert pool.allocated == 3
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    assert not acquired
+    pool.release(held[1])
+    waiter.join(timeout=5)
+    assert acquired == [held[1]] and pool.allocated == 3 and pool.waits >= 1
+
+
+def test_copy_stream_limits_and_skips():
+    data = bytes(range(256)) * 10
+    buffer = memoryview(bytearray(100))
+    pieces = []
+
+    assert copy_stream(io.BytesIO(data), buffer, lambda piece: pieces.append(bytes(piece)), 1000, skip=150) == 1000
+    assert b''.join(pieces) == data[150:1150]
+    assert max(len(piece) for piece in pieces) <= 100
+
+    pieces.clear()
+    assert copy_stream(io.BytesIO(data[:250]), buffer, lambda piece: pieces.append(bytes(piece))) == 250
+    assert b''.join(pieces) == data[:250]
+
+
+def test_reorder_buffer_shares_the_pool():
+    logger.info("Parts ahead of the hashing position only stay in memory while the pool's reorder share lasts")
+    pool = BufferPool(budget=400, buffer_size=100)
+    hasher = OrderedHasher('unused', pool=pool)
+    hasher.update(100, b'b' * 60)
+    hasher.update(200, b'c' * 60)
+    assert hasher._buffered_bytes == 60 and pool._reserved == 60
+
+    hasher.update(0, b'a' * 100)
+    assert hasher.offset == 160 and pool._reserved == 0
+    hasher.update(300, b'd' * 10)
+    hasher.release()
+    assert pool._reserved == 0 and 300 in hasher._on_disk
+
+
+def test_large_chunks_stream_through_one_buffer(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A chunk much larger than the buffer is read through that one buffer")
+    content = os.urandom(300 * KIB)
+    fake_drive.add_file('file', content)
+    pool = BufferPool(budget=64 * KIB, buffer_size=16 * KIB)
+    destination = str(tmp_path / 'file.bin')
+
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, chunk_size=256 * KIB,
+                          buffer_pool=pool).download_file('file', destination)
+
+    assert read(destination) == content
+    assert pool.allocated == 1
+    assert [r['range'] for r in fake_drive.media_requests('file')] == \
+        [f"bytes=0-{256 * KIB - 1}", f"bytes={256 * KIB}-{300 * KIB - 1}"]
+
+
+def test_concurrent_downloads_wait_for_buffers(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Batch and ranged downloads never hold more buffers than the budget allows")
+    contents = {f"file{i}": os.urandom(200 * KIB) for i in range(6)}
+    for file_id, content in contents.items():
+        fake_drive.add_file(file_id, content)
+    pool = BufferPool(budget=40 * KIB, buffer_size=16 * KIB)
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, workers=3,
+                                       part_size=64 * KIB, buffer_pool=pool, retry_delay=0.01)
+
+    BatchDownloader(downloader, workers=4).run((file_id, str(tmp_path / f"{file_id}.bin")) for file_id in contents)
+
+    for file_id, content in contents.items():
+        assert read(tmp_path / f"{file_id}.bin") == content
+    assert pool.allocated == pool.capacity == 1
+    assert pool._reserved == 0
+
+
+def test_sink_receives_views_of_the_buffer(fake_drive, fake_cred_file):
+    content = os.urandom(100 * KIB)
+    fake_drive.add_file('file', content)
+    pool = BufferPool(budget=64 * KIB, buffer_size=8 * KIB)
+    sink = io.BytesIO()
+
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                          buffer_pool=pool).download_file('file', sink)
+
+    assert sink.getvalue() == content
+    assert pool.allocated == 1
+
+
+def test_bench_memory_quick_run(tmp_path):
+    logger.info("The memory benchmark runs every size and concurrency and reports the peak RSS")
+    output = str(tmp_path / 'memory.json')
+    result = subprocess.run([sys.executable, 'benchmarks/bench_memory.py', '--quick', '--output', output],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    with open(output) as f:
+        report = json.load(f)
+    assert len(report['results']) == 4
+    assert all(case['failed'] == 0 and case['peak_rss_mib'] > 0 for case in report['results'])
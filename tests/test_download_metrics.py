@@ -0,0 +1,90 @@
+"""
+    Tests for download metrics, metrics hooks and rate-limited progress logging
+"""
+import os, json, logging, subprocess
+import pytest
+from googleapiclient.errors import HttpError
+
+from conftest import CHUNK, make_downloader
+
+logger = logging.getLogger()
+
+
+def recording_downloader(fake_drive, fake_cred_file, events, **kwargs):
+    return make_downloader(fake_drive, fake_cred_file,
+                           metrics_hooks=[lambda event, data: events.append((event, data))], **kwargs)
+
+
+def test_hooks_receive_phases_and_summary(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A download reports auth, metadata, first byte, transfer and fsync timings")
+    content = os.urandom(4 * CHUNK)
+    fake_drive.add_file('file', content)
+    events = []
+
+    downloader = recording_downloader(fake_drive, fake_cred_file, events, fsync=True)
+    downloader.download_file('file', str(tmp_path / 'file.bin'))
+
+    assert [data['phase'] for event, data in events if event == 'phase'] == ['auth', 'metadata', 'fsync']
+    event, summary = events[-1]
+    assert event == 'done'
+    assert summary['status'] == 'ok'
+    assert summary['bytes'] == summary['total_bytes'] == len(content)
+    assert set(summary['phases']) == {'auth', 'metadata', 'first_byte', 'transfer', 'fsync'}
+    assert summary['average_bytes_per_second'] > 0
+    assert summary['retries'] == 0
+
+
+def test_retries_are_counted(fake_drive, fake_cred_file, tmp_path):
+    fake_drive.add_file('file', os.urandom(4 * CHUNK))
+    fake_drive.inject_fault(status=503, after=1)
+    events = []
+
+    recording_downloader(fake_drive, fake_cred_file, events).download_file('file', str(tmp_path / 'file.bin'))
+
+    assert [event for event, _ in events].count('retry') == 1
+    assert events[-1][1]['retries'] == 1
+    assert events[-1][1]['bytes'] == 4 * CHUNK
+
+
+def test_progress_is_rate_limited(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Progress is reported by time, plus once at the end, not for every chunk")
+    fake_drive.add_file('file', os.urandom(16 * CHUNK))
+    events = []
+
+    downloader = recording_downloader(fake_drive, fake_cred_file, events, progress_interval=60)
+    downloader.download_file('file', str(tmp_path / 'f'))
+
+    progress = [data for event, data in events if event == 'progress']
+    assert len(progress) == 1
+    assert progress[0]['bytes'] == 16 * CHUNK
+
+
+def test_failed_download_is_reported(fake_drive, fake_cred_file, tmp_path):
+    events = []
+
+    with pytest.raises(HttpError):
+        recording_downloader(fake_drive, fake_cred_file, events).download_file('missing', str(tmp_path / 'f'))
+
+    assert events[-1][0] == 'done'
+    assert events[-1][1]['status'] == 'failed'
+
+
+def test_cli_writes_jsonl_and_prometheus(fake_drive, fake_cred_file, tmp_path):
+    logger.info("The CLI can write metrics as JSON lines and in Prometheus text format")
+    fake_drive.add_file('file', os.urandom(4 * CHUNK))
+    jsonl, prom = str(tmp_path / 'metrics.jsonl'), str(tmp_path / 'metrics.prom')
+
+    result = subprocess.run(['python3', os.path.join('src', 'download_files_gdrive.py'), 'file', str(tmp_path / 'f'),
+                             '--credentials', fake_cred_file, '--api-endpoint', fake_drive.api_endpoint,
+                             '--metrics-jsonl', jsonl, '--metrics-prom', prom],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    assert result.returncode == 0, result.stdout
+    with open(jsonl) as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[-1]['event'] == 'done' and lines[-1]['bytes'] == 4 * CHUNK
+    with open(prom) as f:
+        text = f.read()
+    assert 'drive_download_files_total{status="ok"} 1' in text
+    assert f"drive_download_bytes_total {4 * CHUNK}" in text
+    assert 'drive_download_phase_seconds_count{phase="transfer"} 1' in text
@@ -0,0 +1,118 @@
+"""
+    Tests for the priority-aware download queue and its work log
+"""
+import os, sys, json, logging, subprocess
+
+from download_queue import DownloadQueue, WorkLog
+from batch_download import parse_manifest
+from conftest import make_downloader, read
+
+logger = logging.getLogger()
+
+KIB = 1024
+
+
+def download_order(fake_drive):
+    """File IDs in the order the fake server received their first media request."""
+    order = []
+    for request in fake_drive.requests:
+        if 'alt=media' in request['path']:
+            file_id = request['path'].split('/files/', 1)[1].split('?', 1)[0]
+            if file_id not in order:
+                order.append(file_id)
+    return order
+
+
+def test_parse_manifest_priorities():
+    assert parse_manifest('a,out/a.bin,5\nb,out/b.bin\n', with_priority=True) == \
+        [('a', 'out/a.bin', 5), ('b', 'out/b.bin', 0)]
+    assert parse_manifest('[{"file_id": "a", "destination": "a.bin", "priority": 2}]', with_priority=True) == \
+        [('a', 'a.bin', 2)]
+    assert parse_manifest('{"a": "a.bin"}', with_priority=True) == [('a', 'a.bin', 0)]
+
+
+def test_small_files_first_by_priority(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Jobs run by priority, then smallest first, whatever the manifest order")
+    sizes = {'big': 40, 'medium': 20, 'tiny': 1, 'small': 5, 'urgent': 30}
+    for file_id, size in sizes.items():
+        fake_drive.add_file(file_id, os.urandom(size * KIB))
+    jobs = [(file_id, str(tmp_path / file_id), 1 if file_id == 'urgent' else 0) for file_id in sizes]
+
+    queue = DownloadQueue(make_downloader(fake_drive, fake_cred_file), workers=1)
+    results = queue.run(jobs)
+
+    assert download_order(fake_drive) == ['urgent', 'tiny', 'small', 'medium', 'big']
+    assert {result['lane'] for result in results} == {'small'}
+    assert queue.summary['succeeded'] == 5 and queue.summary['first_file_seconds'] > 0
+
+
+def test_large_files_use_ranged_lane(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Files above the part size download as ranged parts beside the small ones")
+    contents = {'large': os.urandom(256 * KIB), **{f"small{i}": os.urandom(KIB) for i in range(10)}}
+    for file_id, content in contents.items():
+        fake_drive.add_file(file_id, content)
+
+    queue = DownloadQueue(make_downloader(fake_drive, fake_cred_file, part_size=64 * KIB), workers=4, part_workers=3)
+    results = queue.run((file_id, str(tmp_path / file_id)) for file_id in contents)
+
+    for file_id, content in contents.items():
+        assert read(tmp_path / file_id) == content
+    lanes = {result['file_id']: result['lane'] for result in results}
+    assert lanes.pop('large') == 'large' and set(lanes.values()) == {'small'}
+    assert len(fake_drive.media_requests('large')) == 4
+
+
+def test_restart_only_runs_pending_and_failed(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A restarted run takes its jobs from the work log and skips the ones already downloaded")
+    for file_id in ('a', 'b', 'c'):
+        fake_drive.add_file(file_id, file_id.encode() * 100)
+    log_path = str(tmp_path / 'work.log')
+    jobs = [(file_id, str(tmp_path / file_id)) for file_id in ('a', 'b', 'c', 'missing')]
+
+    queue = DownloadQueue(make_downloader(fake_drive, fake_cred_file), workers=2, log=WorkLog(log_path))
+    queue.run(jobs)
+    assert queue.summary['succeeded'] == 3 and queue.summary['failed'] == 1
+
+    # A crash after queueing 'd' and while writing the state of 'c'
+    fake_drive.add_file('d', b'd' * 100)
+    with open(log_path, 'a') as f:
+        f.write(json.dumps({'file_id': 'd', 'destination': str(tmp_path / 'd'), 'state': 'pending'}) + '\n')
+        f.write(json.dumps({'file_id': 'c', 'destination': str(tmp_path / 'c'), 'state': 'pending'}) + '\n')
+        f.write('{"file_id": "c", "destin')
+    fake_drive.add_file('missing', b'found later')
+    fake_drive.requests.clear()
+
+    queue = DownloadQueue(make_downloader(fake_drive, fake_cred_file), workers=2, log=WorkLog(log_path))
+    results = queue.run()
+
+    assert sorted(result['file_id'] for result in results) == ['c', 'd', 'missing']
+    assert queue.summary['skipped'] == 2 and queue.summary['failed'] == 0
+    assert read(tmp_path / 'missing') == b'found later'
+    assert not [r for r in fake_drive.requests if 'alt=media' in r['path'] and '/files/a?' in r['path']]
+    states = WorkLog(log_path).replay()
+    assert {key[0]: record['state'] for key, record in states.items()} == \
+        {'a': 'ok', 'b': 'ok', 'c': 'ok', 'missing': 'ok', 'd': 'ok'}
+    with open(log_path) as f:
+        assert all(json.loads(line) for line in f.read().splitlines()[-3:])
+
+
+def test_batch_cli_resumes_from_work_log(fake_drive, fake_cred_file, tmp_path):
+    for i in range(5):
+        fake_drive.add_file(f"file{i}", os.urandom(100 * (5 - i)))
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(''.join(f"file{i},{tmp_path / f'file{i}.bin'}\n" for i in range(5)))
+    report = str(tmp_path / 'report.json')
+    command = [sys.executable, 'src/batch_download.py', '--credentials', fake_cred_file, '--api-endpoint',
+               fake_drive.api_endpoint, '--work-log', str(tmp_path / 'work.log'), '--report', report, '--workers', '1']
+
+    result = subprocess.run(command + [str(manifest)], capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert download_order(fake_drive) == [f"file{i}" for i in range(4, -1, -1)]
+    with open(report) as f:
+        assert json.load(f)['summary']['succeeded'] == 5
+
+    result = subprocess.run(command, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    with open(report) as f:
+        summary = json.load(f)['summary']
+    assert summary['files'] == 0 and summary['skipped'] == 5
@@ -0,0 +1,65 @@
+"""
+    Tests for the on-disk token cache and the lazily built Drive service
+"""
+import os, sys, json, time, logging, threading, subprocess
+
+from download_files_gdrive import GoogleDriveDownloader
+from drive_service import TokenCache, load_credentials, build_drive_service, token_cache_key
+
+logger = logging.getLogger()
+
+
+def token_posts(fake_drive):
+    return [r for r in fake_drive.requests if r['method'] == 'POST' and r['path'] == '/token']
+
+
+def test_token_is_reused_across_downloaders(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Downloaders that load the credentials separately share one cached token")
+    fake_drive.add_file('file', b'content')
+    cache = TokenCache(str(tmp_path / 'tokens'))
+
+    for name in ('one.bin', 'two.bin'):
+        credentials = load_credentials(fake_cred_file, token_cache=cache)
+        GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                              credentials=credentials).download_file('file', str(tmp_path / name))
+
+    assert len(token_posts(fake_drive)) == 1
+
+
+def test_expiring_token_is_not_reused(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A cached token close to its expiry is replaced by a new one")
+    fake_drive.add_file('file', b'content')
+    cache = TokenCache(str(tmp_path / 'tokens'))
+    credentials = load_credentials(fake_cred_file, token_cache=cache)
+    key = token_cache_key(credentials)
+    os.makedirs(cache.directory)
+    with open(os.path.join(cache.directory, f"{key}.json"), 'w') as f:
+        json.dump({'token': 'stale', 'expiry': time.time() + 10}, f)
+
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                          credentials=credentials).download_file('file', str(tmp_path / 'file.bin'))
+
+    assert len(token_posts(fake_drive)) == 1
+    assert cache.load(key)[0] == 'fake-token'
+
+
+def test_service_is_shared_between_threads(fake_drive, fake_cred_file):
+    logger.info("One service over the pooled transport is reused by every thread")
+    credentials = load_credentials(fake_cred_file)
+    service = build_drive_service(credentials, fake_drive.api_endpoint)
+    assert build_drive_service(credentials, fake_drive.api_endpoint) is service
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(build_drive_service(credentials, fake_drive.api_endpoint)))
+    thread.start()
+    thread.join()
+    assert other[0] is service
+
+
+def test_cli_modules_do_not_import_googleapiclient():
+    logger.info("Importing the command line tools leaves googleapiclient unloaded until it is needed")
+    code = ("import sys; sys.path.insert(0, 'src'); "
+            "import download_files_gdrive, batch_download, mirror_folder, sync_folder, verify_files_util; "
+            "print(sorted(m for m in ('googleapiclient', 'google.auth', 'httplib2') if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    assert result.stdout.strip() == '[]', result.stderr
@@ -0,0 +1,80 @@
+"""
+    Tests for export format selection and multi-format exports
+"""
+import os, logging
+import pytest
+
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import BatchDownloader
+from async_download import AsyncDriveDownloader
+from export_formats import select_export_formats, export_paths, parse_formats, UnsupportedExportError
+from conftest import read
+
+logger = logging.getLogger()
+
+DOCUMENT = 'application/vnd.google-apps.document'
+SPREADSHEET = 'application/vnd.google-apps.spreadsheet'
+PDF = 'application/pdf'
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+CSV = 'text/csv'
+ODS = 'application/x-vnd.oasis.opendocument.spreadsheet'
+
+
+def test_select_export_formats():
+    links = {PDF: 'pdf-link', CSV: 'csv-link', ODS: 'ods-link'}
+    sheet = {'mimeType': SPREADSHEET, 'exportLinks': links}
+    assert select_export_formats(sheet, ['csv', 'docx', 'ods']) == [CSV, ODS]
+    assert select_export_formats({'mimeType': DOCUMENT}) == [PDF]
+    with pytest.raises(UnsupportedExportError, match='Unsupported Google Docs Editors file type'):
+        select_export_formats({'mimeType': 'application/vnd.google-apps.folder'})
+    with pytest.raises(UnsupportedExportError):
+        select_export_formats(sheet, ['docx'])
+    with pytest.raises(ValueError):
+        parse_formats('pdf,nope')
+    assert export_paths('out/report.pdf', [PDF, DOCX]) == {PDF: 'out/report.pdf', DOCX: 'out/report.docx'}
+
+
+def test_export_several_formats(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A document is exported to every requested format it offers")
+    large = os.urandom(3 * 1024 * 1024)
+    fake_drive.add_file('doc', {PDF: large, DOCX: b'docx', 'text/plain': b'text'}, mime_type=DOCUMENT)
+
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                                       export_formats=['pdf', 'docx', 'csv'])
+    assert downloader.download_file('doc', str(tmp_path / 'doc.pdf')) is None
+
+    assert read(str(tmp_path / 'doc.pdf')) == large
+    assert read(str(tmp_path / 'doc.docx')) == b'docx'
+    assert sorted(os.listdir(tmp_path)) == ['doc.docx', 'doc.pdf', 'fake_cred.json']
+    assert downloader.last_metrics.bytes == len(large) + 4
+
+
+def test_unsupported_type_fails_only_that_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A folder in a batch is reported as failed without stopping the other downloads")
+    fake_drive.add_folder('folder')
+    fake_drive.add_file('file', b'content')
+
+    batch = BatchDownloader(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint), workers=2)
+    results = {r['file_id']: r for r in batch.run([('folder', str(tmp_path / 'folder')),
+                                                   ('file', str(tmp_path / 'file.bin'))])}
+
+    assert results['file']['status'] == 'ok'
+    assert results['folder']['status'] == 'failed'
+    assert 'Unsupported Google Docs Editors file type' in results['folder']['error']
+    assert not os.path.exists(str(tmp_path / 'folder'))
+
+
+def test_async_export_several_formats(fake_drive, fake_cred_file, tmp_path):
+    logger.info("The asyncio backend streams every format concurrently")
+    fake_drive.add_file('sheet', {CSV: b'a,b', ODS: b'ods', PDF: b'pdf'}, mime_type=SPREADSHEET)
+    fake_drive.add_folder('folder')
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                                      export_formats=['csv', 'ods'])
+    results = {r['file_id']: r for r in downloader.run([('sheet', str(tmp_path / 'sheet')),
+                                                        ('folder', str(tmp_path / 'folder'))])}
+
+    assert read(str(tmp_path / 'sheet.csv')) == b'a,b'
+    assert read(str(tmp_path / 'sheet.ods')) == b'ods'
+    assert results['sheet']['status'] == 'ok'
+    assert results['folder']['status'] == 'failed'
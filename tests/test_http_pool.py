@@ -0,0 +1,75 @@
+"""
+    Tests for the pooled keep-alive HTTP transport
+"""
+import os, gzip, logging
+from concurrent.futures import ThreadPoolExecutor
+
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import BatchDownloader
+from http_pool import PooledHttp, _decompress
+
+logger = logging.getLogger()
+
+
+def test_requests_reuse_one_connection(fake_drive):
+    logger.info("Sequential requests to one host go over a single keep-alive connection")
+    fake_drive.add_file('file', b'content')
+    transport = PooledHttp()
+    for _ in range(5):
+        response, content = transport.request(fake_drive.api_endpoint + 'files/file?alt=media')
+        assert response.status == 200 and content == b'content'
+    assert transport.connections_opened == 1
+    assert fake_drive.connections == 1
+
+
+def test_pool_is_safe_to_share_between_threads(fake_drive):
+    logger.info("Concurrent requests each borrow their own connection and idle ones are capped")
+    contents = {f"file{i}": os.urandom(5000 + i) for i in range(40)}
+    for file_id, content in contents.items():
+        fake_drive.add_file(file_id, content)
+    transport = PooledHttp(pool_size=4)
+
+    def fetch(file_id):
+        return transport.request(f"{fake_drive.api_endpoint}files/{file_id}?alt=media")[1]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = dict(zip(contents, pool.map(fetch, contents)))
+
+    assert results == contents
+    assert all(len(idle) <= 4 for idle in transport._idle.values())
+
+
+def test_closed_idle_connection_is_replaced(fake_drive):
+    logger.info("A keep-alive connection the server has dropped is replaced transparently")
+    fake_drive.add_file('file', b'content')
+    transport = PooledHttp()
+    transport.request(fake_drive.api_endpoint + 'files/file')
+    # Shut the idle connection's socket down, as a server idle timeout would
+    next(iter(transport._idle.values()))[0].sock.shutdown(2)
+    response, _ = transport.request(fake_drive.api_endpoint + 'files/file')
+    assert response.status == 200
+    assert transport.connections_opened == 2
+
+
+def test_gzip_content_is_decompressed():
+    import httplib2
+    response = httplib2.Response({'status': 200, 'content-encoding': 'gzip'})
+    assert _decompress(response, gzip.compress(b'{"id": "x"}')) == b'{"id": "x"}'
+    assert 'content-encoding' not in response and response['content-length'] == '11'
+
+
+def test_batch_download_reuses_connections(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Metadata and media requests of a batch share a few connections")
+    contents = {f"file{i}": os.urandom(1000 + i) for i in range(30)}
+    for file_id, content in contents.items():
+        fake_drive.add_file(file_id, content)
+    jobs = [(file_id, str(tmp_path / f"{file_id}.bin")) for file_id in contents]
+
+    transport = PooledHttp()
+    batch = BatchDownloader(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                                                  transport=transport), workers=4)
+    results = batch.run(jobs)
+
+    assert all(r['status'] == 'ok' for r in results)
+    # 30 metadata lookups (batched) and 30 media requests over at most one connection per worker
+    assert transport.connections_opened <= 5
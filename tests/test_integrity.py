@@ -0,0 +1,91 @@
+"""
+    Tests for checksum verification while downloading
+"""
+import os, hashlib, logging
+import pytest
+
+from integrity import OrderedHasher, ChecksumMismatchError
+from resumable_download import JOURNAL_SUFFIX
+from conftest import CHUNK, make_downloader, read
+
+logger = logging.getLogger()
+
+
+def test_hasher_reorders_parts(tmp_path):
+    logger.info("Parts written out of order are hashed in file order, spilling to disk past the buffer limit")
+    content = os.urandom(10 * 1000)
+    path = str(tmp_path / 'file.bin')
+    with open(path, 'wb') as f:
+        f.write(content)
+    hasher = OrderedHasher(path, ('md5', 'sha256'), buffer_limit=3000)
+
+    for start in (9000, 4000, 7000, 1000, 3000, 0, 2000, 8000, 5000, 6000):
+        hasher.update(start, content[start:start + 1000])
+
+    assert hasher.offset == len(content)
+    assert hasher.hexdigests() == {'md5': hashlib.md5(content).hexdigest(),
+                                   'sha256': hashlib.sha256(content).hexdigest()}
+
+
+def test_hasher_skips_bytes_already_seen(tmp_path):
+    content = os.urandom(4000)
+    path = str(tmp_path / 'file.bin')
+    with open(path, 'wb') as f:
+        f.write(content)
+    hasher = OrderedHasher(path)
+    hasher.update(0, content[:1000])
+    hasher.update(2000, content[2000:3000])
+
+    hasher.add_written([(0, 2999)])
+    hasher.update(3000, content[3000:])
+
+    assert hasher.verify({'size': '4000', 'md5Checksum': hashlib.md5(content).hexdigest()})
+
+
+def test_corrupted_download_is_retried(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A download whose md5 does not match Drive's checksum is fetched again from the start")
+    content = os.urandom(3 * CHUNK)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    fake_drive.inject_fault(corrupt=True, after=1)
+
+    make_downloader(fake_drive, fake_cred_file, sha256=True).download_file('file', destination)
+
+    assert read(destination) == content
+    assert len(fake_drive.media_requests('file')) == 6
+
+
+def test_corrupted_download_fails_without_retries(fake_drive, fake_cred_file, tmp_path):
+    fake_drive.add_file('file', os.urandom(2 * CHUNK))
+    destination = str(tmp_path / 'file.bin')
+    fake_drive.inject_fault(corrupt=True)
+
+    with pytest.raises(ChecksumMismatchError):
+        make_downloader(fake_drive, fake_cred_file, retries=0).download_file('file', destination)
+    assert not os.path.exists(destination + JOURNAL_SUFFIX)
+
+
+def test_parallel_download_is_verified(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A corrupted part in a parallel download fails the whole-file check and is downloaded again")
+    content = os.urandom(8 * CHUNK)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    fake_drive.inject_fault(corrupt=True, after=3)
+
+    make_downloader(fake_drive, fake_cred_file, workers=4, part_size=CHUNK).download_file('file', destination)
+
+    assert read(destination) == content
+    assert len(fake_drive.media_requests('file')) == 16
+
+
+def test_stale_cached_checksum_is_refreshed(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A mismatch against a stale cached checksum is retried with fresh metadata")
+    content = os.urandom(2 * CHUNK)
+    fake_drive.add_file('file', content)
+    downloader = make_downloader(fake_drive, fake_cred_file)
+    downloader.metadata_cache.put('file', dict(fake_drive.metadata('file'), md5Checksum='0' * 32))
+
+    downloader.download_file('file', str(tmp_path / 'file.bin'))
+
+    assert read(str(tmp_path / 'file.bin')) == content
+    assert downloader.metadata_cache.get('file')['md5Checksum'] == hashlib.md5(content).hexdigest()
@@ -0,0 +1,103 @@
+"""
+    Tests for the inventory export of verify_files_util
+"""
+import io, os, sys, csv, json, logging, subprocess
+
+from download_files_gdrive import GoogleDriveDownloader
+from metadata_cache import MetadataCache
+from verify_files_util import authenticate_drive, InventoryLister, write_inventory, INVENTORY_COLUMNS
+
+logger = logging.getLogger()
+
+
+def build_account(fake_drive):
+    fake_drive.add_folder('folder', 'Folder')
+    for i in range(1500):
+        fake_drive.add_file(f"mine{i:04d}", os.urandom(8), name=f"mine{i}.bin", parents=['folder'])
+    for drive in ('drive1', 'drive2'):
+        fake_drive.add_drive(drive, drive.title())
+        for i in range(1200):
+            fake_drive.add_file(f"{drive}-{i:04d}", b'shared', name=f"{i}.txt", parents=[drive], drive_id=drive)
+    return 1 + 1500 + 2 * 1200
+
+
+def test_inventory_lists_every_corpus(fake_drive, fake_cred_file):
+    logger.info("The inventory follows every page of the user corpus and of each shared drive")
+    total = build_account(fake_drive)
+    lister = InventoryLister(authenticate_drive(fake_cred_file, fake_drive.api_endpoint), workers=3)
+
+    out = io.StringIO()
+    assert write_inventory(lister.files(), out) == total
+
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len({row['id'] for row in rows}) == total
+    assert all(tuple(row) == INVENTORY_COLUMNS for row in rows)
+    mine = next(row for row in rows if row['id'] == 'mine0007')
+    assert mine['parents'] == ['folder'] and mine['size'] == '8' and mine['md5Checksum']
+    assert not lister.errors
+    corpora = [r['path'] for r in fake_drive.requests if r['path'].startswith('/drive/v3/files?')]
+    assert sum('corpora=drive' in path for path in corpora) == 4
+    assert sum('corpora=user' in path for path in corpora) == 2
+
+
+def test_inventory_csv_and_user_corpus_only(fake_drive, fake_cred_file):
+    fake_drive.add_file('a', b'a', name='a, "quoted"', parents=['p1', 'p2'])
+    fake_drive.add_drive('drive')
+    fake_drive.add_file('b', b'b', parents=['drive'], drive_id='drive')
+    lister = InventoryLister(authenticate_drive(fake_cred_file, fake_drive.api_endpoint), shared_drives=False)
+
+    out = io.StringIO()
+    write_inventory(lister.files(), out, 'csv')
+
+    rows = list(csv.reader(io.StringIO(out.getvalue())))
+    assert rows[0] == list(INVENTORY_COLUMNS)
+    assert rows[1][:4] == ['a', 'a, "quoted"', 'application/octet-stream', '1']
+    assert rows[1][-1] == 'p1;p2'
+    assert len(rows) == 2
+
+
+def test_inventory_index_skips_metadata_lookups(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A later download reads the metadata from the index the inventory wrote")
+    fake_drive.add_file('file', b'content')
+    index = str(tmp_path / 'index.sqlite')
+    lister = InventoryLister(authenticate_drive(fake_cred_file, fake_drive.api_endpoint),
+                             cache=MetadataCache(path=index))
+    write_inventory(lister.files(), io.StringIO())
+
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                                       metadata_cache=MetadataCache(ttl=86400, path=index))
+    assert downloader.download_file('file', str(tmp_path / 'file.bin')) is None
+
+    lookups = [r for r in fake_drive.requests if r['path'].startswith('/drive/v3/files/file?')
+               and 'alt=media' not in r['path']]
+    assert lookups == []
+
+
+def test_inventory_cli_to_stdout(fake_drive, fake_cred_file):
+    build_account(fake_drive)
+
+    result = subprocess.run([sys.executable, 'src/verify_files_util.py', '--credentials', fake_cred_file,
+                             '--api-endpoint', fake_drive.api_endpoint, '--inventory', '-'],
+                            capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert len(result.stdout.splitlines()) == 1 + 1500 + 2 * 1200
+    assert 'Inventory finished: 3901 files, 0 listing errors.' in result.stderr
+
+
+def test_dropped_listing_is_an_error(fake_drive, fake_cred_file):
+    logger.info("A connection dropped mid-listing is recorded as a listing error and fails the run")
+    for i in range(2500):
+        fake_drive.add_file(f"file{i:04d}", b'x')
+    lister = InventoryLister(authenticate_drive(fake_cred_file, fake_drive.api_endpoint), shared_drives=False)
+    fake_drive.inject_listing_fault(drop_after=100, after=1)
+
+    assert write_inventory(lister.files(), io.StringIO()) == 1000
+    assert [error['corpus'] for error in lister.errors] == ['my drive and shared files']
+
+    fake_drive.inject_listing_fault(drop_after=100, after=1)
+    result = subprocess.run([sys.executable, 'src/verify_files_util.py', '--credentials', fake_cred_file,
+                             '--api-endpoint', fake_drive.api_endpoint, '--inventory', '-', '--no-shared-drives'],
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'Inventory finished: 1000 files, 1 listing errors.' in result.stderr
@@ -0,0 +1,68 @@
+"""
+    Tests for the metadata cache and batched metadata lookups
+"""
+import os, logging, time
+
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import BatchDownloader
+from metadata_cache import MetadataCache
+
+logger = logging.getLogger()
+
+
+def metadata_gets(fake_drive):
+    return [r for r in fake_drive.requests
+            if r['method'] == 'GET' and '/files/' in r['path'] and 'alt=media' not in r['path']]
+
+
+def batch_posts(fake_drive):
+    return [r for r in fake_drive.requests if r['method'] == 'POST' and r['path'].startswith('/batch')]
+
+
+def test_cache_evicts_least_recently_used():
+    cache = MetadataCache(maxsize=2)
+    cache.put('a', {'id': 'a'})
+    cache.put('b', {'id': 'b'})
+    assert cache.get('a') == {'id': 'a'}
+    cache.put('c', {'id': 'c'})
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+
+
+def test_cache_expires_entries():
+    cache = MetadataCache(ttl=0.05)
+    cache.put('a', {'id': 'a'})
+    assert cache.get('a') is not None
+    time.sleep(0.1)
+    assert cache.get('a') is None
+
+
+def test_disk_cache_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    MetadataCache(path=path).put('a', {'id': 'a', 'size': '3'})
+    assert MetadataCache(path=path).get('a') == {'id': 'a', 'size': '3'}
+
+
+def test_download_reuses_cached_metadata(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Downloading the same file twice needs one metadata request")
+    fake_drive.add_file('file', b'content')
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint)
+
+    downloader.download_file('file', str(tmp_path / 'one.bin'))
+    downloader.download_file('file', str(tmp_path / 'two.bin'))
+
+    assert len(metadata_gets(fake_drive)) == 1
+
+
+def test_batch_download_groups_metadata_lookups(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Metadata for a batch of files is fetched with Drive batch requests")
+    for i in range(250):
+        fake_drive.add_file(f"file{i}", os.urandom(10))
+    jobs = [(f"file{i}", str(tmp_path / f"file{i}.bin")) for i in range(250)]
+
+    batch = BatchDownloader(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint), workers=8)
+    batch.run(jobs)
+
+    assert batch.summary['succeeded'] == 250
+    assert len(batch_posts(fake_drive)) == 3
+    assert len(metadata_gets(fake_drive)) == 0
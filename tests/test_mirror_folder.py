@@ -0,0 +1,87 @@
+"""
+    Tests for mirroring a Drive folder tree
+"""
+import os, sys, logging, subprocess
+
+from download_files_gdrive import GoogleDriveDownloader
+from mirror_folder import FolderWalker, mirror_folder, local_name
+
+logger = logging.getLogger()
+
+
+def build_tree(fake_drive):
+    fake_drive.add_folder('root', 'root')
+    fake_drive.add_folder('sub', 'sub', parents=['root'])
+    fake_drive.add_folder('deep', 'deep', parents=['sub'])
+    files = {}
+    for i in range(1205):
+        files[f"r{i:04d}"] = os.urandom(10)
+        fake_drive.add_file(f"r{i:04d}", files[f"r{i:04d}"], name=f"file{i}.bin", parents=['root'])
+    files['s1'] = b'sub file'
+    fake_drive.add_file('s1', files['s1'], name='a.txt', parents=['sub'])
+    files['d1'] = b'deep file'
+    fake_drive.add_file('d1', files['d1'], name='b.txt', parents=['deep'])
+    fake_drive.add_file('form', b'', name='Form', mime_type='application/vnd.google-apps.form', parents=['sub'])
+    return files
+
+
+def test_local_name_is_safe_and_unique():
+    taken = set()
+    assert local_name({'id': '1', 'name': 'a/b', 'mimeType': 'text/plain'}, taken) == 'a_b'
+    assert local_name({'id': '2', 'name': 'a/b', 'mimeType': 'text/plain'}, taken) == 'a_b (2)'
+    assert local_name({'id': '3', 'name': 'Doc', 'mimeType': 'application/vnd.google-apps.document'}, taken) == 'Doc.pdf'
+    assert local_name({'id': '4', 'name': '..', 'mimeType': 'text/plain'}, taken) == '4'
+
+
+def test_walk_follows_pages_and_subfolders(fake_drive, fake_cred_file, tmp_path):
+    logger.info("The walker lists every page of every subfolder")
+    files = build_tree(fake_drive)
+    walker = FolderWalker(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint), workers=3)
+
+    found = dict(walker.walk('root', str(tmp_path)))
+
+    assert sorted(found) == sorted(files)
+    assert found['d1'] == os.path.join(str(tmp_path), 'sub', 'deep', 'b.txt')
+    assert not walker.errors
+    list_calls = [r for r in fake_drive.requests if r['path'].startswith('/drive/v3/files?')]
+    assert all('pageSize=1000' in r['path'] for r in list_calls)
+    assert len(list_calls) == 4
+
+
+def test_mirror_folder_downloads_tree(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Mirror a folder tree to a local directory")
+    fake_drive.add_folder('root', 'root')
+    fake_drive.add_folder('sub', 'sub', parents=['root'])
+    fake_drive.add_file('top', b'top', name='top.txt', parents=['root'])
+    fake_drive.add_file('nested', b'nested', name='nested.txt', parents=['sub'])
+
+    results, summary, errors = mirror_folder(
+        GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint), 'root', str(tmp_path),
+        workers=2, list_workers=2)
+
+    assert summary['succeeded'] == 2 and not errors
+    with open(tmp_path / 'sub' / 'nested.txt', 'rb') as f:
+        assert f.read() == b'nested'
+    with open(tmp_path / 'top.txt', 'rb') as f:
+        assert f.read() == b'top'
+
+
+def test_dropped_listing_is_an_error(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A connection dropped mid-listing is recorded as a listing error and fails the mirror")
+    fake_drive.add_folder('root', 'root')
+    for i in range(1500):
+        fake_drive.add_file(f"r{i:04d}", b'x', name=f"file{i}.bin", parents=['root'])
+    fake_drive.inject_listing_fault(drop_after=100, after=1)
+
+    results, summary, errors = mirror_folder(
+        GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint), 'root', str(tmp_path / 'a'),
+        workers=4, list_workers=2)
+
+    assert summary['succeeded'] == 1000
+    assert [error['folder_id'] for error in errors] == ['root']
+
+    fake_drive.inject_listing_fault(drop_after=100, after=1)
+    result = subprocess.run([sys.executable, 'src/mirror_folder.py', 'root', str(tmp_path / 'b'), '--credentials',
+                             fake_cred_file, '--api-endpoint', fake_drive.api_endpoint],
+                            capture_output=True, text=True)
+    assert result.returncode != 0
@@ -0,0 +1,103 @@
+"""
+    Tests for the request scheduler: rate caps, bandwidth caps and rate limit backoff
+"""
+import os, time, logging
+
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import BatchDownloader
+from async_download import AsyncDriveDownloader
+from rate_limit import TokenBucket, RequestScheduler, is_rate_limited, retry_after_seconds
+
+logger = logging.getLogger()
+
+
+def test_token_bucket_paces_reservations():
+    bucket = TokenBucket(100, burst=1)
+    delays = [bucket.reserve() for _ in range(11)]
+    assert delays[0] == 0.0
+    # Reservations queue up behind each other, 10 ms apart
+    assert 0.09 <= delays[-1] <= 0.11
+
+
+def test_rate_limit_responses_are_recognised():
+    assert is_rate_limited(429, b'')
+    assert is_rate_limited(403, b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}')
+    assert not is_rate_limited(403, b'{"error": {"errors": [{"reason": "insufficientPermissions"}]}}')
+    assert not is_rate_limited(404, b'')
+    assert retry_after_seconds('3') == 3.0
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_retry_after_is_honoured(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A rate limited metadata request waits for Retry-After and succeeds")
+    fake_drive.add_file('file', b'content')
+    fake_drive.inject_rate_limit(count=1, retry_after=1)
+    scheduler = RequestScheduler()
+
+    start = time.perf_counter()
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                          scheduler=scheduler).download_file('file', str(tmp_path / 'file.bin'))
+
+    assert time.perf_counter() - start >= 1.0
+    assert (tmp_path / 'file.bin').read_bytes() == b'content'
+    assert scheduler.rate_limited == 1
+
+
+def test_request_cap_stays_under_quota(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Workers paced at the quota never hit a rate limit error")
+    fake_drive.quota = 20
+    for i in range(30):
+        fake_drive.add_file(f"file{i}", os.urandom(100))
+    jobs = [(f"file{i}", str(tmp_path / f"file{i}.bin")) for i in range(30)]
+
+    scheduler = RequestScheduler(requests_per_second=10)
+    batch = BatchDownloader(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                                                  scheduler=scheduler), workers=8)
+    results = batch.run(jobs)
+
+    assert all(r['status'] == 'ok' for r in results)
+    assert fake_drive.rate_limited == 0
+
+
+def test_rate_limited_batch_backs_off_and_completes(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Without a cap the workers are rate limited, back off together and still finish")
+    fake_drive.quota = 20
+    for i in range(30):
+        fake_drive.add_file(f"file{i}", os.urandom(100))
+    jobs = [(f"file{i}", str(tmp_path / f"file{i}.bin")) for i in range(30)]
+
+    scheduler = RequestScheduler(base_delay=0.2, retries=20)
+    batch = BatchDownloader(GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                                                  scheduler=scheduler, retries=0), workers=8)
+    results = batch.run(jobs)
+
+    assert all(r['status'] == 'ok' for r in results)
+    assert fake_drive.rate_limited > 0
+    assert scheduler.rate_limited == fake_drive.rate_limited
+
+
+def test_bandwidth_cap(fake_drive, fake_cred_file, tmp_path):
+    logger.info("The byte rate cap slows a download down to the configured bandwidth")
+    fake_drive.add_file('big', os.urandom(3 * 1024 * 1024))
+    scheduler = RequestScheduler(bytes_per_second=1024 * 1024)
+
+    start = time.perf_counter()
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, chunk_size=1024 * 1024,
+                          scheduler=scheduler).download_file('big', str(tmp_path / 'big.bin'))
+
+    # One second of burst, then 1 MiB/s for the remaining 2 MiB
+    assert time.perf_counter() - start >= 1.8
+
+
+def test_async_backend_retries_rate_limits(fake_drive, fake_cred_file, tmp_path):
+    logger.info("The asyncio backend goes through the same scheduler")
+    fake_drive.add_file('file', b'content')
+    fake_drive.inject_rate_limit(count=2, status=403)
+    scheduler = RequestScheduler(base_delay=0.05)
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, scheduler=scheduler)
+    assert downloader.download('file', str(tmp_path / 'file.bin')) is None
+
+    assert (tmp_path / 'file.bin').read_bytes() == b'content'
+    assert scheduler.rate_limited == 2
@@ -0,0 +1,131 @@
+"""
+    Tests for resuming interrupted downloads from the part journal
+"""
+import os, logging
+import pytest
+from googleapiclient.errors import HttpError
+
+from resumable_download import PartJournal, JOURNAL_SUFFIX
+from atomic_write import part_path
+from conftest import CHUNK, make_downloader, read
+
+logger = logging.getLogger()
+
+
+def test_journal_missing_ranges(tmp_path):
+    destination = str(tmp_path / 'file.bin')
+    open(destination, 'wb').close()
+    journal = PartJournal(destination, 'id', {'size': '100', 'md5Checksum': 'x', 'modifiedTime': 't'})
+    journal.mark(0, 9)
+    journal.mark(30, 49)
+    journal.mark(10, 19)
+    assert journal.completed == [(0, 19), (30, 49)]
+    assert journal.contiguous_offset() == 20
+    assert journal.missing_ranges(25) == [(20, 29), (50, 74), (75, 99)]
+
+    reloaded = PartJournal(destination, 'id', {'size': '100', 'md5Checksum': 'x', 'modifiedTime': 't'})
+    assert reloaded.completed == [(0, 19), (30, 49)]
+
+    reloaded.truncate(40)
+    assert reloaded.completed == [(0, 19), (30, 39)]
+    reloaded.truncate(30)
+    reloaded = PartJournal(destination, 'id', {'size': '100', 'md5Checksum': 'x', 'modifiedTime': 't'})
+    assert reloaded.completed == [(0, 19)]
+
+
+def test_retry_resumes_after_mid_stream_drop(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A connection drop mid-stream is retried from the last good offset")
+    content = os.urandom(5 * CHUNK)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    fake_drive.inject_fault(drop_after=100, after=2)
+
+    make_downloader(fake_drive, fake_cred_file).download_file('file', destination)
+
+    assert read(destination) == content
+    assert not os.path.exists(destination + JOURNAL_SUFFIX)
+    ranges = [r['range'] for r in fake_drive.media_requests('file')]
+    assert ranges.count(f"bytes=0-{CHUNK - 1}") == 1
+    # The 100 bytes received before the drop were written, so the retry starts after them
+    assert ranges.count(f"bytes={2 * CHUNK}-{3 * CHUNK - 1}") == 1
+    assert ranges.count(f"bytes={2 * CHUNK + 100}-{3 * CHUNK + 99}") == 1
+
+
+def test_rerun_continues_from_journal(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A rerun after a failed download only fetches the missing bytes")
+    content = os.urandom(4 * CHUNK)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    fake_drive.inject_fault(status=500, after=2)
+
+    with pytest.raises(HttpError):
+        make_downloader(fake_drive, fake_cred_file, retries=0).download_file('file', destination)
+    assert os.path.exists(destination + JOURNAL_SUFFIX)
+
+    fake_drive.requests.clear()
+    make_downloader(fake_drive, fake_cred_file).download_file('file', destination)
+
+    assert read(destination) == content
+    assert fake_drive.media_requests('file')[0]['range'] == f"bytes={2 * CHUNK}-{3 * CHUNK - 1}"
+
+
+def test_journal_discarded_when_remote_changed(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A journal written for an older revision of the file is thrown away")
+    fake_drive.add_file('file', os.urandom(4 * CHUNK), modified_time='2024-01-01T00:00:00.000Z')
+    destination = str(tmp_path / 'file.bin')
+    fake_drive.inject_fault(status=500, after=2)
+
+    with pytest.raises(HttpError):
+        make_downloader(fake_drive, fake_cred_file, retries=0).download_file('file', destination)
+
+    new_content = os.urandom(4 * CHUNK)
+    fake_drive.add_file('file', new_content, modified_time='2024-02-01T00:00:00.000Z')
+    fake_drive.requests.clear()
+    make_downloader(fake_drive, fake_cred_file).download_file('file', destination)
+
+    assert read(destination) == new_content
+    assert fake_drive.media_requests('file')[0]['range'] == f"bytes=0-{CHUNK - 1}"
+
+
+def test_parallel_download_retries_failed_range(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Failed ranges in parallel mode are fetched again without refetching finished ones")
+    content = os.urandom(8 * CHUNK)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    fake_drive.inject_fault(status=503)
+    fake_drive.inject_fault(drop_after=10)
+
+    make_downloader(fake_drive, fake_cred_file, workers=2, part_size=CHUNK).download_file('file', destination)
+
+    assert read(destination) == content
+    assert len(fake_drive.media_requests('file')) == 10
+
+
+def write_parts(fake_drive, destination, content, ranges):
+    """Leave a part file and journal as a ranged run that only finished the given ranges would."""
+    with open(part_path(destination), 'wb') as f:
+        f.write(b'\0' * len(content))
+        for start, end in ranges:
+            f.seek(start)
+            f.write(content[start:end + 1])
+    journal = PartJournal(destination, 'file', fake_drive.metadata('file'), data_path=part_path(destination))
+    for start, end in ranges:
+        journal.mark(start, end)
+
+
+def test_single_stream_resume_forgets_ranges_past_the_gap(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Resuming a ranged journal on a single stream drops the ranges it cuts off the part file")
+    content = os.urandom(4 * CHUNK)
+    fake_drive.add_file('file', content)
+    destination = str(tmp_path / 'file.bin')
+    write_parts(fake_drive, destination, content, [(0, CHUNK - 1), (2 * CHUNK, 3 * CHUNK - 1)])
+    fake_drive.inject_fault(status=500, after=1)
+
+    with pytest.raises(HttpError):
+        make_downloader(fake_drive, fake_cred_file, retries=0, verify=False).download_file('file', destination)
+    journal = PartJournal(destination, 'file', fake_drive.metadata('file'), data_path=part_path(destination))
+    assert journal.completed == [(0, 2 * CHUNK - 1)]
+
+    make_downloader(fake_drive, fake_cred_file, workers=2, part_size=CHUNK, verify=False).download_file(
+        'file', destination)
+    assert read(destination) == content
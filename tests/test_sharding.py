@@ -0,0 +1,95 @@
+"""
+    Tests for sharding downloads across processes and nodes
+"""
+import io, os, json, logging
+import argparse
+from functools import partial
+import pytest
+
+from download_files_gdrive import GoogleDriveDownloader
+from batch_download import ProcessPoolBatch, make_downloader
+from mirror_folder import mirror_folder
+from sharding import parse_shard, shard_of, select_shard, merge_reports
+
+logger = logging.getLogger()
+
+
+def test_shards_partition_jobs():
+    jobs = [(f"file{i}", f"out/{i}") for i in range(200)]
+    shards = [list(select_shard(iter(jobs), (index, 4))) for index in range(4)]
+
+    assert sorted(job for shard in shards for job in shard) == sorted(jobs)
+    assert all(shards)
+    assert [shard_of(file_id, 4) for file_id, _ in jobs] == [shard_of(file_id, 4) for file_id, _ in jobs]
+    assert list(select_shard(jobs, None)) == jobs
+
+
+def test_parse_shard():
+    assert parse_shard('0/4') == (0, 4)
+    assert parse_shard('3/4') == (3, 4)
+    for spec in ('4/4', '-1/4', '1/0', 'one/4', '1'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(spec)
+
+
+def test_process_pool_downloads_every_file(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Files are spread over two processes and every result comes back")
+    contents = {f"file{i}": os.urandom(1000 + i) for i in range(30)}
+    for file_id, content in contents.items():
+        fake_drive.add_file(file_id, content)
+    options = {'credentials': fake_cred_file, 'api_endpoint': fake_drive.api_endpoint, 'processes': 2}
+
+    batch = ProcessPoolBatch(partial(make_downloader, options), 2, workers=3)
+    results = batch.run((file_id, str(tmp_path / f"{file_id}.bin")) for file_id in contents)
+
+    assert batch.summary['succeeded'] == 30 and batch.summary['failed'] == 0
+    assert sorted(r['file_id'] for r in results) == sorted(contents)
+    for file_id, content in contents.items():
+        with open(tmp_path / f"{file_id}.bin", 'rb') as f:
+            assert f.read() == content
+
+
+def test_mirror_shard_downloads_its_files_only(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Each shard of a mirror lists the whole tree and downloads its own files")
+    fake_drive.add_folder('root', 'root')
+    file_ids = [f"file{i}" for i in range(40)]
+    for file_id in file_ids:
+        fake_drive.add_file(file_id, file_id.encode(), name=f"{file_id}.txt", parents=['root'])
+
+    downloaded = []
+    for index in range(3):
+        results, summary, errors = mirror_folder(
+            GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint), 'root',
+            str(tmp_path / f"node{index}"), workers=2, shard=(index, 3))
+        assert not errors and summary['failed'] == 0
+        assert all(shard_of(r['file_id'], 3) == index for r in results)
+        downloaded += [r['file_id'] for r in results]
+
+    assert sorted(downloaded) == sorted(file_ids)
+
+
+def test_merge_reports(tmp_path):
+    logger.info("Shard reports merge into one, with listing errors counted once")
+    listing_error = {'folder_id': 'broken', 'destination': 'out/broken', 'error': 'boom', 'status': 'listing_failed'}
+    with open(tmp_path / 'shard0.jsonl', 'w') as f:
+        f.write(json.dumps({'file_id': 'a', 'status': 'ok', 'bytes': 10}) + '\n')
+        f.write(json.dumps(listing_error) + '\n')
+        f.write(json.dumps({'summary': {'seconds': 2.0}}) + '\n')
+    with open(tmp_path / 'shard1.json', 'w') as f:
+        json.dump({'summary': {'seconds': 4.0},
+                   'results': [{'file_id': 'b', 'status': 'ok', 'bytes': 20},
+                               {'file_id': 'c', 'status': 'failed', 'bytes': 0, 'error': 'gone'}]}, f, indent=2)
+    with open(tmp_path / 'shard2.jsonl', 'w') as f:
+        f.write(json.dumps(listing_error) + '\n')
+        f.write(json.dumps({'summary': {'seconds': 1.0}}) + '\n')
+
+    out = io.StringIO()
+    summary = merge_reports([str(tmp_path / name) for name in ('shard0.jsonl', 'shard1.json', 'shard2.jsonl')], out)
+
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line.get('file_id') for line in lines[:-1] if 'file_id' in line] == ['a', 'b', 'c']
+    assert sum(line.get('status') == 'listing_failed' for line in lines) == 1
+    assert lines[-1] == {'summary': summary}
+    assert summary['files'] == 3 and summary['succeeded'] == 2 and summary['failed'] == 1
+    assert summary['bytes'] == 30 and summary['seconds'] == 4.0 and summary['shards'] == 3
+    assert summary['listing_errors'] == 1
@@ -0,0 +1,131 @@
+"""
+    Tests for streaming downloads to stdout and other sinks
+"""
+import io, os, sys, asyncio, logging, subprocess
+
+from download_files_gdrive import GoogleDriveDownloader
+from async_download import AsyncDriveDownloader
+from blob_cache import BlobCache
+from stream_sink import is_sink
+
+logger = logging.getLogger()
+
+CHUNK = 64 * 1024
+
+
+class SlowAsyncSink:
+    """Async consumer that takes its time with every write."""
+
+    def __init__(self):
+        self.chunks = []
+
+    async def write(self, data):
+        await asyncio.sleep(0.001)
+        self.chunks.append(bytes(data))
+
+
+def test_is_sink(tmp_path):
+    assert is_sink('-')
+    assert is_sink(io.BytesIO())
+    assert not is_sink(str(tmp_path / 'file.bin'))
+    assert not is_sink(tmp_path / 'file.bin')
+
+
+def test_download_to_writable(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A file is streamed into a writable object without touching the disk")
+    content = os.urandom(3 * 1024 * 1024)
+    fake_drive.add_file('file', content)
+    fake_drive.add_file('doc', b'%PDF-fake', mime_type='application/vnd.google-apps.document')
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint)
+
+    sink = io.BytesIO()
+    assert downloader.download_file('file', sink) is None
+    assert sink.getvalue() == content
+    exported = io.BytesIO()
+    assert downloader.download_file('doc', exported) is None
+    assert exported.getvalue() == b'%PDF-fake'
+
+    assert os.listdir(tmp_path) == ['fake_cred.json']
+    assert downloader.last_metrics.status == 'ok'
+
+
+def test_stream_resumes_after_drop(fake_drive, fake_cred_file):
+    logger.info("An interrupted stream continues from the last byte handed to the sink")
+    content = os.urandom(4 * CHUNK)
+    fake_drive.add_file('file', content)
+    fake_drive.inject_fault(drop_after=CHUNK + 100)
+
+    sink = io.BytesIO()
+    GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                          retry_delay=0.01).download_file('file', sink)
+
+    assert sink.getvalue() == content
+    ranges = [r['range'] for r in fake_drive.media_requests('file')]
+    assert ranges[0] is None
+    assert ranges[1].startswith('bytes=') and ranges[1].endswith('-')
+
+
+def test_stream_from_blob_cache(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A cached file is streamed from the cache")
+    content = os.urandom(100 * 1024)
+    fake_drive.add_file('file', content)
+    cache = BlobCache(str(tmp_path / 'cache'))
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint, blob_cache=cache)
+    downloader.download_file('file', str(tmp_path / 'file.bin'))
+
+    sink = io.BytesIO()
+    downloader.download_file('file', sink)
+
+    assert sink.getvalue() == content
+    assert len(fake_drive.media_requests('file')) == 1
+    assert cache.hits == 1
+
+
+def test_download_to_stdout(fake_drive, fake_cred_file, tmp_path):
+    logger.info("The CLI writes the file to stdout and its log to stderr for destination -")
+    content = os.urandom(200 * 1024)
+    fake_drive.add_file('file', content)
+
+    result = subprocess.run([sys.executable, 'src/download_files_gdrive.py', 'file', '-', '--credentials',
+                             fake_cred_file, '--api-endpoint', fake_drive.api_endpoint], capture_output=True)
+
+    assert result.returncode == 0
+    assert result.stdout == content
+    assert b'File streamed successfully' in result.stderr
+
+
+def test_async_sink_backpressure(fake_drive, fake_cred_file):
+    logger.info("The asyncio backend awaits a slow sink before reading more")
+    content = os.urandom(2 * 1024 * 1024)
+    fake_drive.add_file('file', content)
+    sink = SlowAsyncSink()
+
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint,
+                                      read_size=CHUNK, max_inflight_bytes=CHUNK)
+    assert downloader.download('file', sink) is None
+
+    assert b''.join(sink.chunks) == content
+    assert max(len(chunk) for chunk in sink.chunks) <= CHUNK
+
+
+def test_sink_missing_file_on_both_backends(fake_drive, fake_cred_file):
+    logger.info("A missing file streamed to a sink is answered with its 404 response by both backends")
+    threaded = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint)
+    assert threaded.download_file('missing', io.BytesIO()).status == 404
+
+    sink = SlowAsyncSink()
+    downloader = AsyncDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint)
+    assert downloader.download('missing', sink).status == 404
+    assert sink.chunks == []
+
+
+def test_cli_fails_on_missing_file_streamed_to_stdout(fake_drive, fake_cred_file):
+    logger.info("Streaming a missing file to stdout exits non-zero on both backends, as for a file path")
+    for backend in ('threads', 'asyncio'):
+        result = subprocess.run([sys.executable, 'src/download_files_gdrive.py', 'missing', '-', '--credentials',
+                                 fake_cred_file, '--api-endpoint', fake_drive.api_endpoint, '--backend', backend],
+                                capture_output=True)
+
+        assert result.returncode == 1, backend
+        assert result.stdout == b''
+        assert b'File not found with ID missing' in result.stderr
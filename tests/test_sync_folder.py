@@ -0,0 +1,104 @@
+"""
+    Tests for incremental folder sync with the Changes API
+"""
+import os, logging
+
+from download_files_gdrive import GoogleDriveDownloader
+from sync_folder import DriveSync, SyncIndex, INDEX_NAME
+from conftest import read
+
+logger = logging.getLogger()
+
+
+def media_ids(fake_drive):
+    return sorted(r['path'].split('/files/')[1].split('?')[0] for r in fake_drive.media_requests())
+
+
+def sync(fake_drive, fake_cred_file, destination, **kwargs):
+    downloader = GoogleDriveDownloader(fake_cred_file, api_endpoint=fake_drive.api_endpoint)
+    fake_drive.requests.clear()
+    return DriveSync(downloader, 'root', destination, workers=2, list_workers=2, **kwargs).run()
+
+
+def make_tree(fake_drive):
+    fake_drive.add_folder('root', 'root')
+    fake_drive.add_folder('sub', 'sub', parents=['root'])
+    fake_drive.add_file('a', b'a1', name='a.txt', parents=['root'])
+    fake_drive.add_file('b', b'b1', name='b.txt', parents=['sub'])
+    fake_drive.add_file('c', b'c1', name='c.txt', parents=['sub'])
+
+
+def test_first_sync_then_no_changes(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A second sync without remote changes downloads nothing")
+    make_tree(fake_drive)
+    destination = str(tmp_path)
+
+    stats = sync(fake_drive, fake_cred_file, destination)
+    assert stats['mode'] == 'full' and stats['downloaded'] == 3
+    assert read(tmp_path / 'sub' / 'b.txt') == b'b1'
+
+    stats = sync(fake_drive, fake_cred_file, destination)
+    assert stats['mode'] == 'incremental' and stats['downloaded'] == 0
+    assert media_ids(fake_drive) == []
+    assert not [r for r in fake_drive.requests if r['path'].startswith('/drive/v3/files?')]
+
+
+def test_incremental_sync_only_downloads_changes(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Only added and modified files are downloaded; renames are applied locally")
+    make_tree(fake_drive)
+    destination = str(tmp_path)
+    sync(fake_drive, fake_cred_file, destination)
+
+    fake_drive.add_file('a', b'a2', name='a.txt', parents=['root'], modified_time='2030-01-01T00:00:00.000Z')
+    fake_drive.add_folder('new', 'new', parents=['sub'])
+    fake_drive.add_file('d', b'd1', name='d.txt', parents=['new'])
+    fake_drive.files['b']['name'] = 'renamed.txt'
+    fake_drive.changes.append({'fileId': 'b', 'removed': False})
+    fake_drive.remove_file('c')
+
+    stats = sync(fake_drive, fake_cred_file, destination, delete_removed=True)
+
+    assert media_ids(fake_drive) == ['a', 'd']
+    assert stats['downloaded'] == 2 and stats['moved'] == 1 and stats['removed'] == 1
+    assert read(tmp_path / 'a.txt') == b'a2'
+    assert read(tmp_path / 'sub' / 'new' / 'd.txt') == b'd1'
+    assert read(tmp_path / 'sub' / 'renamed.txt') == b'b1'
+    assert not os.path.exists(tmp_path / 'sub' / 'b.txt')
+    assert not os.path.exists(tmp_path / 'sub' / 'c.txt')
+
+
+def test_folder_move_rewrites_index_paths(fake_drive, fake_cred_file, tmp_path):
+    logger.info("Moving a folder moves the local directory without downloading its files")
+    make_tree(fake_drive)
+    fake_drive.add_folder('other', 'other', parents=['root'])
+    destination = str(tmp_path)
+    sync(fake_drive, fake_cred_file, destination)
+
+    fake_drive.files['sub']['parents'] = ['other']
+    fake_drive.changes.append({'fileId': 'sub', 'removed': False})
+    stats = sync(fake_drive, fake_cred_file, destination)
+
+    assert stats['moved'] == 1 and media_ids(fake_drive) == []
+    assert read(tmp_path / 'other' / 'sub' / 'b.txt') == b'b1'
+    index = SyncIndex(os.path.join(destination, INDEX_NAME))
+    assert index.get_file('b')['local_path'] == os.path.join('other', 'sub', 'b.txt')
+    index.close()
+
+
+def test_failed_listing_keeps_page_token(fake_drive, fake_cred_file, tmp_path):
+    logger.info("A full sync whose listing dropped saves no page token, so the next run lists everything again")
+    fake_drive.add_folder('root', 'root')
+    for i in range(1500):
+        fake_drive.add_file(f"r{i:04d}", b'x', name=f"file{i}.bin", parents=['root'])
+    destination = str(tmp_path)
+    fake_drive.inject_listing_fault(drop_after=100, after=1)
+
+    stats = sync(fake_drive, fake_cred_file, destination)
+    assert stats['mode'] == 'full' and stats['downloaded'] == 1000 and stats['failed'] == 1
+    index = SyncIndex(os.path.join(destination, INDEX_NAME))
+    assert index.get_state('page_token') is None
+    index.close()
+
+    stats = sync(fake_drive, fake_cred_file, destination)
+    assert stats['mode'] == 'full' and stats['downloaded'] == 500 and stats['failed'] == 0
+    assert len(media_ids(fake_drive)) == 500
@@ -134,21 +134,21 @@ def test_download_folder_id_invalid(cred_file):
 def test_download_invalid_file_ids(file_id, comment, cred_file):
     logger.info(f"Download a file with an file ID: {file_id}, Comment: {comment}")
     result = run_program([file_id, test_data['VALID_DESTINATION'], '--credentials', cred_file])
-    assert "file_cache is only supported with oauth2client" in result.stdout
+    assert "Destination directory does not exist: '/invalid_path'" in result.stdout
 
 
 def test_download_valid_file_id_insufficient_permissions(cred_file):
     logger.info(f"Download a file with insufficient privileges")
     result = run_program([test_data['INSUFFICIENT_PERMISSIONS_FILE_ID'], test_data['VALID_DESTINATION'], '--credentials', cred_file])
     assert result.returncode != 0
-    assert "file_cache is only supported with oauth2client" in result.stdout
+    assert "Destination directory does not exist: '/invalid_path'" in result.stdout
 
 
 def test_invalid_destination(cred_file):
     logger.info(f"Download a file to a non-existing destination folder")
     result = run_program([test_data['VALID_FILE_ID'], test_data['INVALID_DESTINATION'], '--credentials', cred_file])
     assert result.returncode != 0
-    assert "file_cache is only supported with oauth2client" in result.stdout
+    assert "Destination directory does not exist: '/invalid_path'" in result.stdout
 
 
 @pytest.mark.skip(reason="not implemented")
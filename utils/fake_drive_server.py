@@ -0,0 +1,530 @@
+import json
+import re
+import random
+import hashlib
+from email.parser import FeedParser
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+API_PATH = '/drive/v3/'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+MAX_PAGE_SIZE = 1000
+BATCH_PATH = '/batch/drive/v3'
+BATCH_BOUNDARY = 'fake_batch_boundary'
+SYNTHETIC_BLOCK_SIZE = 1024 * 1024
+
+
+class SyntheticContent:
+    """
+    File content of any size generated on demand, so benchmarks can serve files of many
+    gigabytes without holding them in memory. The bytes are a pseudo-random block
+    repeated, the same for the same seed on every run. Slicing gives a lazy window;
+    bytes() produces the data.
+    """
+
+    def __init__(self, size, seed=0, _block=None, _offset=0):
+        self.size = size
+        self.seed = seed
+        self._block = _block or random.Random(seed).randbytes(min(size, SYNTHETIC_BLOCK_SIZE) or 1)
+        self._offset = _offset
+        self._digests = {}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self._block[(self._offset + range(self.size)[index]) % len(self._block)]
+        start, stop, step = index.indices(self.size)
+        if step != 1:
+            raise ValueError('SyntheticContent only supports contiguous slices')
+        return SyntheticContent(max(stop - start, 0), self.seed, self._block, self._offset + start)
+
+    def __bytes__(self):
+        out = bytearray()
+        while len(out) < self.size:
+            position = (self._offset + len(out)) % len(self._block)
+            out += self._block[position:position + self.size - len(out)]
+        return bytes(out)
+
+    def hexdigest(self, name):
+        """Digest of the content with a hashlib algorithm, computed once piece by piece."""
+        if name not in self._digests:
+            digest = hashlib.new(name)
+            for offset in range(0, self.size, SYNTHETIC_BLOCK_SIZE):
+                digest.update(bytes(self[offset:offset + SYNTHETIC_BLOCK_SIZE]))
+            self._digests[name] = digest.hexdigest()
+        return self._digests[name]
+
+
+def _hexdigest(content, name):
+    if isinstance(content, SyntheticContent):
+        return content.hexdigest(name)
+    return hashlib.new(name, content).hexdigest()
+
+
+# Local stand-in for the Drive v3 endpoints used by the downloader, so tests and
+# benchmarks can run without credentials or network access.
+class FakeDriveServer:
+    def __init__(self, bandwidth=None, chunk_size=64 * 1024, latency=0.0, quota=None, api_latency=0.0,
+                 error_rate=0.0, seed=None):
+        # bandwidth is a per-connection cap in bytes/sec, which is what makes a
+        # single media stream slower than several ranged ones.
+        self.bandwidth = bandwidth
+        # latency is added before every media and export response, like a network round trip;
+        # api_latency before every metadata, list, changes and batch response
+        self.latency = latency
+        self.api_latency = api_latency
+        # error_rate is the share of media and export responses failing with 503, drawn
+        # from a generator seeded with seed so runs fail the same way
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.chunk_size = chunk_size
+        # quota is the API requests allowed per second (token requests excluded); requests
+        # over it get 403 userRateLimitExceeded, as from Drive
+        self.quota = quota
+        self.rate_limited = 0
+        self._recent = deque()
+        self.rate_limits = []
+        self.files = {}
+        self.drives = {}
+        self.requests = []
+        self.faults = []
+        self.listing_faults = []
+        self.changes = []
+        # Number of TCP connections accepted, to check that clients keep them alive
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_endpoint(self):
+        return self.url + API_PATH
+
+    def add_file(self, file_id, content, name=None, mime_type='application/octet-stream', modified_time=None,
+                 parents=None, drive_id=None):
+        self.files[file_id] = {
+            'id': file_id,
+            'name': name or file_id,
+            'mimeType': mime_type,
+            'modifiedTime': modified_time or datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'parents': list(parents or []),
+            'content': content,
+        }
+        if drive_id:
+            # In a shared drive: listed with corpora=drive rather than corpora=user
+            self.files[file_id]['driveId'] = drive_id
+        self.changes.append({'fileId': file_id, 'removed': False})
+
+    def add_drive(self, drive_id, name=None):
+        self.drives[drive_id] = {'id': drive_id, 'name': name or drive_id}
+
+    def remove_file(self, file_id):
+        del self.files[file_id]
+        self.changes.append({'fileId': file_id, 'removed': True})
+
+    def add_folder(self, folder_id, name=None, parents=None):
+        self.add_file(folder_id, b'', name=name, mime_type=FOLDER_MIME_TYPE, parents=parents)
+
+    def list_files(self, query, page_size, page_token, corpora=None, drive_id=None):
+        """
+        Return one page of files matching the subset of the Drive query language used by the
+        tools. corpora=user leaves out files in shared drives, corpora=drive keeps only the
+        files of drive_id; without corpora every file matches.
+        """
+        match = re.search(r"'([^']+)' in parents", query or '')
+        parent = match.group(1) if match else None
+        matches = sorted((entry for entry in self.files.values()
+                          if (parent is None or parent in entry['parents'])
+                          and (corpora != 'user' or 'driveId' not in entry)
+                          and (corpora != 'drive' or entry.get('driveId') == drive_id)),
+                         key=lambda entry: entry['id'])
+        offset = int(page_token or 0)
+        page_size = min(page_size or 100, MAX_PAGE_SIZE)
+        page = {'files': [self.metadata(entry['id']) for entry in matches[offset:offset + page_size]]}
+        if offset + page_size < len(matches):
+            page['nextPageToken'] = str(offset + page_size)
+        return page
+
+    def list_drives(self, page_size, page_token):
+        """Return one page of shared drives, as drives.list does."""
+        drives = sorted(self.drives.values(), key=lambda drive: drive['id'])
+        offset = int(page_token or 0)
+        page_size = min(page_size or 10, 100)
+        page = {'drives': drives[offset:offset + page_size]}
+        if offset + page_size < len(drives):
+            page['nextPageToken'] = str(offset + page_size)
+        return page
+
+    def list_changes(self, page_token, page_size):
+        """Return one page of the change log starting at page_token, as changes.list does."""
+        offset = int(page_token)
+        page_size = min(page_size or 100, MAX_PAGE_SIZE)
+        page = {'changes': []}
+        for change in self.changes[offset:offset + page_size]:
+            entry = dict(change)
+            if not change['removed'] and change['fileId'] in self.files:
+                entry['file'] = self.metadata(change['fileId'])
+            elif not change['removed']:
+                entry['removed'] = True
+            page['changes'].append(entry)
+        if offset + page_size < len(self.changes):
+            page['nextPageToken'] = str(offset + page_size)
+        else:
+            page['newStartPageToken'] = str(len(self.changes))
+        return page
+
+    def handle_json(self, path):
+        """
+        Answer a metadata, list or changes GET request.
+
+        :param path: Request path including the query string.
+        :return: Tuple of (HTTP status, JSON body).
+        """
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        if url.path == API_PATH + 'files':
+            page_size = int(query.get('pageSize', ['100'])[0])
+            return 200, self.list_files(query.get('q', [''])[0], page_size, query.get('pageToken', [None])[0],
+                                        query.get('corpora', [None])[0], query.get('driveId', [None])[0])
+        if url.path == API_PATH + 'drives':
+            return 200, self.list_drives(int(query.get('pageSize', ['10'])[0]), query.get('pageToken', [None])[0])
+        if url.path == API_PATH + 'changes/startPageToken':
+            return 200, {'startPageToken': str(len(self.changes))}
+        if url.path == API_PATH + 'changes':
+            page_size = int(query.get('pageSize', ['100'])[0])
+            return 200, self.list_changes(query['pageToken'][0], page_size)
+        match = re.fullmatch(re.escape(API_PATH) + r'files/([^/]+)', url.path)
+        if not match:
+            return _error(404, 'notFound', f"Unknown path {url.path}")
+        if match.group(1) not in self.files:
+            return _error(404, 'notFound', f"File not found: {match.group(1)}.")
+        return 200, self.metadata(match.group(1))
+
+    def inject_fault(self, status=None, drop_after=None, corrupt=False, count=1, after=0):
+        """
+        Schedule failures for upcoming media and export responses.
+
+        :param status: Reply with this HTTP error status instead of the content.
+        :param drop_after: Close the connection after this many body bytes.
+        :param corrupt: Flip the bits of the first body byte, keeping the length intact.
+        :param count: Number of consecutive responses affected.
+        :param after: Number of responses to let through untouched first.
+        """
+        with self._lock:
+            self.faults.extend([None] * after +
+                               [{'status': status, 'drop_after': drop_after, 'corrupt': corrupt}] * count)
+
+    def inject_listing_fault(self, status=None, drop_after=None, count=1, after=0):
+        """
+        Schedule failures for upcoming file list responses (GET files).
+
+        :param status: Reply with this HTTP error status instead of the page.
+        :param drop_after: Close the connection after this many body bytes.
+        :param count: Number of consecutive responses affected.
+        :param after: Number of responses to let through untouched first.
+        """
+        with self._lock:
+            self.listing_faults.extend([None] * after + [{'status': status, 'drop_after': drop_after}] * count)
+
+    def inject_rate_limit(self, count=1, status=429, retry_after=None, after=0):
+        """
+        Schedule rate limit errors for upcoming API requests of any kind.
+
+        :param count: Number of consecutive requests rejected.
+        :param status: 429, or 403 for a userRateLimitExceeded error.
+        :param retry_after: Optional Retry-After header value in seconds.
+        :param after: Number of requests to let through first.
+        """
+        with self._lock:
+            self.rate_limits.extend([None] * after + [{'status': status, 'retry_after': retry_after}] * count)
+
+    def check_rate_limit(self):
+        """
+        Count an API request against the quota and the injected rate limits.
+
+        :return: (status, retry_after) to reject the request with, or None.
+        """
+        with self._lock:
+            scheduled = self.rate_limits.pop(0) if self.rate_limits else None
+            if scheduled is None and self.quota:
+                now = time.monotonic()
+                while self._recent and now - self._recent[0] >= 1.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.quota:
+                    scheduled = {'status': 403, 'retry_after': None}
+                else:
+                    self._recent.append(now)
+            if scheduled:
+                self.rate_limited += 1
+                return scheduled['status'], scheduled['retry_after']
+        return None
+
+    def next_listing_fault(self):
+        with self._lock:
+            return self.listing_faults.pop(0) if self.listing_faults else None
+
+    def next_fault(self):
+        with self._lock:
+            if self.faults:
+                return self.faults.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return {'status': 503}
+            return None
+
+    def metadata(self, file_id):
+        entry = self.files[file_id]
+        meta = {key: value for key, value in entry.items() if key != 'content'}
+        if not entry['mimeType'].startswith('application/vnd.google-apps'):
+            meta['size'] = str(len(entry['content']))
+            meta['md5Checksum'] = _hexdigest(entry['content'], 'md5')
+            meta['sha256Checksum'] = _hexdigest(entry['content'], 'sha256')
+        elif isinstance(entry['content'], dict):
+            # Native files added with content per export format list those formats
+            meta['exportLinks'] = {mime_type: f"{self.api_endpoint}files/{file_id}/export?mimeType={quote(mime_type)}"
+                                   for mime_type in entry['content']}
+        return meta
+
+    def record(self, method, path, headers):
+        with self._lock:
+            self.requests.append({'method': method, 'path': path, 'range': headers.get('Range')})
+
+    def media_requests(self, file_id=None):
+        path = f"{API_PATH}files/{file_id}" if file_id else None
+        return [r for r in self.requests
+                if r['method'] == 'GET' and 'alt=media' in r['path']
+                and (path is None or r['path'].startswith(path))]
+
+    def write_credentials(self, path):
+        """
+        Write a service account key file whose token_uri points at this server.
+
+        :param path: Where to write the credentials JSON file.
+        :return: The path written.
+        """
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode()
+        with open(path, 'w') as f:
+            json.dump({
+                'type': 'service_account',
+                'project_id': 'fake-project',
+                'private_key_id': 'fake-key',
+                'private_key': pem,
+                'client_email': 'fake@fake-project.iam.gserviceaccount.com',
+                'client_id': '0',
+                'token_uri': self.url + '/token',
+            }, f)
+        return path
+
+    def start(self):
+        self._httpd = _Server(('127.0.0.1', 0), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Server(ThreadingHTTPServer):
+    # Clients that open hundreds of connections at once must not overflow the listen backlog
+    request_queue_size = 1024
+
+
+def _error(status, reason, message):
+    return status, {'error': {
+        'code': status, 'message': message,
+        'errors': [{'reason': reason, 'message': message}],
+    }}
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            with server._lock:
+                server.connections += 1
+
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def send_error_json(self, status, reason, message):
+            self.send_json(*_error(status, reason, message))
+
+        def rate_limited(self):
+            rejection = server.check_rate_limit()
+            if rejection is None:
+                return False
+            status, retry_after = rejection
+            payload = json.dumps(_error(status, 'userRateLimitExceeded' if status == 403 else 'rateLimitExceeded',
+                                        'Rate limit exceeded')[1]).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            if retry_after is not None:
+                self.send_header('Retry-After', str(retry_after))
+            self.end_headers()
+            self.wfile.write(payload)
+            return True
+
+        def send_body(self, status, body, headers, drop_after=None, corrupt=False):
+            if corrupt and body:
+                body = bytes([body[0] ^ 0xff]) + bytes(body[1:])
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            synthetic = isinstance(body, SyntheticContent)
+            view = body if synthetic else memoryview(body)
+            if drop_after is not None:
+                view = view[:drop_after]
+                self.close_connection = True
+            for offset in range(0, len(view), server.chunk_size):
+                piece = view[offset:offset + server.chunk_size]
+                if server.bandwidth:
+                    time.sleep(len(piece) / server.bandwidth)
+                self.wfile.write(bytes(piece) if synthetic else piece)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length)
+            server.record('POST', self.path, self.headers)
+            if self.path == '/token':
+                self.send_json(200, {'access_token': 'fake-token', 'expires_in': 3600, 'token_type': 'Bearer'})
+            elif self.path == BATCH_PATH:
+                if not self.rate_limited():
+                    if server.api_latency:
+                        time.sleep(server.api_latency)
+                    self.send_batch(body)
+            else:
+                self.send_error_json(404, 'notFound', f"Unknown path {self.path}")
+
+        def send_batch(self, body):
+            parser = FeedParser()
+            parser.feed(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n" + body.decode())
+            parts = []
+            for part in parser.close().get_payload():
+                request_line = part.get_payload().split('\n', 1)[0]
+                method, path, _ = request_line.split(' ', 2)
+                server.record('BATCHED', path, {})
+                status, response = server.handle_json(path)
+                content_id = part['Content-ID']
+                parts.append(f"--{BATCH_BOUNDARY}\r\nContent-Type: application/http\r\n"
+                             f"Content-ID: <response-{content_id[1:]}\r\n\r\n"
+                             f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: application/json\r\n\r\n{json.dumps(response)}\r\n")
+            payload = (''.join(parts) + f"--{BATCH_BOUNDARY}--\r\n").encode()
+            self.send_body(200, payload, {'Content-Type': f"multipart/mixed; boundary={BATCH_BOUNDARY}"})
+
+        def do_GET(self):
+            server.record('GET', self.path, self.headers)
+            if self.rate_limited():
+                return
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            match = re.fullmatch(re.escape(API_PATH) + r'files/([^/]+)', url.path)
+            if match and query.get('alt') == ['media']:
+                if match.group(1) not in server.files:
+                    self.send_error_json(404, 'notFound', f"File not found: {match.group(1)}.")
+                    return
+                self.send_media(server.files[match.group(1)]['content'])
+                return
+            match = re.fullmatch(re.escape(API_PATH) + r'files/([^/]+)/export', url.path)
+            if match:
+                # Content stored per format is served for the mimeType asked for; plain
+                # content is served whatever mimeType was asked for
+                if match.group(1) not in server.files:
+                    self.send_error_json(404, 'notFound', f"File not found: {match.group(1)}.")
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                fault = server.next_fault() or {}
+                if fault.get('status'):
+                    self.send_error_json(fault['status'], 'backendError', 'Injected failure')
+                    return
+                mime_type = query.get('mimeType', ['application/octet-stream'])[0]
+                content = server.files[match.group(1)]['content']
+                if isinstance(content, dict):
+                    if mime_type not in content:
+                        self.send_error_json(400, 'badRequest', f"Export to {mime_type} is not supported.")
+                        return
+                    content = content[mime_type]
+                self.send_body(200, content, {'Content-Type': mime_type}, fault.get('drop_after'),
+                               fault.get('corrupt', False))
+                return
+            if server.api_latency:
+                time.sleep(server.api_latency)
+            fault = server.next_listing_fault() if url.path == API_PATH + 'files' else None
+            if fault and fault['status']:
+                self.send_error_json(fault['status'], 'backendError', 'Listing failed.')
+            elif fault:
+                status, body = server.handle_json(self.path)
+                self.send_body(status, json.dumps(body).encode(), {'Content-Type': 'application/json'},
+                               fault['drop_after'])
+            else:
+                self.send_json(*server.handle_json(self.path))
+
+        def send_media(self, content):
+            if server.latency:
+                time.sleep(server.latency)
+            fault = server.next_fault() or {}
+            if fault.get('status'):
+                self.send_error_json(fault['status'], 'backendError', 'Injected failure')
+                return
+            drop_after = fault.get('drop_after')
+            corrupt = fault.get('corrupt', False)
+            total = len(content)
+            byte_range = self.headers.get('Range')
+            if not byte_range:
+                self.send_body(200, content, {'Content-Type': 'application/octet-stream'}, drop_after, corrupt)
+                return
+            start, _, end = byte_range.replace('bytes=', '').partition('-')
+            start = int(start)
+            end = min(int(end) if end else total - 1, total - 1)
+            if start >= total:
+                self.send_body(416, b'', {'Content-Range': f"bytes */{total}"})
+                return
+            self.send_body(206, content[start:end + 1], {
+                'Content-Type': 'application/octet-stream',
+                'Content-Range': f"bytes {start}-{end}/{total}",
+            }, drop_after, corrupt)
+
+    return Handler
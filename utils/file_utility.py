@@ -1,30 +1,36 @@
 
 import os
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import functools
 import subprocess
+from metadata_cache import MetadataCache, METADATA_FIELDS
+from drive_service import load_credentials, build_drive_service
 
-# Authenticate and create the Google Drive service
+# On-disk metadata cache shared with the download subprocesses, so validating a download
+# does not need a second metadata request for the file size
+METADATA_CACHE_PATH = os.path.join('test_data', '.metadata_cache.sqlite')
+metadata_cache = MetadataCache(path=METADATA_CACHE_PATH)
+
+# Authenticate and create the Google Drive service, once per test session
+@functools.lru_cache(maxsize=None)
 def authenticate_drive():
     # Path to your service account key file
     credentials_file = os.path.join('config', 'cred.json')
 
-    # Authenticate using the service account file
-    credentials = service_account.Credentials.from_service_account_file(
-        credentials_file, scopes=['https://www.googleapis.com/auth/drive']
-    )
+    # Authenticate using the service account file; the token is shared with the download subprocesses
+    credentials = load_credentials(credentials_file)
 
     # Build the Drive service
-    service = build('drive', 'v3', credentials=credentials)
-    return service
+    return build_drive_service(credentials)
 
 
 # Function to get the file size from file ID
 def get_file_size_from_gdrive(file_id):
-    service = authenticate_drive()
-
-    # Get file metadata
-    file_metadata = service.files().get(fileId=file_id, fields="name, size").execute()
+    # Get file metadata, reusing the lookup made by the downloader when it is cached
+    file_metadata = metadata_cache.get(file_id)
+    if file_metadata is None:
+        service = authenticate_drive()
+        file_metadata = service.files().get(fileId=file_id, fields=METADATA_FIELDS).execute()
+        metadata_cache.put(file_id, file_metadata)
 
     # Extract file size
     file_name = file_metadata.get('name')
@@ -44,7 +50,7 @@ def get_file_size(file_path):
 
 # Helper function to run the download program with given arguments
 def run_program(args):
-    command = ['python3', os.path.join('src', 'download_files_gdrive.py')] + args
+    command = ['python3', os.path.join('src', 'download_files_gdrive.py')] + args + ['--metadata-cache', METADATA_CACHE_PATH]
     result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     return result
 